@@ -11,7 +11,7 @@ import time
 logger = logging.getLogger(__name__)
 
 
-async def bootstrap_mbr_node(client, ctlr_id, node_id, deque, ex=False):
+async def bootstrap_mbr_node(client, ctlr_id, node_id, deque, ex=None):
     """
     Wrapper for bootstrapping a new member node; adds one network for
     each node and adds each node to its (new) network.  Updates net/id
@@ -23,17 +23,21 @@ async def bootstrap_mbr_node(client, ctlr_id, node_id, deque, ex=False):
     :param ctlr_id: node ID of controller node
     :param node_id: node ID
     :param deque: netobj queue
-    :param ex: True if node is an exit node
+    :param ex: True if node is an exit node (default is is_exit_node())
     """
     from node_tools import ctlr_data as ct
 
     from node_tools.ctlr_funcs import get_network_id
     from node_tools.ctlr_funcs import handle_net_cfg
+    from node_tools.ctlr_funcs import is_exit_node
+    from node_tools.ctlr_funcs import release_net_cfg
     from node_tools.ctlr_funcs import set_network_cfg
-    from node_tools.trie_funcs import find_dangling_nets
     from node_tools.trie_funcs import get_dangling_net_data
     from node_tools.trie_funcs import update_id_trie
 
+    if ex is None:
+        ex = is_exit_node(node_id)
+
     await add_network_object(client, ctlr_id=ctlr_id)
     net_id = get_network_id(client.data)
     logger.debug('BOOTSTRAP: added network id {}'.format(net_id))
@@ -59,32 +63,36 @@ async def bootstrap_mbr_node(client, ctlr_id, node_id, deque, ex=False):
         logger.debug('BOOTSTRAP: got node data {}'.format(client.data))
 
         ipnet, _, gw = handle_net_cfg(deque)
-        await config_network_object(client, ipnet, net_id)
-
-        # A dedicated exit node is a special case, otherwise, each new node
-        # gets a src_net here, and still *needs* a exit_net.  We also need to
-        # update the src net needs after linking the next mbr node.
-        if not ex:
-            data_list = find_dangling_nets(ct.id_trie)
-            logger.debug('BOOTSTRAP: got exit net {}'.format(data_list))
-            if len(data_list) == 2:
-                exit_net = data_list[0]
-                exit_node = data_list[1]
-                await add_network_object(client, exit_net, node_id)
-                logger.debug('BOOTSTRAP: added node id {} to exit net {}'.format(node_id, exit_net))
-                netcfg = get_dangling_net_data(ct.net_trie, exit_net)
-                gw_cfg = set_network_cfg(netcfg.host)
-                logger.debug('BOOTSTRAP: got node addr {} for exit net'.format(gw_cfg))
-                await config_network_object(client, gw_cfg, exit_net, node_id)
-                trie_nets = [net_id, exit_net]
-            else:
-                logger.error('BOOTSTRAP: malformed exit net data {}'.format(data_list))
-
-        await config_network_object(client, gw, net_id, node_id)
-        logger.debug('BOOTSTRAP: set gw addr {} for src net {}'.format(gw, net_id))
-
-        await update_mbr_data(client, ct.net_trie, net_id, node_id)
-        logger.debug('BOOTSTRAP: loaded net trie with {} and {} data'.format(node_id, net_id))
+        try:
+            await config_network_object(client, ipnet, net_id)
+
+            # A dedicated exit node is a special case, otherwise, each new node
+            # gets a src_net here, and still *needs* a exit_net.  We also need to
+            # update the src net needs after linking the next mbr node.
+            if not ex:
+                data_list = ct.store.dangling_net()
+                logger.debug('BOOTSTRAP: got exit net {}'.format(data_list))
+                if len(data_list) == 2:
+                    exit_net = data_list[0]
+                    exit_node = data_list[1]
+                    await add_network_object(client, exit_net, node_id)
+                    logger.debug('BOOTSTRAP: added node id {} to exit net {}'.format(node_id, exit_net))
+                    netcfg = get_dangling_net_data(ct.net_trie, exit_net)
+                    gw_cfg = set_network_cfg(netcfg.host)
+                    logger.debug('BOOTSTRAP: got node addr {} for exit net'.format(gw_cfg))
+                    await config_network_object(client, gw_cfg, exit_net, node_id)
+                    trie_nets = [net_id, exit_net]
+                else:
+                    logger.error('BOOTSTRAP: malformed exit net data {}'.format(data_list))
+
+            await config_network_object(client, gw, net_id, node_id)
+            logger.debug('BOOTSTRAP: set gw addr {} for src net {}'.format(gw, net_id))
+
+            await update_mbr_data(client, ct.net_trie, net_id, node_id)
+            logger.debug('BOOTSTRAP: loaded net trie with {} and {} data'.format(node_id, net_id))
+        except Exception:
+            release_net_cfg(deque, ipnet)
+            raise
 
         node_needs = [False, False]
         net_needs = [False, True]
@@ -93,9 +101,84 @@ async def bootstrap_mbr_node(client, ctlr_id, node_id, deque, ex=False):
 
         update_id_trie(ct.id_trie, trie_nets, [node_id], needs=node_needs)
         update_id_trie(ct.id_trie, [net_id], [node_id], needs=net_needs, nw=True)
+
+        ct.ring.add_node(node_id, net_id)
+        if not ex and len(trie_nets) == 2:
+            ct.ring.link(node_id, exit_net, exit_node)
         # logger.debug('TRIE: id_trie has items: {}'.format(ct.id_trie.items()))
 
 
+async def bootstrap_mbr_nodes(client, ctlr_id, node_list, deque, max_requests=8):
+    """
+    Wrapper for bootstrapping a batch of new member nodes in two steps;
+    first reserve a netobj subnet for each node and create all the new
+    networks concurrently, then link the new networks into the chain
+    (in `node_list` order) and update net/id tries with new data.
+    :notes: this is the batch version of bootstrap_mbr_node() so the
+            same caveats apply; nodes that fail in either step are
+            skipped (their new network is removed, the subnet is
+            released, and they stay in the staging queue) without
+            aborting the rest of the batch.
+    :param client: ztcli_api client object
+    :param ctlr_id: node ID of controller node
+    :param node_list: list of node IDs
+    :param deque: netobj queue
+    :param max_requests: max number of API requests in flight
+    :return: tuple of per-node latency dict and batch latency (seconds)
+    """
+    from node_tools import ctlr_data as ct
+
+    from node_tools.ctlr_funcs import handle_net_cfg
+    from node_tools.ctlr_funcs import is_exit_node
+    from node_tools.ctlr_funcs import release_net_cfg
+    from node_tools.timing_funcs import monoclock
+    from node_tools.trie_funcs import update_id_trie
+
+    node_times = {}
+    start = monoclock()
+    sem = asyncio.Semaphore(max(1, max_requests))
+
+    netcfgs = [handle_net_cfg(deque) for _ in node_list]
+    results = await asyncio.gather(
+        *[create_mbr_net(client, sem, ctlr_id, node_id, netcfg)
+          for node_id, netcfg in zip(node_list, netcfgs)],
+        return_exceptions=True)
+    elapsed = monoclock() - start
+    logger.debug('BOOTSTRAP: created {} networks in {:.3f} sec'.format(len(results), elapsed))
+
+    for node_id, net_id, netcfg in zip(node_list, results, netcfgs):
+        if isinstance(net_id, Exception):
+            logger.error('BOOTSTRAP: node {} failed with {}'.format(node_id, net_id))
+            release_net_cfg(deque, netcfg[0])
+            continue
+
+        try:
+            exit_net, exit_node = await link_mbr_net(client, node_id, net_id,
+                                                     ex=is_exit_node(node_id))
+        except Exception as exc:
+            logger.error('BOOTSTRAP: node {} link failed with {}'.format(node_id, exc))
+            await cleanup_mbr_net(client, net_id)
+            release_net_cfg(deque, netcfg[0])
+            continue
+
+        trie_nets = [net_id]
+        if exit_net is not None:
+            trie_nets = [net_id, exit_net]
+            update_id_trie(ct.id_trie, [exit_net], [node_id, exit_node], needs=[False, False], nw=True)
+        update_id_trie(ct.id_trie, trie_nets, [node_id], needs=[False, False])
+        update_id_trie(ct.id_trie, [net_id], [node_id], needs=[False, True], nw=True)
+        ct.ring.add_node(node_id, net_id)
+        if exit_net is not None:
+            ct.ring.link(node_id, exit_net, exit_node)
+        node_times[node_id] = monoclock() - start
+        logger.debug('BOOTSTRAP: node {} linked in {:.3f} sec'.format(node_id, node_times[node_id]))
+
+    batch_time = monoclock() - start
+    num_nodes = len(node_times)
+    logger.info('BOOTSTRAP: {} of {} nodes linked in {:.3f} sec'.format(num_nodes, len(node_list), batch_time))
+    return node_times, batch_time
+
+
 async def close_mbr_net(client, node_lst, boot_lst, min_nodes=5):
     """
     Wrapper for closing the bootstrap chain or adding it to an existing
@@ -111,17 +194,15 @@ async def close_mbr_net(client, node_lst, boot_lst, min_nodes=5):
 
     from node_tools.ctlr_funcs import unset_network_cfg
     from node_tools.network_funcs import publish_cfg_msg
+    from node_tools.topology_funcs import get_ring_neighbors
     from node_tools.trie_funcs import cleanup_state_tries
-    from node_tools.trie_funcs import find_dangling_nets
-    from node_tools.trie_funcs import find_exit_net
-    from node_tools.trie_funcs import get_neighbor_ids
     from node_tools.trie_funcs import get_target_node_id
 
     head_id = boot_lst[-1]
     tail_id = boot_lst[0]
-    head_exit_net = find_exit_net(ct.id_trie)[0]
-    head_src_net, _, _, _ = get_neighbor_ids(ct.net_trie, head_id)
-    tail_exit_net = find_dangling_nets(ct.id_trie)[0]
+    head_exit_net = ct.store.exit_net()[0]
+    head_src_net, _, _, _ = get_ring_neighbors(ct.ring, ct.net_trie, head_id)
+    tail_exit_net = ct.store.dangling_net()[0]
     deauth = unset_network_cfg()
 
     # if true, we only have a boot list
@@ -134,6 +215,7 @@ async def close_mbr_net(client, node_lst, boot_lst, min_nodes=5):
             # detach and connect head to tail
             await config_network_object(client, deauth, head_exit_net, head_id)
             cleanup_state_tries(ct.net_trie, ct.id_trie, head_exit_net, head_id, mbr_only=True)
+            ct.ring.unlink(head_id)
             logger.debug('CLOSURE: deauthed head id {} from exit net {}'.format(head_id, head_exit_net))
 
             await connect_mbr_node(client, head_id, head_src_net, tail_exit_net, tail_id)
@@ -143,14 +225,15 @@ async def close_mbr_net(client, node_lst, boot_lst, min_nodes=5):
     else:
         logger.debug('CLOSURE: adding bootstrap list {} to network'.format(boot_lst))
         tgt_id = get_target_node_id(node_lst, boot_lst)
-        tgt_net, tgt_exit_net, tgt_src_node, tgt_exit_node = get_neighbor_ids(ct.net_trie, tgt_id)
-        tgt_src_net, _, _, _ = get_neighbor_ids(ct.net_trie, tgt_src_node)
+        tgt_net, tgt_exit_net, tgt_src_node, tgt_exit_node = get_ring_neighbors(ct.ring, ct.net_trie, tgt_id)
+        tgt_src_net, _, _, _ = get_ring_neighbors(ct.ring, ct.net_trie, tgt_src_node)
 
         for mbr_id in [tgt_id, tail_id, head_id, tgt_exit_node]:
             st.wait_cache.set(mbr_id, True, 120)
         # detach and connect tgt to tail
         await config_network_object(client, deauth, tgt_exit_net, tgt_id)
         cleanup_state_tries(ct.net_trie, ct.id_trie, tgt_exit_net, tgt_id, mbr_only=True)
+        ct.ring.unlink(tgt_id)
         logger.debug('CLOSURE: deauthed tgt id {} from tgt exit net {}'.format(tgt_id, tgt_exit_net))
 
         await connect_mbr_node(client, tgt_id, tgt_src_net, tail_exit_net, tail_id)
@@ -159,6 +242,7 @@ async def close_mbr_net(client, node_lst, boot_lst, min_nodes=5):
         # detach and connect head to tgt exit net
         await config_network_object(client, deauth, head_exit_net, head_id)
         cleanup_state_tries(ct.net_trie, ct.id_trie, head_exit_net, head_id, mbr_only=True)
+        ct.ring.unlink(head_id)
         logger.debug('CLOSURE: deauthed node id {} from head exit net {}'.format(head_id, head_exit_net))
 
         await connect_mbr_node(client, head_id, head_src_net, tgt_exit_net, tgt_exit_node)
@@ -166,6 +250,31 @@ async def close_mbr_net(client, node_lst, boot_lst, min_nodes=5):
         publish_cfg_msg(ct.id_trie, head_id, addr='127.0.0.1')
 
 
+async def cleanup_mbr_net(client, net_id, mbr_id=None):
+    """
+    Wrapper for removing a partially configured network (or member)
+    after a failed bootstrap step; deletes the ZT object and any net
+    trie data loaded for it.  Errors are logged, not raised.
+    :param client: ztcli_api client object
+    :param net_id: network ID
+    :param mbr_id: member node ID (only delete the member)
+    """
+    from node_tools import ctlr_data as ct
+
+    try:
+        await delete_network_object(client, net_id, mbr_id)
+    except Exception as exc:
+        logger.error('BOOTSTRAP: cleanup of {} {} failed with {}'.format(net_id, mbr_id, exc))
+
+    if mbr_id:
+        keys = [net_id + mbr_id] if net_id + mbr_id in ct.net_trie else []
+    else:
+        keys = list(ct.net_trie.keys(net_id))
+    for key in keys:
+        del ct.net_trie[key]
+    logger.debug('BOOTSTRAP: removed {} {} ({} trie keys)'.format(net_id, mbr_id, len(keys)))
+
+
 async def cleanup_orphans(client):
     """
     Simple cleanup function to run after node juggling and before the
@@ -190,10 +299,12 @@ async def cleanup_orphans(client):
                 if st.wait_cache.get(thing[1]) is None:
                     await delete_network_object(client, thing[0])
                     cleanup_state_tries(ct.net_trie, ct.id_trie, thing[0], thing[1])
+                    ct.ring.remove(thing[1])
                     logger.warning('CLEANUP: removed orphan: {}'.format(thing))
     if node_list:
         for thing in node_list:
             del ct.id_trie[thing]
+            ct.ring.remove(thing)
             logger.warning('CLEANUP: removed orphan: {}'.format(thing))
 
 
@@ -225,6 +336,87 @@ async def connect_mbr_node(client, node_id, src_net, exit_net, gw_node):
 
     update_id_trie(ct.id_trie, [exit_net], [node_id, gw_node], needs=[False, False], nw=True)
     update_id_trie(ct.id_trie, [src_net, exit_net], [node_id], needs=[False, False])
+    ct.ring.add_node(node_id, src_net)
+    ct.ring.link(node_id, exit_net, gw_node)
+
+
+async def create_mbr_net(client, sem, ctlr_id, node_id, netcfg):
+    """
+    Wrapper for creating and configuring a new (src) network for a new
+    member node, then adding the node as the network gateway.  Uses a
+    shallow copy of the client so it can run concurrently.  If any of
+    the config steps fail the new network is deleted before re-raising.
+    :param client: ztcli_api client object
+    :param sem: asyncio.Semaphore limiting concurrent node setups
+    :param ctlr_id: node ID of controller node
+    :param node_id: node ID
+    :param netcfg: tuple of cfg fragments from handle_net_cfg()
+    :return: <str> new network ID
+    """
+    import copy
+
+    from node_tools import ctlr_data as ct
+    from node_tools.ctlr_funcs import get_network_id
+
+    ipnet, _, gw = netcfg
+    worker = copy.copy(client)
+
+    async with sem:
+        await add_network_object(worker, ctlr_id=ctlr_id)
+        net_id = get_network_id(worker.data)
+        try:
+            await config_network_object(worker, ct.rules, net_id)
+            await add_network_object(worker, net_id, node_id)
+            await config_network_object(worker, ipnet, net_id)
+            await config_network_object(worker, gw, net_id, node_id)
+        except Exception:
+            await cleanup_mbr_net(worker, net_id)
+            raise
+    logger.debug('BOOTSTRAP: added network id {} with gw node {}'.format(net_id, node_id))
+
+    return net_id
+
+
+async def link_mbr_net(client, node_id, net_id, ex=False):
+    """
+    Wrapper for linking a new (src) network into the chain; adds the
+    new node to the current dangling exit net (unless it is an exit
+    node) and loads the new network data into the net trie.  If a step
+    fails the node is removed from the exit net before re-raising.
+    :param client: ztcli_api client object
+    :param node_id: node ID
+    :param net_id: new (src) network ID
+    :param ex: True if node is an exit node
+    :return: tuple of exit net ID and exit node ID (or None, None)
+    """
+    from node_tools import ctlr_data as ct
+
+    from node_tools.ctlr_funcs import set_network_cfg
+    from node_tools.trie_funcs import get_dangling_net_data
+
+    exit_net = exit_node = None
+    if not ex:
+        data_list = ct.store.dangling_net()
+        logger.debug('BOOTSTRAP: got exit net {}'.format(data_list))
+        if len(data_list) == 2:
+            exit_net, exit_node = data_list
+        else:
+            logger.error('BOOTSTRAP: malformed exit net data {}'.format(data_list))
+
+    try:
+        if exit_net is not None:
+            await add_network_object(client, exit_net, node_id)
+            netcfg = get_dangling_net_data(ct.net_trie, exit_net)
+            gw_cfg = set_network_cfg(netcfg.host)
+            await config_network_object(client, gw_cfg, exit_net, node_id)
+            logger.debug('BOOTSTRAP: added node id {} to exit net {}'.format(node_id, exit_net))
+        await update_mbr_data(client, ct.net_trie, net_id, node_id)
+    except Exception:
+        if exit_net is not None:
+            await cleanup_mbr_net(client, exit_net, node_id)
+        raise
+
+    return exit_net, exit_node
 
 
 async def offline_mbr_node(client, node_id):
@@ -241,11 +433,11 @@ async def offline_mbr_node(client, node_id):
 
     from node_tools.ctlr_funcs import unset_network_cfg
     from node_tools.network_funcs import publish_cfg_msg
+    from node_tools.topology_funcs import get_ring_neighbors
     from node_tools.trie_funcs import cleanup_state_tries
-    from node_tools.trie_funcs import get_neighbor_ids
 
     try:
-        node_net, exit_net, src_node, exit_node = get_neighbor_ids(ct.net_trie, node_id)
+        node_net, exit_net, src_node, exit_node = get_ring_neighbors(ct.ring, ct.net_trie, node_id)
         node_nets = [node_net, exit_net]
         logger.debug('OFFLINE: got node_nets {} and nodes {} {}'.format(node_nets, src_node, exit_node))
         if exit_node is not None:
@@ -258,22 +450,26 @@ async def offline_mbr_node(client, node_id):
     deauth = unset_network_cfg()
     if node_nets != [None, None]:
         if src_node is not None:
-            src_net, _, _, _ = get_neighbor_ids(ct.net_trie, src_node)
+            src_net, _, _, _ = get_ring_neighbors(ct.ring, ct.net_trie, src_node)
 
         if src_node is None:
             if exit_net is not None:
                 await config_network_object(client, deauth, exit_net, node_id)
                 cleanup_state_tries(ct.net_trie, ct.id_trie, exit_net, node_id, mbr_only=True)
+                ct.ring.unlink(node_id)
                 logger.debug('OFFLINE: deauthed node id {} from exit net {}'.format(node_id, exit_net))
             await delete_network_object(client, node_net)
             cleanup_state_tries(ct.net_trie, ct.id_trie, node_net, node_id)
+            ct.ring.remove(node_id)
             logger.debug('OFFLINE: removed dangling net {}'.format(node_net))
         else:
             await config_network_object(client, deauth, exit_net, node_id)
             cleanup_state_tries(ct.net_trie, ct.id_trie, exit_net, node_id, mbr_only=True)
+            ct.ring.unlink(node_id)
             logger.debug('OFFLINE: deauthed node id {} from exit net {}'.format(node_id, exit_net))
             await delete_network_object(client, node_net)
             cleanup_state_tries(ct.net_trie, ct.id_trie, node_net, node_id)
+            ct.ring.remove(node_id)
             logger.debug('OFFLINE: removed network id {} and node {}'.format(node_net, node_id))
 
             await connect_mbr_node(client, src_node, src_net, exit_net, exit_node)
@@ -282,6 +478,101 @@ async def offline_mbr_node(client, node_id):
         logger.warning('OFFLINE: node {} has missing net list {}'.format(node_id, node_nets))
 
 
+async def offline_mbr_nodes(client, node_list, max_requests=8):
+    """
+    Wrapper for handling a batch of offline member nodes; this is the
+    batch version of offline_mbr_node().  Adjacent offline nodes are
+    grouped into runs, so only the top node in each run is deauthed
+    from its exit net and only the surviving downstream node is
+    relinked (to the exit net of the top node).  The src nets of all
+    offline nodes are deleted concurrently.
+    :param client: ztcli_api client object
+    :param node_list: list of offline node IDs
+    :param max_requests: max number of API requests in flight
+    :return: list of relinked (surviving) node IDs
+    """
+    import copy
+
+    from node_tools import ctlr_data as ct
+    from node_tools import state_data as st
+
+    from node_tools.ctlr_funcs import unset_network_cfg
+    from node_tools.network_funcs import publish_cfg_msgs
+    from node_tools.topology_funcs import get_ring_neighbors
+    from node_tools.trie_funcs import cleanup_state_tries
+
+    sem = asyncio.Semaphore(max(1, max_requests))
+    deauth = unset_network_cfg()
+    nbrs = {}
+
+    for node_id in node_list:
+        try:
+            nbrs[node_id] = get_ring_neighbors(ct.ring, ct.net_trie, node_id)
+        except Exception as exc:
+            logger.error('OFFLINE: {}'.format(exc))
+            logger.warning('OFFLINE: node {} has missing net list'.format(node_id))
+
+    # each run of adjacent offline nodes starts at a node whose upstream
+    # neighbor is still online; a fully offline ring has no top node
+    runs = []
+    for node_id, (_, _, _, exit_node) in nbrs.items():
+        if exit_node not in nbrs:
+            run = [node_id]
+            src_node = nbrs[node_id][2]
+            while src_node in nbrs and src_node not in run:
+                run.append(src_node)
+                src_node = nbrs[src_node][2]
+            runs.append((run, src_node))
+    logger.debug('OFFLINE: got offline runs {}'.format(runs))
+
+    relinks = []
+    for run, src_node in runs:
+        _, exit_net, _, exit_node = nbrs[run[0]]
+        if exit_node is not None:
+            st.wait_cache.set(exit_node, True, 65)
+        if src_node is not None and exit_net is not None:
+            try:
+                src_net = get_ring_neighbors(ct.ring, ct.net_trie, src_node)[0]
+            except Exception as exc:
+                logger.error('OFFLINE: {}'.format(exc))
+                continue
+            relinks.append((src_node, src_net, exit_net, exit_node))
+
+    async def remove_net(node_id, exit_net=None):
+        worker = copy.copy(client)
+        async with sem:
+            if exit_net is not None:
+                await config_network_object(worker, deauth, exit_net, node_id)
+            await delete_network_object(worker, nbrs[node_id][0])
+
+    tops = {run[0]: nbrs[run[0]][1] for run, _ in runs}
+    results = await asyncio.gather(*[remove_net(node_id, tops.get(node_id))
+                                     for node_id in nbrs],
+                                   return_exceptions=True)
+    for node_id, result in zip(list(nbrs), results):
+        if isinstance(result, Exception):
+            logger.error('OFFLINE: node {} failed with {}'.format(node_id, result))
+        node_net, exit_net, _, _ = nbrs[node_id]
+        if tops.get(node_id) is not None:
+            cleanup_state_tries(ct.net_trie, ct.id_trie, exit_net, node_id, mbr_only=True)
+            logger.debug('OFFLINE: deauthed node id {} from exit net {}'.format(node_id, exit_net))
+        cleanup_state_tries(ct.net_trie, ct.id_trie, node_net, node_id)
+        ct.ring.remove(node_id)
+        logger.debug('OFFLINE: removed network id {} and node {}'.format(node_net, node_id))
+
+    async def relink(node_id, src_net, exit_net, exit_node):
+        async with sem:
+            await connect_mbr_node(copy.copy(client), node_id, src_net, exit_net, exit_node)
+
+    await asyncio.gather(*[relink(*args) for args in relinks])
+
+    relinked = [args[0] for args in relinks]
+    if relinked:
+        publish_cfg_msgs(ct.id_trie, relinked, addr='127.0.0.1')
+    logger.info('OFFLINE: removed {} nodes and relinked {}'.format(len(nbrs), relinked))
+    return relinked
+
+
 async def update_mbr_data(client, net_trie, net_id, mbr_id):
     """
     Wrapper to update net state trie during bootstrap.  Loads net trie
@@ -303,16 +594,82 @@ async def update_mbr_data(client, net_trie, net_id, mbr_id):
     net_trie[net_id + mbr_id] = client.data
 
 
-async def update_state_tries(client, net_trie, id_trie):
+async def get_state_data(client, max_requests=8):
+    """
+    Get all network and member payloads from the ctlr API using up to
+    `max_requests` concurrent requests.  Each request runs on a shallow
+    copy of the client, since the response is stored in `client.data`.
+    :param client: ztcli_api client object
+    :param max_requests: max number of API requests in flight
+    :return: tuple of net ID list, net data dict, and member data dict
+             (keyed by net ID, each with a dict of mbr ID: mbr data)
+    """
+    sem = asyncio.Semaphore(max(1, max_requests))
+
+    await get_network_object_ids(client)
+    net_list = list(client.data)
+    logger.debug('{} networks found'.format(len(net_list)))
+
+    results = await asyncio.gather(
+        *[fetch_network_object(client, sem, net_id) for net_id in net_list],
+        *[fetch_network_object(client, sem, net_id, ids=True) for net_id in net_list])
+    net_data = dict(zip(net_list, results[:len(net_list)]))
+    mbr_ids = dict(zip(net_list, results[len(net_list):]))
+
+    mbr_keys = [(net_id, mbr_id) for net_id in net_list for mbr_id in mbr_ids[net_id]]
+    results = await asyncio.gather(
+        *[fetch_network_object(client, sem, net_id, mbr_id) for net_id, mbr_id in mbr_keys])
+    mbr_data = {net_id: {} for net_id in net_list}
+    for (net_id, mbr_id), data in zip(mbr_keys, results):
+        mbr_data[net_id][mbr_id] = data
+
+    return net_list, net_data, mbr_data
+
+
+def load_state_data(net_trie, id_trie, net_list, net_data, mbr_data):
+    """
+    Load net/id tries from pre-fetched API data in the same order used
+    by the sequential update (so the resulting trie state is the same).
+    :param net_trie: zt network/member data
+    :param id_trie: network/node state
+    :param net_list: list of network IDs
+    :param net_data: dict of network data keyed by net ID
+    :param mbr_data: dict of member data dicts keyed by net ID
+    """
+    from node_tools.trie_funcs import load_id_trie
+
+    for net_id in net_list:
+        mbr_list = []
+        net_trie[net_id] = net_data[net_id]
+        logger.debug('network {} has {} possible member(s)'.format(net_id, len(mbr_data[net_id])))
+        for mbr_id, data in mbr_data[net_id].items():
+            if data['authorized']:
+                logger.debug('adding member: {}'.format(mbr_id))
+                net_trie[net_id + mbr_id] = data
+                load_id_trie(net_trie, id_trie, [], [mbr_id])
+                mbr_list.append(mbr_id)
+        load_id_trie(net_trie, id_trie, [net_id], mbr_list, nw=True)
+        logger.debug('member key suffixes: {}'.format(net_trie.suffixes(net_id)))
+
+
+async def update_state_tries(client, net_trie, id_trie, max_requests=None):
     """
     Wrapper to update ctlr state tries from ZT client API.  Loads net/id
     tries with new data (does not remove any stale trie data).
+    :notes: Set `max_requests` > 1 to fetch all the API data concurrently
+            before loading the tries (default is one request at a time).
     :param client: ztcli_api client object
     :param net_trie: zt network/member data
     :param id_trie: network/node state
+    :param max_requests: max number of API requests in flight
     """
     from node_tools.trie_funcs import load_id_trie
 
+    if max_requests and max_requests > 1:
+        state_data = await get_state_data(client, max_requests)
+        load_state_data(net_trie, id_trie, *state_data)
+        return
+
     await get_network_object_ids(client)
     logger.debug('{} networks found'.format(len(client.data)))
     net_list = client.data
@@ -336,6 +693,103 @@ async def update_state_tries(client, net_trie, id_trie):
         logger.debug('member key suffixes: {}'.format(net_trie.suffixes(net_id)))
 
 
+async def refresh_state_tries(client, net_trie, id_trie, revs, max_requests=8):
+    """
+    Wrapper to refresh ctlr state tries using the ZT object `revision`
+    field; only new or changed members are fetched, and only new or
+    changed objects are written to the tries.  Keys that are no longer
+    in the API data, and members that are no longer authorized, are
+    deleted from the net trie (removed keys are also dropped from
+    `revs`) and the affected id trie keys are reloaded.
+    :param client: ztcli_api client object
+    :param net_trie: zt network/member data
+    :param id_trie: network/node state
+    :param revs: dict of last-seen (revision, authorized) per trie key
+    :param max_requests: max number of API requests in flight
+    :return: tuple of sets of trie keys (added, changed, removed)
+    """
+    from node_tools.trie_funcs import cleanup_state_tries
+    from node_tools.trie_funcs import load_id_trie
+
+    added = set()
+    changed = set()
+    sem = asyncio.Semaphore(max(1, max_requests))
+
+    await get_network_object_ids(client)
+    net_list = list(client.data)
+    logger.debug('REFRESH: {} networks found'.format(len(net_list)))
+
+    results = await asyncio.gather(
+        *[fetch_network_object(client, sem, net_id) for net_id in net_list],
+        *[fetch_network_object(client, sem, net_id, ids=True) for net_id in net_list])
+    net_data = dict(zip(net_list, results[:len(net_list)]))
+    mbr_revs = dict(zip(net_list, results[len(net_list):]))
+
+    seen = set()
+    mbr_keys = []
+    for net_id in net_list:
+        seen.add(net_id)
+        for mbr_id, mbr_rev in mbr_revs[net_id].items():
+            key = net_id + mbr_id
+            seen.add(key)
+            last = revs.get(key)
+            if last is None or last[0] != mbr_rev or (last[1] and key not in net_trie):
+                mbr_keys.append((net_id, mbr_id))
+    results = await asyncio.gather(
+        *[fetch_network_object(client, sem, net_id, mbr_id) for net_id, mbr_id in mbr_keys])
+    mbr_data = dict(zip([net_id + mbr_id for net_id, mbr_id in mbr_keys], results))
+    logger.debug('REFRESH: fetched {} of {} members'.format(len(mbr_keys), len(seen) - len(net_list)))
+
+    for net_id in net_list:
+        data = net_data[net_id]
+        last = revs.get(net_id)
+        if last is None or last[0] != data['revision'] or net_id not in net_trie:
+            net_trie[net_id] = data
+            (changed if last else added).add(net_id)
+            revs[net_id] = (data['revision'], True)
+        for mbr_id in mbr_revs[net_id]:
+            key = net_id + mbr_id
+            if key in mbr_data:
+                data = mbr_data[key]
+                if data['authorized']:
+                    net_trie[key] = data
+                (changed if key in revs else added).add(key)
+                revs[key] = (data['revision'], data['authorized'])
+
+    removed = set(revs) - seen
+    for key in removed:
+        del revs[key]
+
+    # drop stale net/member records so they do not feed the id trie
+    stale = removed | set([x for x in mbr_data if not mbr_data[x]['authorized']])
+    for net_id in [x for x in stale if len(x) == 16]:
+        if net_id in id_trie:
+            cleanup_state_tries(net_trie, id_trie, net_id, None)
+        else:
+            for key in net_trie.keys(net_id):
+                del net_trie[key]
+    for key in [x for x in stale if len(x) > 16]:
+        if key in net_trie:
+            del net_trie[key]
+        if key[16:] in id_trie:
+            del id_trie[key[16:]]
+
+    nodes = set([key[16:] for key in added | changed | removed if len(key) > 16])
+    nets = set([key[0:16] for key in added | changed | removed])
+    for net_id in net_list:
+        mbr_list = [x for x in mbr_revs[net_id] if revs[net_id + x][1]]
+        for mbr_id in mbr_list:
+            if mbr_id in nodes or mbr_id not in id_trie:
+                load_id_trie(net_trie, id_trie, [], [mbr_id])
+        if net_id in nets or net_id not in id_trie:
+            load_id_trie(net_trie, id_trie, [net_id], mbr_list, nw=True)
+
+    logger.debug('REFRESH: {} added, {} changed, {} removed'.format(len(added),
+                                                                    len(changed),
+                                                                    len(removed)))
+    return added, changed, removed
+
+
 async def unwrap_mbr_net(client, node_lst, boot_lst, min_nodes=5):
     """
     Wrapper for unwrapping the (closed) network when it gets too small.
@@ -350,17 +804,16 @@ async def unwrap_mbr_net(client, node_lst, boot_lst, min_nodes=5):
 
     from node_tools.ctlr_funcs import unset_network_cfg
     from node_tools.network_funcs import publish_cfg_msg
+    from node_tools.topology_funcs import get_ring_neighbors
     from node_tools.trie_funcs import cleanup_state_tries
-    from node_tools.trie_funcs import find_dangling_nets
-    from node_tools.trie_funcs import get_neighbor_ids
     from node_tools.trie_funcs import get_target_node_id
 
     if len(node_lst) < min_nodes and len(boot_lst) == 0:
         logger.debug('UNWRAP: creating bootstrap list from network {}'.format(node_lst))
         tgt_id = get_target_node_id(node_lst, boot_lst)
-        tgt_net, tgt_exit_net, _, _ = get_neighbor_ids(ct.net_trie, tgt_id)
+        tgt_net, tgt_exit_net, _, _ = get_ring_neighbors(ct.ring, ct.net_trie, tgt_id)
         # tgt_src_net, _, _, _ = get_neighbor_ids(ct.net_trie, tgt_src_node)
-        data_list = find_dangling_nets(ct.id_trie)
+        data_list = ct.store.dangling_net()
         exit_net = data_list[0]
         exit_node = data_list[1]
         deauth = unset_network_cfg()
@@ -368,6 +821,7 @@ async def unwrap_mbr_net(client, node_lst, boot_lst, min_nodes=5):
         # detach and connect tgt node back to exit node
         await config_network_object(client, deauth, tgt_exit_net, tgt_id)
         cleanup_state_tries(ct.net_trie, ct.id_trie, tgt_exit_net, tgt_id, mbr_only=True)
+        ct.ring.unlink(tgt_id)
         logger.debug('UNWRAP: deauthed node id {} from tgt exit net {}'.format(tgt_id, tgt_exit_net))
 
         await connect_mbr_node(client, tgt_id, tgt_net, exit_net, exit_node)
@@ -448,6 +902,29 @@ async def delete_network_object(client, net_id, mbr_id=None):
     await client.delete_thing(endpoint)
 
 
+async def fetch_network_object(client, sem, net_id, mbr_id=None, ids=False):
+    """
+    Command wrapper for getting ZT network/member data (or member IDs
+    if `ids` is True) with a concurrency limit.  Uses a shallow copy of
+    the client so concurrent requests do not clobber `client.data`.
+    :param client: ztcli_api client object
+    :param sem: asyncio.Semaphore limiting requests in flight
+    :param net_id: network ID endpoint path
+    :param mbr_id: member ID endpoint path
+    :param ids: if True, get the member IDs for `net_id`
+    :return: API response data
+    """
+    import copy
+
+    worker = copy.copy(client)
+    async with sem:
+        if ids:
+            await get_network_object_ids(worker, net_id)
+        else:
+            await get_network_object_data(worker, net_id, mbr_id)
+    return worker.data
+
+
 async def get_network_object_data(client, net_id, mbr_id=None):
     """
     Command wrapper for getting ZT network/member data under the
@@ -3,30 +3,421 @@
 """cache-specific helper functions."""
 import logging
 import ipaddress
+import time
 
 from collections import namedtuple
+from contextlib import contextmanager
+
+from diskcache import Disk
+from diskcache.core import UNKNOWN
 
 from node_tools.helper_funcs import AttrDict
 from node_tools.helper_funcs import NODE_SETTINGS
 from node_tools.helper_funcs import find_ipv4_iface
+from node_tools.metric_funcs import cache_metrics
 
 
 logger = logging.getLogger(__name__)
 
+KEY_TYPES = ['node', 'peer', 'moon', 'net', 'mbr', 'nstate', 'mstate', 'istate']
+
+# payload field with the stable identity for each key type
+KEY_ID_FIELDS = {
+    'node': 'address',
+    'peer': 'address',
+    'mbr': 'address',
+    'moon': 'id',
+    'net': 'id',
+    'nstate': 'identity',
+    'mstate': 'identity',
+    'istate': 'identity'
+}
+
+key_indexes = {}
+
+entry_views = {}
+
+JSON_TAG = b'\x00fpnjson\x00'
+
+# entry writes done/skipped/expired by the cache_funcs write helpers
+write_stats = {'written': 0, 'skipped': 0, 'expired': 0}
+
+# entry TTL in seconds by key type (None means use max_cache_age); keys
+# of other types (eg, 'utc-time') do not expire
+KEY_TTLS = {
+    'peer': None,
+    'mbr': None,
+    'net': None,
+    'istate': None,
+    'moon': 300,
+    'mstate': 300,
+    'node': 300,
+    'nstate': 300
+}
+
+
+# diskcache directories (under the cache dir) for the maintenance job
+CACHE_DIRS = [
+    'fpn_cache',
+    'cfg_queue',
+    'clean_queue',
+    'hold_queue',
+    'net_queue',
+    'node_queue',
+    'off_queue',
+    'pub_queue',
+    'reg_queue',
+    'staging_queue',
+    'tmp_queue',
+    'wait_queue',
+    'wedge_queue'
+]
+
+# limits for the WAL checkpoint and VACUUM steps in maintain_cache_dirs
+VACUUM_MIN_RATIO = 0.25
+VACUUM_MIN_BYTES = 2 ** 16
+VACUUM_MAX_BYTES = 4 * 2 ** 20
+VACUUM_STEP_PAGES = 256
+WAL_MAX_BYTES = 2 ** 20
+
+
+class CacheKeyIndex(object):
+    """
+    Key type -> key list index for a cache <Index> object, so key lookups
+    do not read the whole cache key table.  The index also holds the
+    content digest and last refresh time of each entry written by
+    cache_funcs, so unchanged payloads are not rewritten and stale
+    entries can expire by type (see KEY_TTLS).  The index is kept in
+    memory and saved (as a key list, the cache entry count and the
+    refresh times) to a file in the cache directory when keys change
+    or on a full expiry sweep (refreshes alone do not rewrite the file,
+    so saved times may lag by one sweep); it is rebuilt
+    whenever the cache entry count does not match (ie, the cache was
+    changed by something else).  Digests are only kept in memory, since
+    the entry count cannot tell if an entry was rewritten by something
+    else; they are dropped on a commit by another connection and are
+    recomputed from the stored entries on demand (see get_digest).
+    :param cache: Index <cache> object
+    """
+    def __init__(self, cache):
+        import os
+
+        self.fname = os.path.join(cache.directory, 'key_index.pkl')
+        self.types = {}
+        self.order = {}
+        self.digests = {}
+        self.stamps = {}
+        self.seq = 0
+        self.count = None
+        self.version = None
+        self.generation = 0
+        self.deferred = False
+        self.dirty = False
+        self.stamped = False
+        self.load()
+
+    def _add(self, key):
+        if key not in self.order:
+            self.seq += 1
+            self.order[key] = self.seq
+            self.types.setdefault(get_key_type(key), {})[key] = None
+
+    def add(self, key):
+        """
+        Add a new cache key.
+        :param key: cache key
+        """
+        if key not in self.order:
+            self._add(key)
+            if self.count is not None:
+                self.count += 1
+            self.save()
+
+    @contextmanager
+    def batch(self):
+        """
+        Save the index file once after a batch of key changes.
+        """
+        nested = self.deferred
+        self.deferred = True
+        try:
+            yield self
+        finally:
+            self.deferred = nested
+            if not nested and self.dirty:
+                self.save()
+
+    def check(self, cache):
+        """
+        Rebuild the index if the cache entry count does not match.
+        :param cache: Index <cache> object
+        """
+        if self.count != len(cache):
+            self.rebuild(cache)
+
+    def clear(self):
+        self.types = {}
+        self.order = {}
+        self.digests = {}
+        self.stamps = {}
+        self.count = 0
+        self.generation += 1
+        self.save()
+
+    def find(self, cache, key_str):
+        """
+        Get the cache keys containing `key_str` (in cache order).
+        :param cache: Index <cache> object
+        :param key_str: key type string
+        :return: list of keys
+        """
+        self.check(cache)
+        types = [x for x in self.types if key_str in x]
+        if len(types) == 1:
+            return [key for key in self.types[types[0]] if key_str in key]
+        key_list = [key for x in types for key in self.types[x] if key_str in key]
+        return sorted(key_list, key=self.order.get)
+
+    def get_digest(self, cache, key):
+        """
+        Get the content digest of a cache entry.  All digests are dropped
+        if the cache version has changed, and a missing digest is
+        recomputed from the stored entry (one read).
+        :param cache: Index <cache> object
+        :param key: cache key
+        :return: digest string or None if the key is not in the cache
+        """
+        version = get_cache_version(cache)
+        if version != self.version:
+            self.digests = {}
+            self.version = version
+        if key not in self.digests and key in self.order:
+            try:
+                self.digests[key] = get_data_digest(cache[key])
+            except KeyError:
+                return None
+        return self.digests.get(key)
+
+    def load(self):
+        import pickle
+
+        try:
+            with open(self.fname, 'rb') as f:
+                key_list, count, stamps = pickle.load(f)
+        except Exception:
+            return
+        for key in key_list:
+            self._add(key)
+        self.stamps = stamps
+        self.count = count
+
+    def rebuild(self, cache):
+        """
+        Rebuild the index from the cache keys (one full key scan).
+        :param cache: Index <cache> object
+        """
+        self.types = {}
+        self.order = {}
+        self.digests = {}
+        now = time.time()
+        key_list = list(cache)
+        for key in key_list:
+            self._add(key)
+        self.stamps = dict.fromkeys(key_list, now)
+        self.count = len(key_list)
+        self.generation += 1
+        logger.debug('Rebuilt cache key index with {} keys'.format(self.count))
+        self.save()
+
+    def remove(self, key):
+        """
+        Remove a deleted cache key.
+        :param key: cache key
+        """
+        if key in self.order:
+            del self.order[key]
+            del self.types[get_key_type(key)][key]
+            self.digests.pop(key, None)
+            self.stamps.pop(key, None)
+            if self.count is not None:
+                self.count -= 1
+            self.save()
+
+    def expired(self, key, now=None):
+        """
+        Check if a cache entry is older than the TTL for its key type.
+        :param key: cache key
+        :param now: current time (epoch seconds)
+        :return: True if the entry has expired
+        """
+        ttl = get_key_ttl(key)
+        if ttl is None or key not in self.stamps:
+            return False
+        return (now or time.time()) - self.stamps[key] > ttl
+
+    def set_digest(self, key, digest):
+        """
+        Record the content digest for a written cache entry.
+        :param key: cache key
+        :param digest: payload digest
+        """
+        self.digests[key] = digest
+
+    def touch(self, key):
+        """
+        Record a refresh (write or skipped write) for a cache entry; the
+        index file is saved with the next key change or expiry sweep.
+        :param key: cache key
+        """
+        self.stamps[key] = time.time()
+        self.stamped = True
+
+    def save(self):
+        """
+        Save the index file (unless saves are deferred).
+        """
+        import os
+        import pickle
+
+        self.dirty = True
+        if self.deferred:
+            return
+        tmp_name = self.fname + '.tmp'
+        try:
+            with open(tmp_name, 'wb') as f:
+                pickle.dump((sorted(self.order, key=self.order.get),
+                             self.count,
+                             self.stamps), f)
+            os.replace(tmp_name, self.fname)
+            self.dirty = False
+            self.stamped = False
+        except OSError as exc:
+            logger.warning('Could not save cache key index: {}'.format(exc))
+
+
+class EntryViewCache(object):
+    """
+    In-process read-through layer for the decoded entries of a cache
+    <Index> object, so repeated reads within an update cycle do not go
+    back to SQLite.  Entries are keyed by cache key and tagged with the
+    cache version; the cache_funcs write helpers invalidate the keys
+    they change, and everything is dropped when the version changes,
+    ie, on a commit by another connection (the SQLite data_version) or
+    a key index rebuild (the cache was changed by something else).
+    :notes: the cached AttrDicts are shared between readers and must be
+            treated as read-only.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.version = None
+
+    def check(self, cache):
+        """
+        Drop all entries if the cache version has changed.
+        :param cache: Index <cache> object
+        """
+        version = get_cache_version(cache)
+        if version != self.version:
+            self.entries = {}
+            self.version = version
+
+    def clear(self):
+        self.entries = {}
+        self.version = None
+
+    def get(self, cache, key):
+        """
+        Get the (attribute view of the) entry for a cache key, reading
+        it from the cache on a miss.
+        :param cache: Index <cache> object
+        :param key: cache key
+        :return: `dict` Attrdict of payload data
+        :raises: KeyError if the key is not in the cache
+        """
+        if key in self.entries:
+            cache_metrics.count(get_key_type(key), 'hits')
+            return self.entries[key]
+        data = get_entry_view(cache[key])
+        cache_metrics.count(get_key_type(key), 'misses')
+        self.entries[key] = data
+        return data
+
+    def invalidate(self, key):
+        """
+        Drop the entry for a changed or deleted cache key.
+        :param key: cache key
+        """
+        self.entries.pop(key, None)
+
+
+class JSONDisk(Disk):
+    """
+    Cache <Disk> that stores dict and list payloads as compact (tagged)
+    JSON bytes instead of pickled AttrDict trees; all other values use
+    the default Disk serialization.  JSON is decoded to plain dicts and
+    lists; the attribute view is only built when an entry is read
+    through cache_funcs (see get_entry_view and EntryViewCache), so raw
+    reads (eg, digest checks) do not pay for it.
+    """
+    def __init__(self, directory, **kwargs):
+        import json
+
+        super(JSONDisk, self).__init__(directory, **kwargs)
+        self.decoder = json.JSONDecoder()
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def fetch(self, mode, filename, value, read):
+        data = super(JSONDisk, self).fetch(mode, filename, value, read)
+        if isinstance(data, bytes) and data.startswith(JSON_TAG):
+            return self.decoder.decode(data[len(JSON_TAG):].decode())
+        return data
+
+    def store(self, value, read, key=UNKNOWN):
+        if isinstance(value, (dict, list)):
+            value = JSON_TAG + self.encoder.encode(value).encode()
+            key_type = 'push' if key is UNKNOWN else get_key_type(key)
+            cache_metrics.count(key_type, 'bytes', len(value))
+        return super(JSONDisk, self).store(value, read, key)
+
+
+def count_cache_stat(key, name, num=1):
+    """
+    Update the write stats and the cache metrics for a cache key.
+    :param key: cache key
+    :param name: counter name, eg, 'written' or 'deleted'
+    :param num: amount to add
+    """
+    if name in write_stats:
+        write_stats[name] += num
+    cache_metrics.count(get_key_type(key), name, num)
+
 
 def create_cache_entry(cache, data, key_str):
     """
-    Load new cache entry by key type.
+    Load new cache entry by key type; the key is the key type plus the
+    payload identity (see get_cache_key) or a pushed key if the payload
+    has no identity.
     :param cache: Index <cache> object
     :param data: payload data in a dictionary
     :param key_str: desired 'key_str', one of
                     ['node'|'peer'|'net'|'mbr'|'moon'] or
                     ['nstate'|'mstate'|'istate']
     """
-    new_data = AttrDict.from_nested_dict(data)
-    logger.debug('Pushing entry for: {}'.format(key_str))
-    with cache.transact():
-        key = cache.push(new_data, prefix=key_str)
+    new_data = get_entry_data(data)
+    key = get_cache_key(key_str, new_data)
+    index = get_key_index(cache)
+    logger.debug('Creating entry for: {}'.format(key_str))
+    with cache_metrics.transact(cache, key_str):
+        if key is None:
+            key = cache.push(new_data, prefix=key_str)
+        else:
+            cache[key] = new_data
+    count_cache_stat(key, 'written')
+    get_entry_views(cache).invalidate(key)
+    with index.batch():
+        index.add(key)
+        index.set_digest(key, get_data_digest(data))
+        index.touch(key)
     logger.debug('New key created for: {}'.format(key))
 
 
@@ -38,25 +429,61 @@ def delete_cache_entry(cache, key_str):
                     ['node'|'peer'|'net'|'mbr'|'moon'] or
                     ['nstate'|'mstate'|'istate']
     """
+    index = get_key_index(cache)
+    views = get_entry_views(cache)
     key_list = find_keys(cache, key_str)
     if key_list:
-        for key in key_list:
-            logger.debug('Deleting entry for: {}'.format(key))
-            with cache.transact():
-                del cache[key]
+        with index.batch():
+            for key in key_list:
+                logger.debug('Deleting entry for: {}'.format(key))
+                with cache_metrics.transact(cache, get_key_type(key)):
+                    cache.pop(key, None)
+                index.remove(key)
+                views.invalidate(key)
+                count_cache_stat(key, 'deleted')
         logger.debug('Deleted cache items matching: {}'.format(key_str))
     else:
         logger.warning('No matching keys found for: {}'.format(key_str))
 
 
+def expire_cache_entries(cache, key_list=None):
+    """
+    Delete cache entries older than the TTL for their key type (lazy
+    expiry on read, or a full sweep if `key_list` is None; a sweep also
+    saves the refresh times of the key index).
+    :param cache: Index <cache> object
+    :param key_list: list of keys to check (default is all keys)
+    :return: list of deleted keys
+    """
+    index = get_key_index(cache)
+    now = time.time()
+    sweep = key_list is None
+    if sweep:
+        index.check(cache)
+        key_list = list(index.order)
+    expired = [key for key in key_list if index.expired(key, now)]
+
+    if expired:
+        views = get_entry_views(cache)
+        with index.batch(), cache_metrics.transact(cache, 'expire'):
+            for key in expired:
+                logger.debug('Expiring cache entry for key: {}'.format(key))
+                cache.pop(key, None)
+                index.remove(key)
+                views.invalidate(key)
+                count_cache_stat(key, 'expired')
+    elif sweep and index.stamped:
+        index.save()
+    return expired
+
+
 def find_keys(cache, key_str):
     """Find API key(s) in cache using key type string, return list of keys."""
-    valid_strings = ['node', 'peer', 'moon', 'net', 'mbr', 'nstate', 'mstate', 'istate']
-    match_list = [key for key in valid_strings if key_str in key]
+    match_list = [key for key in KEY_TYPES if key_str in key]
     if not match_list:
         logger.debug('Key type {} not valid'.format(key_str))
         return None
-    key_list = [key for key in list(cache) if key_str in key]
+    key_list = get_key_index(cache).find(cache, key_str)
     if not key_list:
         logger.debug('Key type {} not in cache'.format(key_str))
         return None
@@ -66,7 +493,8 @@ def find_keys(cache, key_str):
 
 def get_endpoint_data(cache, key_str):
     """
-    Get all data for key type from cache (can be endpoint or state).
+    Get all data for key type from cache (can be endpoint or state);
+    entries are read through the in-process view cache.
     :param cache: Index <cache> object
     :param key_str: desired 'key_str', one of
                     ['node'|'peer'|'net'|'mbr'|'moon'] or
@@ -77,17 +505,213 @@ def get_endpoint_data(cache, key_str):
     values = []
     key_list = find_keys(cache, key_str)
     if key_list:
-        for key in key_list:
-            with cache.transact():
-                data = cache[key]
-            values.append(data)
-            logger.debug('Appending data for key: {}'.format(key))
+        expired = expire_cache_entries(cache, key_list)
+        key_list = [x for x in key_list if x not in expired]
+        stale = []
+        views = get_entry_views(cache)
+        views.check(cache)
+        with cache_metrics.transact(cache, key_str):
+            for key in key_list:
+                try:
+                    data = views.get(cache, key)
+                except KeyError:
+                    logger.warning('Stale key index entry: {}'.format(key))
+                    stale.append(key)
+                    continue
+                values.append(data)
+                cache_metrics.count(get_key_type(key), 'reads')
+                logger.debug('Appending data for key: {}'.format(key))
+        if stale:
+            get_key_index(cache).rebuild(cache)
+            key_list = [x for x in key_list if x not in stale]
     else:
         key_list = []
     logger.debug('Leaving get_endpoint_data with key_str: {}'.format(key_str))
     return (key_list, values)
 
 
+def get_cache_dir_stats(directory, dbstat=False):
+    """
+    Get size and fragmentation stats for a diskcache directory.  Uses a
+    separate (read-only) SQLite connection, so it does not take any
+    cache locks.  By default the fragmentation is estimated from the
+    free page count (a few PRAGMAs); with `dbstat` it also counts the
+    unused bytes in partly filled pages, which reads the whole db.
+    :param directory: diskcache directory
+    :param dbstat: if True, use the dbstat table for the fragmentation
+    :return: `dict` of stats or None if there is no cache db
+    """
+    import os
+    import sqlite3
+
+    db_file = os.path.join(directory, 'cache.db')
+    if not os.path.isfile(db_file):
+        return None
+    wal_file = db_file + '-wal'
+
+    con = sqlite3.connect(db_file, timeout=0.1)
+    try:
+        page_size = con.execute('PRAGMA page_size').fetchone()[0]
+        page_count = con.execute('PRAGMA page_count').fetchone()[0]
+        free_pages = con.execute('PRAGMA freelist_count').fetchone()[0]
+        auto_vacuum = con.execute('PRAGMA auto_vacuum').fetchone()[0]
+        row = con.execute("SELECT value FROM Settings WHERE key = 'count'").fetchone()
+        unused = 0
+        if dbstat:
+            try:
+                unused = con.execute('SELECT SUM(unused) FROM dbstat').fetchone()[0] or 0
+            except sqlite3.OperationalError:
+                pass  # no dbstat table in this SQLite build
+    finally:
+        con.close()
+
+    db_bytes = page_size * page_count
+    wasted = free_pages * page_size + unused
+    return {'directory': directory,
+            'entries': row[0] if row else 0,
+            'db_bytes': db_bytes,
+            'wal_bytes': os.path.getsize(wal_file) if os.path.isfile(wal_file) else 0,
+            'free_pages': free_pages,
+            'auto_vacuum': auto_vacuum,
+            'fragmentation': round(wasted / db_bytes, 3) if db_bytes else 0.0}
+
+
+def get_cache_key(key_str, data):
+    """
+    Get the identity key for a payload, eg, 'peer-beef9f73c6' for a peer
+    or 'net-b6079f73ca8129ad' for a network.
+    :param key_str: key type string
+    :param data: payload data in a dictionary
+    :return: cache key or None if the payload has no identity
+    """
+    data_id = data.get(KEY_ID_FIELDS.get(key_str))
+    if not data_id:
+        return None
+    return '{}-{}'.format(key_str, data_id)
+
+
+def get_cache_version(cache):
+    """
+    Get the version of a cache <Index> object as seen by this process:
+    the SQLite data_version of the calling thread (changes on commits
+    by other connections) and the key index generation (changes on a
+    rebuild).
+    :param cache: Index <cache> object
+    :return: version tuple
+    """
+    return (get_data_version(cache.cache), get_key_index(cache).generation)
+
+
+def get_data_version(cache):
+    """
+    Get the SQLite data_version of a diskcache <Cache> object as seen by
+    the calling thread; it only changes on commits by other connections,
+    so it is cheap to check before trusting anything cached in-process.
+    :param cache: Cache object (eg, `Index.cache`)
+    :return: (thread ID, data_version) or a new token (never equal to a
+             previous one) if the data_version cannot be read
+    :notes: diskcache has no public API for this, so the PRAGMA is run on
+            the per-thread connection of diskcache 4.1 (pinned in setup.py).
+            With any other connection layout the caller just sees a
+            change on every call (ie, always rescans/reloads).
+    """
+    import sqlite3
+    import threading
+
+    try:
+        data_version = cache._con.execute('PRAGMA data_version').fetchone()[0]
+    except (AttributeError, sqlite3.Error):
+        return object()
+    return (threading.get_ident(), data_version)
+
+
+def get_data_digest(data):
+    """
+    Get the content digest for a payload (JSON with sorted keys).
+    :param data: payload data in a dictionary
+    :return: digest string
+    """
+    import hashlib
+    import json
+
+    payload = json.dumps(data, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+
+def get_entry_data(data):
+    """
+    Get the plain (dict) payload to store for a cache entry.
+    :param data: payload data in a dictionary (or AttrDict)
+    :return: payload as nested plain dicts/lists
+    """
+    if isinstance(data, AttrDict):
+        import json
+        return json.loads(json.dumps(data))
+    return data
+
+
+def get_entry_view(data):
+    """
+    Wrap a cache entry payload for attribute access when it is read;
+    entries stored as AttrDict (old caches) are returned as-is.  Same
+    result as AttrDict.from_nested_dict (nested dicts are wrapped, list
+    items are not) but only recurses into dict values.
+    :param data: cache entry payload
+    :return: `dict` Attrdict of payload data
+    """
+    if isinstance(data, AttrDict) or not isinstance(data, dict):
+        return data
+    view = AttrDict(data)
+    for key, value in data.items():
+        if type(value) is dict:
+            view[key] = get_entry_view(value)
+    return view
+
+
+def get_entry_views(cache):
+    """
+    Get the read-through entry view cache for a cache object.
+    :param cache: Index <cache> object
+    :return: <EntryViewCache> object
+    """
+    if cache.directory not in entry_views:
+        entry_views[cache.directory] = EntryViewCache()
+    return entry_views[cache.directory]
+
+
+def get_key_index(cache):
+    """
+    Get (or load) the key index for a cache object.
+    :param cache: Index <cache> object
+    :return: <CacheKeyIndex> object
+    """
+    if cache.directory not in key_indexes:
+        key_indexes[cache.directory] = CacheKeyIndex(cache)
+    return key_indexes[cache.directory]
+
+
+def get_key_type(key):
+    """
+    Get the key type for a cache key, eg, 'peer-beef9f73c6' -> 'peer'.
+    :param key: cache key
+    :return: key type string
+    """
+    return str(key).split('-', 1)[0]
+
+
+def get_key_ttl(key):
+    """
+    Get the TTL for a cache key from its key type.
+    :param key: cache key
+    :return: TTL in seconds or None (no expiry)
+    """
+    key_type = get_key_type(key)
+    if key_type not in KEY_TTLS:
+        return None
+    ttl = KEY_TTLS[key_type]
+    return ttl if ttl is not None else NODE_SETTINGS['max_cache_age']
+
+
 def get_net_status(cache):
     """
     Get user node status data for 'network' endpoint from cache, return
@@ -169,13 +793,14 @@ def get_peer_status(cache):
 def get_state(cache):
     """
     Get state data from cache to build node state and update it.
-
+    The fpn0/fpn1 state comes from the stored fields of each (OK) net
+    state entry, so it does not depend on the cache key order.
     """
     from node_tools import state_data as st
 
     key_list, values = get_endpoint_data(cache, 'state')
     if key_list:
-        d = {}
+        d = dict(fpn0=None, fpn1=None, fpn_id0=None, fpn_id1=None)
         for key, data in zip(key_list, values):
             if 'nstate' in str(key):
                 if 'ONLINE' in data.status:
@@ -200,8 +825,6 @@ def get_state(cache):
                     st.fpn0Data['nwid'] = data.identity
                     st.fpn0Data['iface'] = data.ztdevice
                     st.fpn0Data['address'] = data.ztaddress
-            else:
-                d.update(fpn0=None, fpn1=None, fpn_id0=None, fpn_id1=None)
         st.fpnState.update(d)
         logger.debug('fpnState: {}'.format(st.fpnState))
         logger.debug('fpn0Data: {}'.format(st.fpn0Data))
@@ -226,30 +849,166 @@ def handle_node_status(data, cache):
     return node_id
 
 
-def load_cache_by_type(cache, data, key_str):
-    """Load or update cache by key type string (uses find_keys)."""
-    from itertools import zip_longest
-    key_list = find_keys(cache, key_str)
-    if not key_list:
-        if key_str in ('node', 'nstate'):
-            create_cache_entry(cache, data, key_str)
-        else:
-            for item in data:
+def load_cache_by_type(cache, data, key_str, bulk=True):
+    """
+    Load or update cache by key type string (uses find_keys).  Entries
+    are keyed by payload identity, so each refresh only upserts the
+    current items and deletes the entries for items that are gone.
+    :param cache: Index <cache> object
+    :param data: payload data (a list of items except for node/nstate)
+    :param key_str: desired 'key_str', one of
+                    ['node'|'peer'|'net'|'mbr'|'moon'] or
+                    ['nstate'|'mstate'|'istate']
+    :param bulk: if True, apply the create/update/delete diff for the
+                 key type in a single cache transaction
+    """
+    from contextlib import ExitStack
+
+    index = get_key_index(cache)
+    old_keys = set(find_keys(cache, key_str) or [])
+    items = [data] if key_str in ('node', 'nstate') else data
+    new_items = [(get_cache_key(key_str, item), item) for item in items]
+    new_keys = set(key for key, _ in new_items)
+
+    with index.batch(), ExitStack() as stack:
+        if bulk:
+            stack.enter_context(cache_metrics.transact(cache, key_str))
+        for key in sorted(old_keys - new_keys):
+            logger.debug('Removing cache entry for key: {}'.format(key))
+            with cache_metrics.transact(cache, key_str):
+                cache.pop(key, None)
+            index.remove(key)
+            get_entry_views(cache).invalidate(key)
+            count_cache_stat(key, 'deleted')
+        for key, item in new_items:
+            if key in old_keys:
+                update_cache_entry(cache, item, key)
+            else:
                 create_cache_entry(cache, item, key_str)
-    else:
-        if key_str in ('node', 'nstate'):
-            update_cache_entry(cache, data, key_list[0])
-        else:
-            for key, item in zip_longest(key_list, data):
-                if not key:
-                    create_cache_entry(cache, item, key_str)
-                elif not item:
-                    logger.debug('Removing cache entry for key: {}'.format(key))
-                    with cache.transact():
-                        del cache[key]
-                else:
-                    update_cache_entry(cache, item, key)
-    key_list = find_keys(cache, key_str)
+
+
+def maintain_cache_dirs(dir_names=None, min_ratio=VACUUM_MIN_RATIO,
+                        max_bytes=VACUUM_MAX_BYTES):
+    """
+    Run one (short) maintenance step on the diskcache directories; each
+    cache is culled (expired items, in small batches) and its WAL is
+    checkpointed (truncated if larger than WAL_MAX_BYTES).  Dbs in
+    incremental auto_vacuum mode release up to VACUUM_STEP_PAGES free
+    pages; otherwise only the db under `max_bytes` with the most free
+    pages is checked (with dbstat) and vacuumed if it has at least
+    `min_ratio` and VACUUM_MIN_BYTES to reclaim, so the writer lock is
+    only held for one small db per run.  All steps use raw SQLite
+    connections with a short busy timeout (opening a diskcache Cache
+    can block for up to 60 sec) and busy caches are skipped until the
+    next run.
+    :notes: the CACHE_DIRS caches all use eviction policy 'none', so
+            culling only removes expired items (same as Cache.expire).
+    :param dir_names: list of cache dir names (default is CACHE_DIRS)
+    :param min_ratio: min fragmentation ratio for a full vacuum
+    :param max_bytes: max db size for a full vacuum
+    :return: list of dir stats (see get_cache_dir_stats) from before the
+             maintenance step, plus the `culled` count and `vacuumed` flag
+    """
+    import os
+    import sqlite3
+    import time
+
+    from node_tools.helper_funcs import get_cachedir
+
+    def expire_items(stats, now):
+        db_file = os.path.join(stats['directory'], 'cache.db')
+        con = sqlite3.connect(db_file, timeout=0.1, isolation_level=None)
+        count = 0
+        try:
+            while True:
+                con.execute('BEGIN IMMEDIATE')
+                rows = con.execute('SELECT rowid, filename FROM Cache'
+                                   ' WHERE 0 < expire_time AND expire_time < ?'
+                                   ' ORDER BY expire_time LIMIT 100', (now,)).fetchall()
+                con.executemany('DELETE FROM Cache WHERE rowid = ?', [(x[0],) for x in rows])
+                con.execute('COMMIT')
+                for _, filename in rows:
+                    if filename:
+                        try:
+                            os.remove(os.path.join(stats['directory'], filename))
+                        except OSError:
+                            pass
+                count += len(rows)
+                if len(rows) < 100:
+                    break
+        except sqlite3.OperationalError as exc:
+            logger.debug('MAINT: {} is busy ({})'.format(stats['name'], exc))
+        finally:
+            con.close()
+        return count
+
+    def run_pragmas(stats, pragmas):
+        con = sqlite3.connect(os.path.join(stats['directory'], 'cache.db'), timeout=0.1)
+        try:
+            for pragma in pragmas:
+                con.execute(pragma).fetchall()
+            return True
+        except sqlite3.OperationalError as exc:
+            logger.debug('MAINT: {} is busy ({})'.format(stats['name'], exc))
+            return False
+        finally:
+            con.close()
+
+    report = []
+    for name in dir_names or CACHE_DIRS:
+        try:
+            stats = get_cache_dir_stats(get_cachedir(name))
+        except sqlite3.OperationalError as exc:
+            logger.debug('MAINT: {} is busy ({})'.format(name, exc))
+            continue
+        if stats is None:
+            continue
+        stats.update(name=name, culled=0, vacuumed=False)
+        stats['culled'] = expire_items(stats, time.time())
+        mode = 'TRUNCATE' if stats['wal_bytes'] > WAL_MAX_BYTES else 'PASSIVE'
+        pragmas = ['PRAGMA wal_checkpoint({})'.format(mode)]
+        if stats['auto_vacuum'] == 2 and stats['free_pages']:
+            pragmas.append('PRAGMA incremental_vacuum({})'.format(VACUUM_STEP_PAGES))
+        run_pragmas(stats, pragmas)
+        report.append(stats)
+
+    candidates = [x for x in report if x['auto_vacuum'] != 2 and
+                  VACUUM_MIN_BYTES <= x['db_bytes'] <= max_bytes]
+    if candidates:
+        stats = max(candidates, key=lambda x: (x['fragmentation'], x['db_bytes']))
+        try:
+            full_stats = get_cache_dir_stats(stats['directory'], dbstat=True)
+        except sqlite3.OperationalError as exc:
+            logger.debug('MAINT: {} is busy ({})'.format(stats['name'], exc))
+            full_stats = None
+        if full_stats is not None:
+            stats['fragmentation'] = full_stats['fragmentation']
+            if (stats['fragmentation'] >= min_ratio and
+                    stats['fragmentation'] * full_stats['db_bytes'] >= VACUUM_MIN_BYTES):
+                stats['vacuumed'] = run_pragmas(stats, ['VACUUM',
+                                                        'PRAGMA wal_checkpoint(TRUNCATE)'])
+
+    for stats in report:
+        logger.debug('MAINT: {name} has {entries} entries, {db_bytes} bytes '
+                     '(wal {wal_bytes}), fragmentation {fragmentation}, '
+                     'culled {culled}, vacuumed {vacuumed}'.format(**stats))
+    return report
+
+
+def open_cache(directory=None):
+    """
+    Open the state cache Index using the JSONDisk serializer (all
+    openers of the same cache directory should use this).
+    :param directory: cache directory (default is the fpn cache dir)
+    :return: Index <cache> object
+    """
+    from diskcache import Cache
+    from diskcache import Index
+    from node_tools.helper_funcs import get_cachedir
+
+    if directory is None:
+        directory = get_cachedir()
+    return Index.fromcache(Cache(directory, eviction_policy='none', disk=JSONDisk))
 
 
 def update_cache_entry(cache, data, key):
@@ -261,15 +1020,23 @@ def update_cache_entry(cache, data, key):
                     ['node'|'peer'|'net'|'mbr'|'moon'] or
                     ['nstate'|'mstate'|'istate']
     """
-    new_data = AttrDict.from_nested_dict(data)
-    if 'state' in key.rstrip('-0123456789'):
-        tgt = 'identity'
-    elif key.rstrip('-0123456789') in ('net', 'moon'):
-        tgt = 'id'
-    else:
-        tgt = 'address'
-    data_id = new_data[tgt]
+    index = get_key_index(cache)
+    index.check(cache)
+    digest = get_data_digest(data)
+    if index.get_digest(cache, key) == digest:
+        count_cache_stat(key, 'skipped')
+        index.touch(key)
+        logger.debug('Skipping unchanged cache entry for key: {}'.format(key))
+        return
+    new_data = get_entry_data(data)
+    data_id = new_data.get(KEY_ID_FIELDS.get(get_key_type(key)))
     logger.debug('New data has id: {}'.format(data_id))
     logger.debug('Updating cache entry for key: {}'.format(key))
-    with cache.transact():
+    with cache_metrics.transact(cache, get_key_type(key)):
         cache[key] = new_data
+    count_cache_stat(key, 'written')
+    get_entry_views(cache).invalidate(key)
+    with index.batch():
+        index.add(key)
+        index.set_digest(key, digest)
+        index.touch(key)
@@ -3,17 +3,31 @@
 """
     Default fpn ctlr state variables.  Trie keys must be in the set
     `string.hexdigits`.
-    :var net_trie: <Trie> of JSON network/member data objects
-    :var id_trie: <Trie> of JSON member node net_id state objects
+    :var net_trie: <NetTrie> of JSON network/member data objects (with
+                   a node ID -> net IDs index)
+    :var id_trie: <StateTrie> of JSON member node net_id state objects
+    :var ring: <MemberRing> of member chain/ring links (see topology_funcs)
+    :var store: <TopologyStore> of memoized trie/ring queries
+    :var revisions: <dict> of last-seen (revision, authorized) per trie key
+    :var journal: <TrieJournal> of trie mutations (see journal_funcs)
+    :var subnets: <SubnetAllocator> for member network subnets (released
+                  when a network is removed from the tries)
     :var rules: <cfg_dict> default flow rules for each network link
 """
 import string
 
-import datrie
+from node_tools.topology_funcs import MemberRing
+from node_tools.topology_funcs import TopologyStore
+from node_tools.trie_funcs import NetTrie
+from node_tools.trie_funcs import StateTrie
 
-
-net_trie = datrie.Trie(string.hexdigits)
-id_trie = datrie.Trie(string.hexdigits)
+net_trie = NetTrie(string.hexdigits, name='net_trie')
+id_trie = StateTrie(string.hexdigits, name='id_trie')
+ring = MemberRing()
+store = TopologyStore(net_trie, id_trie, ring)
+revisions = {}
+journal = None
+subnets = None
 
 rules = {
     'rules': [
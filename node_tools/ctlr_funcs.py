@@ -6,7 +6,6 @@ import logging
 
 from node_tools.helper_funcs import AttrDict
 from node_tools.helper_funcs import NODE_SETTINGS
-from node_tools.helper_funcs import find_ipv4_iface
 from node_tools.helper_funcs import json_load_file
 
 
@@ -53,16 +52,21 @@ def handle_net_cfg(deque):
     Handle the initial net_cfg for a (new) member node. Required format
     derived from async wrapper funcs.  Context is netstate runner and
     bootstrap_mbr_node.
-    :param deque: netobj queue
+    :param deque: netobj queue or <SubnetAllocator>
     :return: tuple of formatted cfg fragments
     """
-    with deque.transact():
-        ipnet = deque.popleft()
-        deque.append(ipnet)
+    from node_tools.ipv4_funcs import int_get_netcfg
 
-    netcfg = ipnet_get_netcfg(ipnet)
-    gw_ip = find_ipv4_iface(netcfg.gateway[0])
-    src_ip = find_ipv4_iface(netcfg.host[0])
+    if hasattr(deque, 'allocate'):
+        netcfg = int_get_netcfg(deque.allocate(), deque.prefix)
+    else:
+        with deque.transact():
+            ipnet = deque.popleft()
+            deque.append(ipnet)
+        netcfg = ipnet_get_netcfg(ipnet)
+
+    gw_ip = netcfg.net_routes[1]['via']
+    src_ip = netcfg.host[0].split('/')[0]
 
     ip_range = [{'ipRangeStart': '{}'.format(gw_ip),
                  'ipRangeEnd': '{}'.format(src_ip)}]
@@ -98,25 +102,10 @@ def ipnet_get_netcfg(netobj):
     :return: `dict` Attrdict of JSON config fragments
     """
     import ipaddress as ip
+    from node_tools.ipv4_funcs import int_get_netcfg
 
-    if isinstance(netobj, ip.IPv4Network):
-        net_cidr = str(netobj)
-        net_pfx = '/' + str(netobj.prefixlen)
-        gate_iface = ip.IPv4Interface(str(list(netobj.hosts())[0]) + net_pfx)
-        host_iface = ip.IPv4Interface(str(list(netobj.hosts())[1]) + net_pfx)
-        gate_addr = str(gate_iface.ip)
-        host_cidr = [str(host_iface)]
-        gate_cidr = [str(gate_iface)]
-
-        net_routes = [{"target": "{}".format(net_cidr)},
-                      {"target": "0.0.0.0/0", "via": "{}".format(gate_addr)}]
-
-        d = {
-            "net_routes": net_routes,
-            "host": host_cidr,
-            "gateway": gate_cidr
-        }
-        return AttrDict.from_nested_dict(d)
+    if isinstance(netobj, ip.IPv4Network) and netobj.prefixlen <= 30:
+        return int_get_netcfg(int(netobj.network_address), netobj.prefixlen)
     else:
         raise ValueError('{} is not a valid IPv4Network object'.format(netobj))
 
@@ -166,13 +155,30 @@ def netcfg_get_ipnet(addr, cidr='/30'):
     :raises: AddressValueError
     """
     import ipaddress as ip
-    from node_tools.helper_funcs import find_ipv4_iface
+    from node_tools.ipv4_funcs import addr_get_net_int
 
-    if find_ipv4_iface(addr + cidr, strip=False):
-        netobj = ip.ip_network(addr + cidr, strict=False)
-        return netobj
-    else:
-        raise ip.AddressValueError
+    prefix = int(cidr.lstrip('/'))
+    return ip.IPv4Network((addr_get_net_int(addr, prefix), prefix))
+
+
+def release_net_cfg(deque, ipnet):
+    """
+    Return the subnet for a net_cfg from handle_net_cfg() to the
+    allocator, eg, when creating the new network failed.  Does nothing
+    for a netobj queue (subnets are recycled there anyway).
+    :param deque: netobj queue or <SubnetAllocator>
+    :param ipnet: network cfg fragment (with routes)
+    :return: True if the subnet was released
+    """
+    from node_tools.ipv4_funcs import get_net_subnet
+
+    if not hasattr(deque, 'release'):
+        return False
+    net_int = get_net_subnet(ipnet, deque.prefix)
+    if net_int is None:
+        return False
+    logger.debug('BOOTSTRAP: releasing subnet for {}'.format(ipnet.routes[0]['target']))
+    return deque.release(net_int)
 
 
 def set_network_cfg(cfg_addr):
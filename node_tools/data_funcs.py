@@ -9,10 +9,11 @@ import functools
 
 from datetime import timezone
 
-from diskcache import Index
-
+from node_tools.cache_funcs import expire_cache_entries
+from node_tools.cache_funcs import get_key_index
 from node_tools.cache_funcs import get_state
-from node_tools.helper_funcs import get_cachedir
+from node_tools.cache_funcs import maintain_cache_dirs
+from node_tools.cache_funcs import open_cache
 from node_tools.helper_funcs import get_runtimedir
 from node_tools.helper_funcs import log_fpn_state
 from node_tools.helper_funcs import put_state_msg
@@ -21,20 +22,39 @@ from node_tools.helper_funcs import update_state
 from node_tools.helper_funcs import AttrDict
 from node_tools.helper_funcs import ENODATA
 from node_tools.helper_funcs import NODE_SETTINGS
+from node_tools.metric_funcs import get_cache_metrics
+from node_tools.sched_funcs import catch_exceptions
 
 
 utc = timezone.utc
 logger = logging.getLogger(__name__)
-cache = Index(get_cachedir())
+cache = open_cache()
+
+
+@catch_exceptions()
+def do_cache_maintenance():
+    """Cull/vacuum the diskcache dirs in small steps (scheduled job)"""
+    report = maintain_cache_dirs()
+    total = sum(x['db_bytes'] + x['wal_bytes'] for x in report)
+    logger.info('Cache maintenance checked {} dirs ({} bytes)'.format(len(report), total))
+    return report
+
+
+@catch_exceptions()
+def do_cache_sweep():
+    """Expire stale cache entries (scheduled job)"""
+    expired = expire_cache_entries(cache)
+    logger.debug('Cache sweep removed {} entries'.format(len(expired)))
+    return expired
 
 
 def do_logstats(msg=None):
-    """Log cache size/key stats with optional ``msg`` string"""
+    """Log cache size and metrics with optional ``msg`` string"""
     size = len(cache)
     if msg:
         logger.debug(msg)
     logger.debug('{} items currently in cache.'.format(size))
-    logger.debug('Cache items: {}'.format(list(cache)))
+    logger.debug('Cache metrics: {}'.format(get_cache_metrics()))
 
 
 def get_state_values(old, new, pairs=False):
@@ -70,9 +90,9 @@ def with_cache_aging(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         """
-        Diskcache wrapper to manage timestamp age for update_runner (this is
-        necessary because the Index cache has no expire/eviction policy).
-        * get timestamp and clear cache if greater than max_age
+        Diskcache wrapper to manage timestamp age for update_runner (the
+        cache entries expire by key type, see cache_funcs.KEY_TTLS).
+        * get timestamp and expire stale entries if greater than max_age
         * update cache timestamp based on result
         * log some debug info
         :return result: result from update_runner()
@@ -90,12 +110,13 @@ def with_cache_aging(func):
             logger.debug('Maximum cache age: {} sec'.format(max_age))
             if cache_age.seconds > max_age:
                 logger.debug('Cache data is too old!!')
-                logger.debug('Stale data will be removed!!')
-                cache.clear()
+                expired = expire_cache_entries(cache)
+                logger.debug('Removed {} stale cache entries'.format(len(expired)))
             else:
                 logger.info('Cache is {} sec old (still valid)'.format(cache_age.seconds))
         else:
             cache.update([('utc-time', utc_stamp)])
+            get_key_index(cache).add('utc-time')
 
         result = func(*args, **kwargs)
         logger.info('Get data result: {}'.format(result))
@@ -105,6 +126,7 @@ def with_cache_aging(func):
             logger.debug('Old cache time is: {:%Y-%m-%d %H:%M:%S %Z}'.format(stamp))
         else:
             cache.update([('utc-time', utc_stamp)])
+            get_key_index(cache).add('utc-time')
             logger.debug('New cache time is: {:%Y-%m-%d %H:%M:%S %Z}'.format(utc_stamp))
         log_fpn_state()
         run_event_handlers()
@@ -31,6 +31,9 @@ NODE_SETTINGS = {
     u'drop_ip6': False,  # set IPv6 in/out/fwd policies to drop while running
     u'max_timeout': 75,  # max wait timeout for network changes in seconds
     u'max_cache_age': 60,  # maximum cache age in seconds
+    u'max_api_requests': 8,  # max concurrent ctlr API requests
+    u'snapshot_interval': 300,  # ctlr state snapshot interval in seconds
+    u'maint_interval': 900,  # diskcache dir maintenance interval in seconds
     u'use_localhost': False,  # messaging interface to use
     u'runas_user': False,  # user to run as
     u'node_role': None,  # role this node will run as
@@ -39,6 +42,7 @@ NODE_SETTINGS = {
     u'home_dir': None,
     u'debug': False,
     u'node_runner': 'nodestate.py',
+    u'use_runner': True,  # keep runner state alive between update cycles
     u'mode': 'peer',
     u'use_exitnode': [],  # edit to populate with ID: ['exitnode']
     u'nwid': None  # adhoc mode network ID goes here
@@ -490,6 +494,11 @@ def startup_handlers():
 
 
 def update_state(scr=None):
+    """
+    Run one state update cycle for the node runner script, either with
+    the persistent state runner (default) or by executing the script.
+    :param scr: runner script name (default is NODE_SETTINGS value)
+    """
     import pathlib
 
     if not scr:
@@ -499,7 +508,11 @@ def update_state(scr=None):
     node_scr = here.joinpath(scr)
 
     try:
-        exec_full(node_scr)
+        if NODE_SETTINGS['use_runner']:
+            from node_tools.state_runner import get_state_runner
+            get_state_runner(scr).run()
+        else:
+            exec_full(node_scr)
         return 'OK'
     except Exception as exc:
         logger.warning('{} exception: {}'.format(scr, exc))
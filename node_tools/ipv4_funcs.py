@@ -0,0 +1,321 @@
+# coding: utf-8
+
+"""Integer-based IPv4 subnet functions for the ctlr hot path."""
+
+import functools
+import ipaddress
+import logging
+
+from collections import deque
+
+from node_tools.helper_funcs import AttrDict
+
+
+logger = logging.getLogger(__name__)
+
+NETCFG_CACHE_SIZE = 16384
+
+
+def addr_to_int(addr):
+    """
+    Convert a bare IPv4 address string to an integer.
+    :param addr: IPv4 address string without mask, eg: 172.16.0.1
+    :return: `int` address
+    :raises: AddressValueError
+    """
+    octets = addr.split('.')
+    if len(octets) != 4:
+        raise ipaddress.AddressValueError('Expected 4 octets in {!r}'.format(addr))
+    value = 0
+    for octet in octets:
+        if not octet.isdigit() or len(octet) > 3 or int(octet) > 255:
+            raise ipaddress.AddressValueError('Invalid octet {!r} in {!r}'.format(octet, addr))
+        value = (value << 8) | int(octet)
+    return value
+
+
+def int_to_addr(value):
+    """
+    Convert an integer to a bare IPv4 address string.
+    :param value: `int` address
+    :return: IPv4 address string
+    """
+    return '{}.{}.{}.{}'.format(value >> 24 & 255, value >> 16 & 255,
+                                value >> 8 & 255, value & 255)
+
+
+def addr_get_net_int(addr, prefix=30):
+    """
+    Get the (integer) network address for a bare IPv4 address.
+    :param addr: IPv4 address string without mask
+    :param prefix: network prefix length
+    :return: `int` network address
+    :raises: AddressValueError
+    """
+    mask = (0xffffffff << (32 - prefix)) & 0xffffffff
+    return addr_to_int(addr) & mask
+
+
+@functools.lru_cache(maxsize=NETCFG_CACHE_SIZE)
+def get_net_strings(net_int, prefix=30):
+    """
+    Get the string fragments for a network; the first two host addrs
+    are the gateway and member host (same as the netobj.hosts() order).
+    :param net_int: `int` network address
+    :param prefix: network prefix length (max 30)
+    :return: tuple of net cidr, gateway addr, host addr, prefix string
+    """
+    if not 0 <= prefix <= 30:
+        raise ValueError('prefix /{} has no usable host pair'.format(prefix))
+    return (int_to_addr(net_int) + '/' + str(prefix),
+            int_to_addr(net_int + 1),
+            int_to_addr(net_int + 2),
+            '/' + str(prefix))
+
+
+def addr_get_gateway(addr, prefix=30):
+    """
+    Get the gateway addr for the network a host/gateway addr belongs to.
+    :param addr: IPv4 address string without mask
+    :param prefix: network prefix length
+    :return: bare gateway addr string
+    :raises: AddressValueError
+    """
+    return get_net_strings(addr_get_net_int(addr, prefix), prefix)[1]
+
+
+def addr_get_netcfg(addr, prefix=30):
+    """
+    Same as ipnet_get_netcfg(netcfg_get_ipnet(addr)) without the
+    ipaddress objects.
+    :param addr: IPv4 address string without mask
+    :param prefix: network prefix length
+    :return: `dict` Attrdict of JSON config fragments
+    :raises: AddressValueError
+    """
+    return int_get_netcfg(addr_get_net_int(addr, prefix), prefix)
+
+
+def int_get_netcfg(net_int, prefix=30):
+    """
+    Build the netcfg Attrdict for a network (a new object per call, since
+    callers may update the fragments).
+    :param net_int: `int` network address
+    :param prefix: network prefix length
+    :return: `dict` Attrdict of JSON config fragments
+    """
+    net_cidr, gate_addr, host_addr, net_pfx = get_net_strings(net_int, prefix)
+
+    net_routes = [{"target": net_cidr},
+                  {"target": "0.0.0.0/0", "via": gate_addr}]
+
+    return AttrDict({
+        "net_routes": net_routes,
+        "host": [host_addr + net_pfx],
+        "gateway": [gate_addr + net_pfx]
+    })
+
+
+def get_net_subnet(payload, prefix=30):
+    """
+    Get the (integer) subnet address for a network payload from the
+    gateway (`via`) in its routes.
+    :param payload: net data trie payload
+    :param prefix: network prefix length
+    :return: `int` network address or None
+    """
+    for route in payload.get('routes') or []:
+        if route.get('via') is not None:
+            try:
+                return addr_get_net_int(route['via'], prefix)
+            except ipaddress.AddressValueError:
+                return None
+    return None
+
+
+class SubnetAllocator(object):
+    """
+    Subnet allocator for the ctlr member networks (replaces the netobj
+    deque).  Subnets in `ipnet` are tracked with an in-use bitmap plus
+    a (FIFO) free-list of released subnets, so a released subnet is not
+    handed out again until the older free subnets are used; new subnets
+    are handed out from a `cursor` so allocate/release are O(1) and
+    startup does not need to generate every subnet object.  State is
+    saved to `directory` (if set) and should be rebuilt from the net
+    trie with sync() on startup.
+    :param directory: directory for the allocator state file
+    :param ipnet: address pool in CIDR format
+    :param prefix: subnet prefix length
+    """
+    def __init__(self, directory=None, ipnet='172.16.0.0/12', prefix=30):
+        import os
+
+        pool = ipaddress.ip_network(ipnet)
+        self.directory = directory
+        self.fname = os.path.join(directory, 'subnets.pkl') if directory else None
+        self.prefix = prefix
+        self.base = int(pool.network_address)
+        self.size = 2 ** (prefix - pool.prefixlen)
+        self.step = 2 ** (32 - prefix)
+        self.synced = False
+        self.clear()
+        self.load()
+
+    def __contains__(self, net_int):
+        idx = self._get_index(net_int)
+        return idx is not None and self._is_set(idx)
+
+    def __len__(self):
+        """
+        :return: number of free subnets
+        """
+        return self.size - self.used
+
+    def _get_index(self, net_int):
+        idx, offset = divmod(net_int - self.base, self.step)
+        if offset or not 0 <= idx < self.size:
+            return None
+        return idx
+
+    def _is_set(self, idx):
+        return self.bitmap[idx >> 3] & (1 << (idx & 7))
+
+    def _set(self, idx):
+        self.bitmap[idx >> 3] |= 1 << (idx & 7)
+        self.used += 1
+
+    def _unset(self, idx):
+        self.bitmap[idx >> 3] &= ~(1 << (idx & 7))
+        self.used -= 1
+
+    def allocate(self):
+        """
+        Allocate a free subnet (released subnets are reused first, oldest
+        first).
+        :return: `int` network address
+        :raises: IndexError if there are no free subnets
+        """
+        while self.free_list:
+            idx = self.free_list.popleft()
+            if not self._is_set(idx):
+                self._set(idx)
+                return self.base + idx * self.step
+        while self.cursor < self.size:
+            idx = self.cursor
+            self.cursor += 1
+            if not self._is_set(idx):
+                self._set(idx)
+                return self.base + idx * self.step
+        raise IndexError('no free subnets in pool')
+
+    def clear(self):
+        self.bitmap = bytearray((self.size + 7) // 8)
+        self.free_list = deque()
+        self.cursor = 0
+        self.used = 0
+
+    def load(self):
+        """
+        Load the allocator state file (if any).
+        :return: True if the state was loaded
+        """
+        import os
+        import pickle
+
+        if not self.fname or not os.path.isfile(self.fname):
+            return False
+        try:
+            with open(self.fname, 'rb') as f:
+                state = pickle.load(f)
+            if (state['base'], state['size']) != (self.base, self.size):
+                raise ValueError('pool mismatch')
+            self.bitmap = bytearray(state['bitmap'])
+            self.free_list = deque(state['free_list'])
+            self.cursor = state['cursor']
+            self.used = state['used']
+        except Exception as exc:
+            logger.warning('ALLOC: ignoring bad state file {} ({})'.format(self.fname, exc))
+            self.clear()
+            return False
+        return True
+
+    def mark_used(self, net_int):
+        """
+        Mark a subnet as in use (eg, when rebuilding from the tries).
+        :param net_int: `int` network address
+        """
+        idx = self._get_index(net_int)
+        if idx is not None and not self._is_set(idx):
+            self._set(idx)
+
+    def release(self, net_int):
+        """
+        Return a subnet to the free-list.
+        :param net_int: `int` network address
+        :return: True if the subnet was in use
+        """
+        idx = self._get_index(net_int)
+        if idx is None or not self._is_set(idx):
+            return False
+        self._unset(idx)
+        self.free_list.append(idx)
+        return True
+
+    def save(self):
+        """
+        Save the allocator state file (atomic replace).
+        """
+        import os
+        import pickle
+
+        if not self.fname:
+            return
+        state = {'base': self.base,
+                 'size': self.size,
+                 'bitmap': bytes(self.bitmap),
+                 'free_list': list(self.free_list),
+                 'cursor': self.cursor,
+                 'used': self.used}
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_name = self.fname + '.tmp'
+        with open(tmp_name, 'wb') as f:
+            pickle.dump(state, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_name, self.fname)
+
+    def sync(self, net_trie):
+        """
+        Rebuild the in-use set from the network payloads in the net trie;
+        unused subnets below the cursor go back on the free-list.
+        :param net_trie: net data trie
+        """
+        self.clear()
+        last = -1
+        for key in [x for x in list(net_trie) if len(x) == 16]:
+            net_int = get_net_subnet(net_trie[key], self.prefix)
+            idx = None if net_int is None else self._get_index(net_int)
+            if idx is not None:
+                if not self._is_set(idx):
+                    self._set(idx)
+                last = max(last, idx)
+        self.cursor = last + 1
+        self.free_list = deque(idx for idx in range(last + 1) if not self._is_set(idx))
+        self.synced = True
+        logger.debug('ALLOC: {} subnets in use after sync'.format(self.used))
+
+
+def open_subnet_allocator(directory=None):
+    """
+    Get the ctlr subnet allocator, loading it from the state file in
+    `directory` (default is the cache dir) the first time.
+    :param directory: allocator state directory
+    :return: <SubnetAllocator> object
+    """
+    from node_tools import ctlr_data as ct
+    from node_tools.helper_funcs import get_cachedir
+
+    if ct.subnets is None:
+        if not directory:
+            directory = get_cachedir('subnet_alloc')
+        ct.subnets = SubnetAllocator(directory)
+        logger.debug('ALLOC: opened subnet allocator in {}'.format(directory))
+    return ct.subnets
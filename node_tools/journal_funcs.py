@@ -0,0 +1,147 @@
+# coding: utf-8
+
+"""Write-ahead journal functions for the ctlr state tries."""
+
+import logging
+import os
+import pickle
+
+
+logger = logging.getLogger(__name__)
+
+
+class TrieJournal(object):
+    """
+    Append-only journal of state trie mutations.  Records are pickled
+    (trie name, op, key, value) tuples; writes are buffered and flushed
+    with a single fsync every `sync_every` records (or on sync()).
+    :param fname: journal file path
+    :param sync_every: number of records per fsync batch
+    """
+    def __init__(self, fname, sync_every=64):
+        self.fname = fname
+        self.sync_every = sync_every
+        self.pending = 0
+        self.fobj = open(fname, 'ab')
+
+    def append(self, name, op, key=None, value=None):
+        """
+        Append one trie mutation record.
+        :param name: trie name
+        :param op: one of 'set', 'del', or 'clear'
+        :param key: trie key
+        :param value: trie payload (for 'set')
+        """
+        pickle.dump((name, op, key, value), self.fobj)
+        self.pending += 1
+        if self.pending >= self.sync_every:
+            self.sync()
+
+    def close(self):
+        if not self.fobj.closed:
+            self.sync()
+            self.fobj.close()
+
+    def sync(self):
+        """
+        Flush and fsync any pending records.
+        """
+        if self.pending:
+            self.fobj.flush()
+            os.fsync(self.fobj.fileno())
+            self.pending = 0
+
+    def truncate(self):
+        """
+        Drop all journal records (after compaction into a snapshot).
+        """
+        self.fobj.flush()
+        self.fobj.truncate(0)
+        os.fsync(self.fobj.fileno())
+        self.pending = 0
+
+
+def replay_journal(fname, tries):
+    """
+    Apply the journal records in `fname` to the given tries; stops at
+    the first truncated or unreadable record.
+    :param fname: journal file path
+    :param tries: dict of trie name: trie object
+    :return: number of records applied
+    """
+    count = 0
+    if not os.path.isfile(fname):
+        return count
+
+    with open(fname, 'rb') as f:
+        while True:
+            try:
+                name, op, key, value = pickle.load(f)
+            except EOFError:
+                break
+            except Exception as exc:
+                logger.warning('JOURNAL: stopped at bad record {} ({})'.format(count, exc))
+                break
+            trie = tries.get(name)
+            if trie is None:
+                continue
+            if op == 'set':
+                trie[key] = value
+            elif op == 'del':
+                trie.pop(key, None)
+            elif op == 'clear':
+                trie.clear()
+            count += 1
+
+    logger.debug('JOURNAL: replayed {} records from {}'.format(count, fname))
+    return count
+
+
+def open_ctlr_journal(snap_dir=None, sync_every=64):
+    """
+    Warm start the ctlr state tries from the last snapshot plus the
+    journal (no API calls), then attach a new journal to both tries.
+    :param snap_dir: snapshot/journal directory (default is the cache dir)
+    :param sync_every: number of records per fsync batch
+    :return: <TrieJournal> object
+    """
+    from node_tools import ctlr_data as ct
+    from node_tools.helper_funcs import get_cachedir
+    from node_tools.trie_funcs import load_ctlr_snapshot
+
+    if not snap_dir:
+        snap_dir = get_cachedir('ctlr_snapshot')
+    fname = os.path.join(snap_dir, 'journal.pkl')
+
+    close_ctlr_journal()
+    load_ctlr_snapshot(snap_dir)
+    replay_journal(fname, {'net_trie': ct.net_trie, 'id_trie': ct.id_trie})
+
+    ct.journal = TrieJournal(fname, sync_every)
+    for trie in [ct.net_trie, ct.id_trie]:
+        trie.journal = ct.journal
+    logger.info('JOURNAL: opened journal {}'.format(fname))
+    return ct.journal
+
+
+def close_ctlr_journal():
+    """
+    Detach and close the ctlr journal (if any).
+    """
+    from node_tools import ctlr_data as ct
+
+    if ct.journal is not None:
+        for trie in [ct.net_trie, ct.id_trie]:
+            trie.journal = None
+        ct.journal.close()
+        ct.journal = None
+
+
+def sync_ctlr_journal():
+    """
+    Flush pending ctlr journal records (if any).
+    """
+    from node_tools import ctlr_data as ct
+
+    if ct.journal is not None:
+        ct.journal.sync()
@@ -0,0 +1,124 @@
+# coding: utf-8
+
+"""Cache metrics (read/write counters and transaction timing)."""
+
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (in msec) of the transaction latency histogram buckets
+LATENCY_BUCKETS = [1, 5, 10, 50, 100, 500, 1000]
+
+COUNTER_NAMES = ['reads', 'hits', 'misses', 'written', 'skipped',
+                 'expired', 'deleted', 'bytes']
+
+
+class CacheMetrics(object):
+    """
+    Per key type counters for the cache_funcs entry points: entry reads
+    (and view cache hits/misses), writes, skipped (unchanged) writes,
+    expired and deleted entries, bytes serialized, plus a latency
+    histogram of the (outermost) cache transactions.  Use snapshot() to
+    get a plain dict for logging or export.
+    """
+    def __init__(self):
+        self.local = threading.local()
+        self.reset()
+
+    def count(self, key_type, name, num=1):
+        """
+        Add to a counter for a key type.
+        :param key_type: key type string
+        :param name: counter name (see COUNTER_NAMES)
+        :param num: amount to add
+        """
+        counters = self.types.get(key_type)
+        if counters is None:
+            counters = self.types[key_type] = dict.fromkeys(COUNTER_NAMES, 0)
+        counters[name] += num
+
+    def observe(self, key_type, elapsed):
+        """
+        Record a transaction duration for a key type.
+        :param key_type: key type string
+        :param elapsed: duration in seconds
+        """
+        msec = elapsed * 1000
+        hist = self.latency.get(key_type)
+        if hist is None:
+            hist = self.latency[key_type] = {'count': 0,
+                                             'total_ms': 0.0,
+                                             'max_ms': 0.0,
+                                             'buckets': [0] * (len(LATENCY_BUCKETS) + 1)}
+        hist['count'] += 1
+        hist['total_ms'] += msec
+        hist['max_ms'] = max(hist['max_ms'], msec)
+        for idx, bound in enumerate(LATENCY_BUCKETS):
+            if msec <= bound:
+                hist['buckets'][idx] += 1
+                break
+        else:
+            hist['buckets'][-1] += 1
+
+    def reset(self):
+        self.types = {}
+        self.latency = {}
+        self.started = time.time()
+
+    def snapshot(self):
+        """
+        Get a copy of the current metrics.
+        :return: `dict` of counters and latency histograms by key type
+        """
+        labels = ['<={}ms'.format(x) for x in LATENCY_BUCKETS]
+        labels.append('>{}ms'.format(LATENCY_BUCKETS[-1]))
+        latency = {}
+        for key_type, hist in self.latency.items():
+            latency[key_type] = {'count': hist['count'],
+                                 'total_ms': round(hist['total_ms'], 3),
+                                 'max_ms': round(hist['max_ms'], 3),
+                                 'buckets': dict(zip(labels, hist['buckets']))}
+        return {'since': self.started,
+                'interval': round(time.time() - self.started, 3),
+                'types': {k: dict(v) for k, v in self.types.items()},
+                'transact': latency}
+
+    @contextmanager
+    def transact(self, cache, key_type):
+        """
+        Cache transaction context that records its duration for a key
+        type (nested transactions are only timed once, by the outermost
+        context).
+        :param cache: Index <cache> object
+        :param key_type: key type string
+        """
+        depth = getattr(self.local, 'depth', 0)
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            with cache.transact():
+                yield
+        finally:
+            self.local.depth = depth
+            if not depth:
+                self.observe(key_type, time.perf_counter() - start)
+
+
+cache_metrics = CacheMetrics()
+
+
+def get_cache_metrics(reset=False):
+    """
+    Get a snapshot of the cache metrics for this process.
+    :param reset: if True, restart the counters after the snapshot
+    :return: `dict` of cache metrics
+    """
+    snapshot = cache_metrics.snapshot()
+    if reset:
+        cache_metrics.reset()
+    return snapshot
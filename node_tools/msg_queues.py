@@ -3,15 +3,210 @@
 """msg queue-specific helper functions."""
 import logging
 
+from contextlib import contextmanager
+
+from diskcache import Deque
+from diskcache.core import ENOVAL
+
 
 logger = logging.getLogger('node_tools.msg_queues')
 
+# slot key tag for unhashable (eg, dict) queue items
+JSON_SLOT = object()
+
+
+class IndexedDeque(Deque):
+    """
+    Persistent diskcache Deque plus an in-memory index of queue items to
+    their cache keys, so membership tests, counts, unique appends and
+    removals are O(1) instead of a scan of the whole queue.  The order
+    and on-disk format are the same as Deque (FIFO, shared directories
+    are fine).  The index is rebuilt with one scan whenever the SQLite
+    data_version shows a commit from another connection (eg, another
+    daemon using the same queue), and after the bulk mutators (extend,
+    rotate, reverse, item assignment, etc).
+    :notes: items must be hashable or JSON-serializable (eg, dicts)
+    """
+    slots = None
+    version = None
+
+    def __contains__(self, value):
+        self.sync()
+        return self._get_slot(value) in self.slots
+
+    def __delitem__(self, index):
+        super(IndexedDeque, self).__delitem__(index)
+        self.version = None
+
+    def __setitem__(self, index, value):
+        super(IndexedDeque, self).__setitem__(index, value)
+        self.version = None
+
+    @staticmethod
+    def _get_slot(value):
+        try:
+            hash(value)
+            return value
+        except TypeError:
+            import json
+            return (JSON_SLOT, json.dumps(value, sort_keys=True, default=str))
+
+    def _get_version(self):
+        from node_tools.cache_funcs import get_data_version
+
+        return get_data_version(self._cache)
+
+    def _add_key(self, value, key, side='back'):
+        keys = self.slots.setdefault(self._get_slot(value), [])
+        if side == 'front':
+            keys.insert(0, key)
+        else:
+            keys.append(key)
+
+    def _drop_key(self, value, key):
+        slot = self._get_slot(value)
+        keys = self.slots.get(slot, [])
+        if key in keys:
+            keys.remove(key)
+        if not keys:
+            self.slots.pop(slot, None)
+
+    def add_unique(self, value):
+        """
+        Append value to the back of the queue if not already present.
+        :param value: queue item
+        :return: True if the value was added
+        """
+        with self.transact():
+            if value in self:
+                return False
+            self.append(value)
+            return True
+
+    def append(self, value):
+        self.sync()
+        self._add_key(value, self._cache.push(value, retry=True))
+
+    def appendleft(self, value):
+        self.sync()
+        self._add_key(value, self._cache.push(value, side='front', retry=True), side='front')
+
+    def clear(self):
+        super(IndexedDeque, self).clear()
+        self.slots = {}
+        self.version = None
+
+    def count(self, value):
+        self.sync()
+        return len(self.slots.get(self._get_slot(value), []))
+
+    def extend(self, iterable):
+        super(IndexedDeque, self).extend(iterable)
+        self.version = None
+
+    def extendleft(self, iterable):
+        super(IndexedDeque, self).extendleft(iterable)
+        self.version = None
+
+    def pop(self):
+        self.sync()
+        key, value = self._cache.pull(default=(None, ENOVAL), side='back', retry=True)
+        if value is ENOVAL:
+            raise IndexError('pop from an empty deque')
+        self._drop_key(value, key)
+        return value
+
+    def popleft(self):
+        self.sync()
+        key, value = self._cache.pull(default=(None, ENOVAL), retry=True)
+        if value is ENOVAL:
+            raise IndexError('pop from an empty deque')
+        self._drop_key(value, key)
+        return value
+
+    def rebuild(self, version=None):
+        """
+        Rebuild the item index from the queue (one full scan).
+        :param version: queue version at the start of the scan
+        """
+        slots = {}
+        for key in self._cache.iterkeys():
+            try:
+                value = self._cache[key]
+            except KeyError:
+                continue
+            slots.setdefault(self._get_slot(value), []).append(key)
+        self.slots = slots
+        self.version = version
+
+    def remove(self, value):
+        """
+        Remove the first occurrence of value.
+        :param value: queue item
+        :raises: ValueError if value is not in the queue
+        """
+        self.sync()
+        keys = self.slots.get(self._get_slot(value))
+        if not keys:
+            raise ValueError('deque.remove(value): value not in deque')
+        key = keys[0]
+        try:
+            del self._cache[key]
+        except KeyError:
+            self.version = None
+            return super(IndexedDeque, self).remove(value)
+        self._drop_key(value, key)
+
+    def remove_all(self, value):
+        """
+        Remove all occurrences of value.
+        :param value: queue item
+        :return: number of items removed
+        """
+        with self.transact():
+            self.sync()
+            keys = self.slots.pop(self._get_slot(value), [])
+            for key in keys:
+                self._cache.pop(key, None)
+        return len(keys)
+
+    def reverse(self):
+        super(IndexedDeque, self).reverse()
+        self.version = None
+
+    def rotate(self, steps=1):
+        super(IndexedDeque, self).rotate(steps)
+        self.version = None
+
+    def sync(self):
+        """
+        Rebuild the item index if the queue was changed by another
+        connection.
+        """
+        version = self._get_version()
+        if version != self.version or self.slots is None:
+            self.rebuild(version)
+
+    @contextmanager
+    def transact(self):
+        """
+        Same as Deque.transact (the index is rebuilt after a rollback).
+        """
+        try:
+            with super(IndexedDeque, self).transact():
+                yield
+        except BaseException:
+            self.version = None
+            raise
+
 
 def add_one_only(item, deque):
     """
     Add item to deque only if not already present (ie, avoid duplicates).
     """
-    if deque.count(item) < 1:
+    if hasattr(deque, 'add_unique'):
+        deque.add_unique(item)
+    elif item not in deque:
         deque.append(item)
 
 
@@ -34,23 +229,17 @@ def clean_from_queue(item, deque):
     """
     Remove all instances of item from deque.
     """
-    while deque.count(item) != 0:
-        thing = deque.peek()
-        if thing == item:
-            deque.pop()
-        else:
-            deque.rotate()
+    if hasattr(deque, 'remove_all'):
+        deque.remove_all(item)
+    else:
+        while item in deque:
+            deque.remove(item)
 
 
 def handle_announce_msg(node_q, reg_q, wait_q, msg):
-    for node in list(node_q):
-        if msg == node:
-            with reg_q.transact():
-                reg_q.append(msg)
-    for node in list(wait_q):
-        if msg == node:
-            with reg_q.transact():
-                reg_q.append(msg)
+    for _ in range(node_q.count(msg) + wait_q.count(msg)):
+        with reg_q.transact():
+            reg_q.append(msg)
 
 
 def handle_node_queues(node_q, staging_q):
@@ -142,10 +331,10 @@ def make_version_msg(node_id, version=None):
 def manage_incoming_nodes(node_q, reg_q, wait_q):
     with node_q.transact():
         for node in list(reg_q):
-            if node in list(node_q):
+            if node in node_q:
                 node_q.remove(node)
     for node in list(wait_q):
-        if wait_q.count(node) >= 3 or node in list(reg_q):
+        if wait_q.count(node) >= 3 or node in reg_q:
             clean_from_queue(node, wait_q)
     for node in list(node_q):
         if wait_q.count(node) < 3:
@@ -274,7 +463,7 @@ def wait_for_cfg_msg(cfg_q, hold_q, reg_q, msg):
                 result = item
                 with cfg_q.transact():
                     cfg_q.remove(item)
-                if msg in list(hold_q):
+                if msg in hold_q:
                     with hold_q.transact():
                         clean_from_queue(msg, hold_q)
                 return result
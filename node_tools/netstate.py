@@ -5,8 +5,6 @@ import asyncio
 import aiohttp
 import logging
 
-import diskcache as dc
-
 from ztcli_api import ZeroTier
 from ztcli_api import ZeroTierConnectionError
 
@@ -14,109 +12,142 @@ from node_tools import ctlr_data as ct
 from node_tools import state_data as st
 
 from node_tools.async_funcs import bootstrap_mbr_node
+from node_tools.async_funcs import bootstrap_mbr_nodes
 from node_tools.async_funcs import cleanup_orphans
 from node_tools.async_funcs import close_mbr_net
 from node_tools.async_funcs import offline_mbr_node
+from node_tools.async_funcs import offline_mbr_nodes
 from node_tools.async_funcs import unwrap_mbr_net
-from node_tools.async_funcs import update_state_tries
+from node_tools.async_funcs import refresh_state_tries
 from node_tools.cache_funcs import handle_node_status
-from node_tools.ctlr_funcs import is_exit_node
+from node_tools.cache_funcs import open_cache
 from node_tools.helper_funcs import AttrDict
 from node_tools.helper_funcs import NODE_SETTINGS
 from node_tools.helper_funcs import get_cachedir
 from node_tools.helper_funcs import get_token
+from node_tools.ipv4_funcs import open_subnet_allocator
+from node_tools.journal_funcs import sync_ctlr_journal
+from node_tools.msg_queues import IndexedDeque
 from node_tools.msg_queues import handle_node_queues
 from node_tools.msg_queues import handle_wedged_nodes
 from node_tools.network_funcs import publish_cfg_msg
-from node_tools.trie_funcs import get_active_nodes
-from node_tools.trie_funcs import get_bootstrap_list
+from node_tools.network_funcs import publish_cfg_msgs
+from node_tools.topology_funcs import sync_ring
 
 
 logger = logging.getLogger('netstate')
 
 
-async def main():
-    """State cache updater to retrieve data from a local ZeroTier node."""
-    async with aiohttp.ClientSession() as session:
-        ZT_API = get_token()
-        client = ZeroTier(ZT_API, loop, session)
-
-        try:
-            # handle offline/wedged nodes
-            handle_wedged_nodes(ct.net_trie, wdg_q, off_q)
-            pre_off = list(off_q)
-            logger.debug('{} nodes in offline queue: {}'.format(len(pre_off), pre_off))
+async def run_cycle(client, cache, off_q, node_q, netobj_q, staging_q, wdg_q):
+    """
+    Run one netstate update cycle using an existing API client, cache
+    and queues (see also `node_tools.state_runner`).
+    """
+    max_reqs = NODE_SETTINGS['max_api_requests']
+
+    try:
+        # handle offline/wedged nodes
+        handle_wedged_nodes(ct.net_trie, wdg_q, off_q)
+        pre_off = list(off_q)
+        logger.debug('{} nodes in offline queue: {}'.format(len(pre_off), pre_off))
+        if len(pre_off) > 1:
+            await offline_mbr_nodes(client, pre_off, max_reqs)
+        else:
             for node_id in pre_off:
                 await offline_mbr_node(client, node_id)
-            for node_id in [x for x in off_q if x in pre_off]:
-                off_q.remove(node_id)
-            logger.debug('{} nodes in offline queue: {}'.format(len(off_q), list(off_q)))
-
-            # get ID and status details of ctlr node
-            await client.get_data('status')
-            ctlr_id = handle_node_status(client.data, cache)
-
-            # update ctlr state tries
-            await update_state_tries(client, ct.net_trie, ct.id_trie)
-            logger.debug('net_trie has keys: {}'.format(list(ct.net_trie)))
-            # for key in list(ct.net_trie):
-            #     logger.debug('net key {} has paylod: {}'.format(key, ct.net_trie[key]))
-            # for key in list(ct.id_trie):
-            #     logger.debug('id key {} has payload: {}'.format(key, ct.id_trie[key]))
-            logger.debug('id_trie has keys: {}'.format(list(ct.id_trie)))
-
-            # handle node queues and publish messages
+        for node_id in [x for x in off_q if x in pre_off]:
+            off_q.remove(node_id)
+        logger.debug('{} nodes in offline queue: {}'.format(len(off_q), list(off_q)))
+
+        # get ID and status details of ctlr node
+        await client.get_data('status')
+        ctlr_id = handle_node_status(client.data, cache)
+
+        # update ctlr state tries
+        diff = await refresh_state_tries(client, ct.net_trie, ct.id_trie, ct.revisions, max_reqs)
+        logger.debug('trie diff is: {}'.format(diff))
+        sync_ring(ct.ring, ct.net_trie, ct.id_trie, force=bool(diff[2]))
+        if hasattr(netobj_q, 'sync') and not netobj_q.synced:
+            netobj_q.sync(ct.net_trie)
+        logger.debug('net_trie has keys: {}'.format(list(ct.net_trie)))
+        # for key in list(ct.net_trie):
+        #     logger.debug('net key {} has paylod: {}'.format(key, ct.net_trie[key]))
+        # for key in list(ct.id_trie):
+        #     logger.debug('id key {} has payload: {}'.format(key, ct.id_trie[key]))
+        logger.debug('id_trie has keys: {}'.format(list(ct.id_trie)))
+
+        # handle node queues and publish messages
+        logger.debug('{} nodes in node queue: {}'.format(len(node_q),
+                                                         list(node_q)))
+        if len(node_q) > 0:
+            handle_node_queues(node_q, staging_q)
             logger.debug('{} nodes in node queue: {}'.format(len(node_q),
                                                              list(node_q)))
-            if len(node_q) > 0:
-                handle_node_queues(node_q, staging_q)
-                logger.debug('{} nodes in node queue: {}'.format(len(node_q),
-                                                                 list(node_q)))
-            logger.debug('{} nodes in staging queue: {}'.format(len(staging_q),
-                                                                list(staging_q)))
-
-            for mbr_id in [x for x in staging_q if x not in list(ct.id_trie)]:
-                if is_exit_node(mbr_id):
-                    await bootstrap_mbr_node(client, ctlr_id, mbr_id, netobj_q, ex=True)
-                else:
-                    await bootstrap_mbr_node(client, ctlr_id, mbr_id, netobj_q)
+        logger.debug('{} nodes in staging queue: {}'.format(len(staging_q),
+                                                            list(staging_q)))
+
+        new_nodes = [x for x in staging_q if x not in ct.id_trie]
+        if len(new_nodes) > 1:
+            node_times, _ = await bootstrap_mbr_nodes(client, ctlr_id, new_nodes, netobj_q, max_reqs)
+            for mbr_id in node_times:
+                st.wait_cache.set(mbr_id, True, 90)
+            publish_cfg_msgs(ct.id_trie, list(node_times), addr='127.0.0.1')
+        else:
+            for mbr_id in new_nodes:
+                await bootstrap_mbr_node(client, ctlr_id, mbr_id, netobj_q)
                 st.wait_cache.set(mbr_id, True, 90)
                 publish_cfg_msg(ct.id_trie, mbr_id, addr='127.0.0.1')
 
-            for mbr_id in [x for x in staging_q if x in list(ct.id_trie)]:
-                publish_cfg_msg(ct.id_trie, mbr_id, addr='127.0.0.1')
-                staging_q.remove(mbr_id)
-            logger.debug('{} nodes in staging queue: {}'.format(len(staging_q),
-                                                                list(staging_q)))
-
-            # refresh ctlr state tries again
-            await update_state_tries(client, ct.net_trie, ct.id_trie)
-
-            node_list = get_active_nodes(ct.id_trie)
-            logger.debug('{} nodes in node_list: {}'.format(len(node_list), node_list))
-            if len(node_list) > 0:
-                boot_list = get_bootstrap_list(ct.net_trie, ct.id_trie)
-                logger.debug('{} nodes in boot_list: {}'.format(len(boot_list), boot_list))
-
-                if len(boot_list) != 0:
-                    await close_mbr_net(client, node_list, boot_list, min_nodes=3)
-                else:
-                    await unwrap_mbr_net(client, node_list, boot_list, min_nodes=3)
-
-        except Exception as exc:
-            logger.error('netstate exception was: {}'.format(exc))
-            await cleanup_orphans(client)
-            if list(ct.net_trie) == [] and list(ct.id_trie) != []:
-                ct.id_trie.clear()
-            raise exc
-
-
-cache = dc.Index(get_cachedir())
-off_q = dc.Deque(directory=get_cachedir('off_queue'))
-node_q = dc.Deque(directory=get_cachedir('node_queue'))
-netobj_q = dc.Deque(directory=get_cachedir('netobj_queue'))
-staging_q = dc.Deque(directory=get_cachedir('staging_queue'))
-wdg_q = dc.Deque(directory=get_cachedir('wedge_queue'))
-
-loop = asyncio.get_event_loop()
-loop.run_until_complete(main())
+        for mbr_id in [x for x in staging_q if x in list(ct.id_trie)]:
+            publish_cfg_msg(ct.id_trie, mbr_id, addr='127.0.0.1')
+            staging_q.remove(mbr_id)
+        logger.debug('{} nodes in staging queue: {}'.format(len(staging_q),
+                                                            list(staging_q)))
+
+        # refresh ctlr state tries again
+        diff = await refresh_state_tries(client, ct.net_trie, ct.id_trie, ct.revisions, max_reqs)
+        logger.debug('trie diff is: {}'.format(diff))
+        sync_ring(ct.ring, ct.net_trie, ct.id_trie, force=bool(diff[2]))
+
+        node_list = ct.store.active_nodes()
+        logger.debug('{} nodes in node_list: {}'.format(len(node_list), node_list))
+        if len(node_list) > 0:
+            boot_list = ct.store.bootstrap_list()
+            logger.debug('{} nodes in boot_list: {}'.format(len(boot_list), boot_list))
+
+            if len(boot_list) != 0:
+                await close_mbr_net(client, node_list, boot_list, min_nodes=3)
+            else:
+                await unwrap_mbr_net(client, node_list, boot_list, min_nodes=3)
+
+    except Exception as exc:
+        logger.error('netstate exception was: {}'.format(exc))
+        await cleanup_orphans(client)
+        if list(ct.net_trie) == [] and list(ct.id_trie) != []:
+            ct.id_trie.clear()
+        raise exc
+
+    finally:
+        sync_ctlr_journal()
+        if hasattr(netobj_q, 'save'):
+            netobj_q.save()
+
+
+async def main():
+    """State cache updater to retrieve data from a local ZeroTier node."""
+    async with aiohttp.ClientSession() as session:
+        ZT_API = get_token()
+        client = ZeroTier(ZT_API, loop, session)
+        await run_cycle(client, cache, off_q, node_q, netobj_q, staging_q, wdg_q)
+
+
+if __name__ == '__main__':
+    cache = open_cache()
+    off_q = IndexedDeque(directory=get_cachedir('off_queue'))
+    node_q = IndexedDeque(directory=get_cachedir('node_queue'))
+    netobj_q = open_subnet_allocator()
+    staging_q = IndexedDeque(directory=get_cachedir('staging_queue'))
+    wdg_q = IndexedDeque(directory=get_cachedir('wedge_queue'))
+
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main())
@@ -269,6 +269,32 @@ def publish_cfg_msg(trie, node_id, addr=None):
     logger.debug('CFG: sent cfg msg {} for node {} to {}'.format(msg, node_id, addr))
 
 
+def publish_cfg_msgs(trie, node_list, addr=None):
+    """
+    Publish node cfg messages for a list of nodes using a single
+    publisher connection (see publish_cfg_msg).
+    :param trie: `id_trie` state trie
+    :param node_list: list of mbr node IDs to configure
+    :param addr: IP address of subscriber
+    """
+    import time
+    from nanoservice import Publisher
+    from node_tools.msg_queues import make_cfg_msg
+
+    if NODE_SETTINGS['use_localhost'] or not addr:
+        addr = '127.0.0.1'
+
+    pub = Publisher('tcp://{}:9442'.format(addr))
+
+    # Need to wait a bit on connect to prevent lost messages
+    time.sleep(0.002)
+
+    for node_id in node_list:
+        msg = make_cfg_msg(trie, node_id)
+        pub.publish('cfg_msgs', msg)
+        logger.debug('CFG: sent cfg msg {} for node {} to {}'.format(msg, node_id, addr))
+
+
 @catch_exceptions()
 def run_cleanup_check(cln_q, pub_q):
     """
@@ -0,0 +1,134 @@
+# coding: utf-8
+
+"""Persistent state runner for the netstate/nodestate/peerstate roles."""
+
+import asyncio
+import logging
+
+from node_tools.cache_funcs import open_cache
+from node_tools.helper_funcs import get_cachedir
+from node_tools.ipv4_funcs import open_subnet_allocator
+from node_tools.msg_queues import IndexedDeque
+
+
+logger = logging.getLogger(__name__)
+
+# runner queue args for each role (arg name: cachedir name)
+RUNNER_QUEUES = {
+    'netstate': {'off_q': 'off_queue',
+                 'node_q': 'node_queue',
+                 'netobj_q': 'subnet_alloc',
+                 'staging_q': 'staging_queue',
+                 'wdg_q': 'wedge_queue'},
+    'nodestate': {},
+    'peerstate': {'cfg_q': 'cfg_queue',
+                  'node_q': 'node_queue',
+                  'off_q': 'off_queue',
+                  'wdg_q': 'wedge_queue',
+                  'pub_q': 'pub_queue',
+                  'reg_q': 'reg_queue',
+                  'tmp_q': 'tmp_queue',
+                  'wait_q': 'wait_queue'}
+}
+
+runners = {}
+
+
+class StateRunner(object):
+    """
+    Long-lived runner for one of the state update scripts.  Keeps the
+    cache, queues, event loop, client session and ZeroTier client
+    alive across update cycles, so each cycle only runs the script's
+    `run_cycle()` coroutine.
+    :param role: one of 'netstate', 'nodestate', or 'peerstate'
+    :param loop: event loop (a new loop is created if None)
+    """
+    def __init__(self, role, loop=None):
+        import importlib
+
+        if role not in RUNNER_QUEUES:
+            raise ValueError('Invalid runner role: {}'.format(role))
+        self.role = role
+        self.module = importlib.import_module('node_tools.' + role)
+        self.loop = loop if loop is not None else asyncio.new_event_loop()
+        self.cache = open_cache()
+        self.queues = {}
+        for arg, name in RUNNER_QUEUES[role].items():
+            if arg == 'netobj_q':
+                self.queues[arg] = open_subnet_allocator(get_cachedir(name))
+            else:
+                self.queues[arg] = IndexedDeque(directory=get_cachedir(name))
+        self.session = None
+        self.client = None
+
+    def save(self):
+        """
+        Save the state of any runner queues that are not saved on write
+        (eg, the subnet allocator).
+        """
+        for queue in self.queues.values():
+            if hasattr(queue, 'save'):
+                queue.save()
+
+    async def start(self):
+        """
+        Open the client session and ZeroTier client (if needed).
+        """
+        import aiohttp
+
+        from ztcli_api import ZeroTier
+        from node_tools.helper_funcs import get_token
+
+        if self.session is None or self.session.closed:
+            ZT_API = get_token()
+            self.session = aiohttp.ClientSession()
+            self.client = ZeroTier(ZT_API, self.loop, self.session)
+            logger.debug('RUNNER: opened client session for {}'.format(self.role))
+
+    async def run_once(self):
+        """
+        Run one update cycle for this role (the queue state is saved
+        even if the cycle fails).
+        """
+        await self.start()
+        try:
+            await self.module.run_cycle(self.client, self.cache, **self.queues)
+        finally:
+            self.save()
+
+    def run(self):
+        """
+        Synchronous wrapper for run_once() (runs on the runner loop).
+        """
+        return self.loop.run_until_complete(self.run_once())
+
+    def close(self):
+        """
+        Close the client session and the runner event loop.
+        """
+        if self.session is not None and not self.session.closed:
+            self.loop.run_until_complete(self.session.close())
+        self.session = None
+        self.client = None
+        if not self.loop.is_closed():
+            self.loop.close()
+
+
+def get_state_runner(scr):
+    """
+    Get (or create) the persistent runner for a state script name.
+    :param scr: runner script name, eg 'netstate.py'
+    :return: <StateRunner> object
+    """
+    role = scr.replace('.py', '')
+    if role not in runners:
+        runners[role] = StateRunner(role)
+    return runners[role]
+
+
+def close_state_runners():
+    """
+    Close and remove all persistent runners (mainly on shutdown).
+    """
+    for role in list(runners):
+        runners.pop(role).close()
@@ -0,0 +1,342 @@
+# coding: utf-8
+
+"""Member ring/chain topology functions."""
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class MemberRing(object):
+    """
+    Doubly-linked member topology for the bootstrap chain and the closed
+    network.  Each node entry holds its own (src) net, its exit net, and
+    its upstream (exit) and downstream (src) neighbor nodes.  Nodes with
+    no downstream neighbor are tracked in `open_nodes` (a dict used as an
+    insertion-ordered set), so the chain head, tail (insertion point) and
+    neighbor lookups do not need a trie walk.
+    :notes: the ring is updated by the async handlers as they link and
+            unlink nodes; use rebuild_ring() to resync it from the tries.
+    """
+    def __init__(self):
+        self.nodes = {}
+        self.open_nodes = {}
+        self.synced = None
+        self.version = 0
+
+    def __contains__(self, node_id):
+        return node_id in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add_node(self, node_id, src_net):
+        """
+        Add a new (unlinked) node with its src net, or update the src
+        net of an existing node.
+        :param node_id: node ID
+        :param src_net: network ID of the net with node as gateway
+        """
+        self.version += 1
+        if node_id in self.nodes:
+            self.nodes[node_id]['src_net'] = src_net
+        else:
+            self.nodes[node_id] = {'src_net': src_net,
+                                   'exit_net': None,
+                                   'up': None,
+                                   'down': None}
+            self.open_nodes[node_id] = None
+
+    def clear(self):
+        self.nodes = {}
+        self.open_nodes = {}
+        self.version += 1
+
+    def link(self, node_id, exit_net, up_node):
+        """
+        Link a node to its upstream node via the upstream src net.
+        :param node_id: node ID (must already be in the ring)
+        :param exit_net: network ID of the upstream src net
+        :param up_node: upstream (gateway) node ID
+        """
+        self.version += 1
+        node = self.nodes[node_id]
+        node['exit_net'] = exit_net
+        node['up'] = up_node
+        if up_node in self.nodes:
+            self.nodes[up_node]['down'] = node_id
+            self.open_nodes.pop(up_node, None)
+
+    def unlink(self, node_id):
+        """
+        Detach a node from its upstream node (the node keeps its src net
+        and downstream neighbor).
+        :param node_id: node ID
+        """
+        node = self.nodes.get(node_id)
+        if node is None:
+            return
+        self.version += 1
+        up_node = node['up']
+        if up_node in self.nodes and self.nodes[up_node]['down'] == node_id:
+            self.nodes[up_node]['down'] = None
+            self.open_nodes[up_node] = None
+        node['exit_net'] = None
+        node['up'] = None
+
+    def remove(self, node_id):
+        """
+        Remove a node and detach both of its neighbors.
+        :param node_id: node ID
+        """
+        if node_id not in self.nodes:
+            return
+        self.unlink(node_id)
+        self.version += 1
+        down_node = self.nodes[node_id]['down']
+        if down_node in self.nodes and self.nodes[down_node]['up'] == node_id:
+            self.nodes[down_node]['exit_net'] = None
+            self.nodes[down_node]['up'] = None
+        del self.nodes[node_id]
+        self.open_nodes.pop(node_id, None)
+
+    def neighbors(self, node_id):
+        """
+        Get the nets and neighbor nodes for a node (same order as
+        trie_funcs.get_neighbor_ids).
+        :param node_id: node ID
+        :return: tuple of src_net, exit_net, src_node, exit_node
+        """
+        node = self.nodes[node_id]
+        return node['src_net'], node['exit_net'], node['down'], node['up']
+
+    def head(self):
+        """
+        Get the first node downstream from the exit node.
+        :return: node ID or None
+        """
+        from node_tools.ctlr_funcs import get_exit_node_id
+
+        exit_node = self.nodes.get(get_exit_node_id())
+        if exit_node is not None:
+            return exit_node['down']
+
+    def dangling(self):
+        """
+        Get the insertion point for the next bootstrap node, ie, the src
+        net and node ID at the end of the chain (or the exit node).  If
+        there is more than one open node, the oldest one wins.
+        :return: list of network ID and node ID (same as find_dangling_nets)
+        """
+        from node_tools.ctlr_funcs import get_exit_node_id
+
+        exit_id = get_exit_node_id()
+        for node_id in self.open_nodes:
+            if node_id != exit_id and self.nodes[node_id]['up'] is not None:
+                return [self.nodes[node_id]['src_net'], node_id]
+        if exit_id in self.open_nodes:
+            return [self.nodes[exit_id]['src_net'], exit_id]
+        return []
+
+    def tail(self):
+        """
+        Get the last node in the bootstrap chain.
+        :return: node ID or None
+        """
+        data_list = self.dangling()
+        if data_list:
+            return data_list[1]
+
+    def bootstrap_list(self):
+        """
+        Get the nodes in the bootstrap chain, starting from the tail.
+        :return: list of node IDs (empty list if None)
+        """
+        from node_tools.ctlr_funcs import is_exit_node
+
+        node_list = []
+        node_id = self.tail()
+
+        while node_id is not None and not is_exit_node(node_id):
+            if node_id in node_list or node_id not in self.nodes:
+                logger.error('RING: broken chain at {}'.format(node_id))
+                return []
+            node_list.append(node_id)
+            node_id = self.nodes[node_id]['up']
+        return node_list
+
+
+class TopologyStore(object):
+    """
+    Query layer over the net/id state tries (and member ring) with
+    memoized derived views.  Views are cached until the trie or ring
+    `version` counters (or the exit node setting) change, so repeated
+    queries within a netstate cycle do not rescan the tries.
+    :param net_trie: net data trie (a StateTrie)
+    :param id_trie: ID state trie (a StateTrie)
+    :param ring: <MemberRing> object
+    """
+    def __init__(self, net_trie, id_trie, ring=None):
+        self.net_trie = net_trie
+        self.id_trie = id_trie
+        self.ring = ring
+        self.views = {}
+        self.views_key = None
+
+    def _get_key(self):
+        from node_tools.helper_funcs import NODE_SETTINGS
+
+        versions = [getattr(x, 'version', None) for x in [self.net_trie, self.id_trie]]
+        if None in versions:
+            return None
+        if self.ring is not None:
+            versions.append(self.ring.version)
+        return tuple(versions + NODE_SETTINGS['use_exitnode'])
+
+    def _get_view(self, name, func):
+        key = self._get_key()
+        if key is None:
+            return func()
+        if key != self.views_key:
+            self.views = {}
+            self.views_key = key
+        if name not in self.views:
+            self.views[name] = func()
+        return self.views[name]
+
+    def active_nodes(self):
+        """
+        Same as trie_funcs.get_active_nodes.
+        :return: list of node IDs (except the exit node)
+        """
+        from node_tools.ctlr_funcs import is_exit_node
+
+        return list(self._get_view('active_nodes',
+                                   lambda: [x for x in self.node_ids() if not is_exit_node(x)]))
+
+    def bootstrap_list(self):
+        """
+        Same as trie_funcs.get_bootstrap_list (using the ring if set).
+        :return: list of node IDs (empty list if None)
+        """
+        from node_tools.trie_funcs import get_bootstrap_list
+
+        return list(self._get_view('bootstrap_list',
+                                   lambda: get_bootstrap_list(self.net_trie,
+                                                              self.id_trie,
+                                                              self.ring)))
+
+    def dangling_net(self):
+        """
+        Same as trie_funcs.find_dangling_nets.
+        :return: list of network ID and attached node ID
+        """
+        def find_view():
+            net_list = []
+            for net in self.net_ids():
+                if self.id_trie[net][1] == [False, True]:
+                    net_list = [net, self.id_trie[net][0][0]]
+            return net_list
+
+        return list(self._get_view('dangling_net', find_view))
+
+    def exit_net(self):
+        """
+        Same as trie_funcs.find_exit_net.
+        :return: network ID list for the (only) network on the exit node
+        """
+        def find_view():
+            net_list = []
+            for node in self.node_ids():
+                if self.id_trie[node][1] == [False, False] and len(self.id_trie[node][0]) == 1:
+                    net_list = self.id_trie[node][0]
+            return net_list
+
+        return list(self._get_view('exit_net', find_view))
+
+    def net_ids(self):
+        """
+        :return: list of network IDs in the ID trie
+        """
+        return list(self._get_view('net_ids',
+                                   lambda: [x for x in self.id_trie.keys() if len(x) == 16]))
+
+    def node_ids(self):
+        """
+        :return: list of node IDs in the ID trie
+        """
+        return list(self._get_view('node_ids',
+                                   lambda: [x for x in self.id_trie.keys() if len(x) == 10]))
+
+
+def get_ring_neighbors(ring, net_trie, node_id):
+    """
+    Get the neighbor IDs for a node from the ring, falling back to the
+    net trie if the node is not in the ring.
+    :param ring: <MemberRing> object
+    :param net_trie: net data trie
+    :param node_id: node ID to lookup
+    :return: tuple of src_net, exit_net, src_node, exit_node
+    """
+    from node_tools.trie_funcs import get_neighbor_ids
+
+    if node_id in ring:
+        return ring.neighbors(node_id)
+    return get_neighbor_ids(net_trie, node_id)
+
+
+def rebuild_ring(ring, net_trie, id_trie):
+    """
+    Rebuild the ring from the current state tries.
+    :param ring: <MemberRing> object
+    :param net_trie: net data trie
+    :param id_trie: ID state trie
+    """
+    from node_tools.trie_funcs import get_neighbor_ids
+
+    ring.clear()
+    links = []
+
+    for node_id in [x for x in list(id_trie) if len(x) == 10]:
+        try:
+            src_net, exit_net, _, exit_node = get_neighbor_ids(net_trie, node_id)
+        except Exception as exc:
+            logger.warning('RING: skipping node {} ({})'.format(node_id, exc))
+            continue
+        ring.add_node(node_id, src_net)
+        if exit_net is not None:
+            links.append((node_id, exit_net, exit_node))
+    for node_id, exit_net, exit_node in links:
+        ring.link(node_id, exit_net, exit_node)
+    logger.debug('RING: rebuilt ring with {} nodes'.format(len(ring)))
+
+
+def sync_ring(ring, net_trie, id_trie, force=False):
+    """
+    Rebuild the ring if it does not match the node IDs in the ID trie.
+    Skips the ID trie scan if neither trie (nor the ring) has changed
+    since the last sync.
+    :param ring: <MemberRing> object
+    :param net_trie: net data trie
+    :param id_trie: ID state trie
+    :param force: rebuild even if the node IDs match
+    :return: True if the ring was rebuilt
+    """
+    def get_key():
+        versions = [getattr(x, 'version', None) for x in [net_trie, id_trie]]
+        if None in versions:
+            return None
+        return tuple(versions + [ring.version])
+
+    key = get_key()
+    if not force and key is not None and key == ring.synced:
+        return False
+
+    rebuilt = False
+    node_ids = [x for x in list(id_trie) if len(x) == 10]
+    if force or len(node_ids) != len(ring) or not all(x in ring for x in node_ids):
+        rebuild_ring(ring, net_trie, id_trie)
+        rebuilt = True
+    ring.synced = get_key()
+    return rebuilt
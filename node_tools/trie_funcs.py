@@ -9,6 +9,193 @@ import datrie
 
 logger = logging.getLogger(__name__)
 
+SNAPSHOT_FILES = ['net_trie.dat', 'id_trie.dat', 'revisions.json']
+
+_MISSING = object()
+
+
+class TrieRecord(object):
+    """
+    Compact net/member payload for the net state trie.  Only the fields
+    used by the trie/topology code are kept as attributes (routes are
+    kept in full, eg, with any flags/metric fields); the full ZT JSON
+    object is kept as a compressed blob and decoded on demand (for any
+    other key, or via `data`).  Supports read-only dict-style access.
+    """
+    __slots__ = ('authorized', 'ipAssignments', 'revision', 'routes', '_blob')
+
+    FIELDS = ('authorized', 'ipAssignments', 'revision', 'routes')
+
+    def __init__(self, data):
+        self._set_blob(data)
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return getattr(self, key) is not _MISSING
+        return key in self.data
+
+    def __eq__(self, other):
+        if isinstance(other, TrieRecord):
+            return self._blob == other._blob or self.data == other.data
+        return self.data == other
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not _MISSING:
+                if key == 'routes':
+                    value = [dict(x) for x in value]
+                return value
+        return self.data[key]
+
+    def __getstate__(self):
+        return self._blob
+
+    def __repr__(self):
+        return 'TrieRecord({!r})'.format(self.data)
+
+    def __setstate__(self, state):
+        import json
+        import zlib
+
+        self._set_blob(json.loads(zlib.decompress(state).decode()))
+
+    def _set_blob(self, data):
+        import json
+        import zlib
+
+        for key in self.FIELDS:
+            setattr(self, key, data.get(key, _MISSING))
+        if self.routes is not _MISSING:
+            self.routes = tuple(dict(x) for x in self.routes)
+        self._blob = zlib.compress(json.dumps(data).encode())
+
+    @property
+    def data(self):
+        """
+        Full ZT JSON object (decoded from the blob).
+        """
+        import json
+        import zlib
+
+        return json.loads(zlib.decompress(self._blob).decode())
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+
+class StateTrie(datrie.Trie):
+    """
+    State trie with mutation hooks; every key insert/delete (and clear)
+    runs the matching `on_*` hook, which bumps the trie `version` and
+    appends the mutation to the trie journal (if one is attached, see
+    journal_funcs).
+    :param name: trie name used in journal records
+    """
+    def __init__(self, *args, **kwargs):
+        self.name = kwargs.pop('name', None)
+        super(StateTrie, self).__init__(*args, **kwargs)
+        self.journal = None
+        self.version = 0
+
+    def __setitem__(self, key, value):
+        super(StateTrie, self).__setitem__(key, value)
+        self.on_set(key, value)
+
+    def __delitem__(self, key):
+        super(StateTrie, self).__delitem__(key)
+        self.on_del(key)
+
+    def clear(self):
+        super(StateTrie, self).clear()
+        self.on_clear()
+
+    def on_clear(self):
+        self.version += 1
+        if self.journal is not None:
+            self.journal.append(self.name, 'clear')
+
+    def on_del(self, key):
+        self.version += 1
+        if self.journal is not None:
+            self.journal.append(self.name, 'del', key)
+
+    def on_set(self, key, value):
+        self.version += 1
+        if self.journal is not None:
+            self.journal.append(self.name, 'set', key, value)
+
+    def pop(self, key, *args):
+        found = key in self
+        value = super(StateTrie, self).pop(key, *args)
+        if found:
+            self.on_del(key)
+        return value
+
+    def setdefault(self, key, value=None):
+        if key not in self:
+            self[key] = value
+        return self[key]
+
+
+class NetTrie(StateTrie):
+    """
+    Net state trie with a reverse index of node ID -> [net IDs] for the
+    member (net ID + node ID) keys.  The index is updated on every key
+    insert and delete, so node lookups do not need a full key scan.
+    Dict payloads are stored as compact TrieRecord objects.
+    """
+    def __init__(self, *args, **kwargs):
+        super(NetTrie, self).__init__(*args, **kwargs)
+        self.node_nets = {}
+
+    def __setitem__(self, key, value):
+        if isinstance(value, dict):
+            value = TrieRecord(value)
+        super(NetTrie, self).__setitem__(key, value)
+
+    @classmethod
+    def read(cls, f):
+        trie = super(NetTrie, cls).read(f)
+        trie.rebuild_index()
+        return trie
+
+    def add_index(self, key):
+        import bisect
+
+        if len(key) > 16:
+            net_list = self.node_nets.setdefault(key[16:], [])
+            if key[0:16] not in net_list:
+                bisect.insort(net_list, key[0:16])
+
+    def del_index(self, key):
+        if len(key) > 16:
+            net_list = self.node_nets.get(key[16:], [])
+            if key[0:16] in net_list:
+                net_list.remove(key[0:16])
+            if not net_list:
+                self.node_nets.pop(key[16:], None)
+
+    def on_clear(self):
+        self.node_nets = {}
+        super(NetTrie, self).on_clear()
+
+    def on_del(self, key):
+        self.del_index(key)
+        super(NetTrie, self).on_del(key)
+
+    def on_set(self, key, value):
+        self.add_index(key)
+        super(NetTrie, self).on_set(key, value)
+
+    def rebuild_index(self):
+        self.node_nets = {}
+        for key in self.keys():
+            self.add_index(key)
+
 
 def create_state_trie(prefix='trie', ext='.dat'):
     """
@@ -39,6 +226,83 @@ def save_state_trie(trie, fname):
     trie.save(fname)
 
 
+def load_ctlr_snapshot(snap_dir=None):
+    """
+    Load the ctlr state tries and member revisions from the last saved
+    snapshot (warm start).  Loaded data only needs a revision diff
+    against the live API (see refresh_state_tries).
+    :param snap_dir: snapshot directory (default is the cache dir)
+    :return: True if a snapshot was loaded
+    """
+    import json
+    import os
+
+    from node_tools import ctlr_data as ct
+    from node_tools.helper_funcs import get_cachedir
+
+    if not snap_dir:
+        snap_dir = get_cachedir('ctlr_snapshot')
+    fnames = [os.path.join(snap_dir, x) for x in SNAPSHOT_FILES]
+    if not all(os.path.isfile(x) for x in fnames):
+        logger.debug('SNAPSHOT: no snapshot found in {}'.format(snap_dir))
+        return False
+
+    try:
+        net_trie = load_state_trie(fnames[0])
+        id_trie = load_state_trie(fnames[1])
+        with open(fnames[2], 'r') as f:
+            revs = json.load(f)
+    except Exception as exc:
+        logger.warning('SNAPSHOT: cannot load snapshot ({})'.format(exc))
+        return False
+
+    for trie, data in [(ct.net_trie, net_trie), (ct.id_trie, id_trie)]:
+        trie.clear()
+        trie.update(data.items())
+    ct.revisions.clear()
+    ct.revisions.update({k: tuple(v) for k, v in revs.items()})
+    logger.info('SNAPSHOT: loaded {} net keys and {} id keys'.format(len(ct.net_trie),
+                                                                     len(ct.id_trie)))
+    return True
+
+
+def save_ctlr_snapshot(snap_dir=None):
+    """
+    Save the ctlr state tries and member revisions to a snapshot dir;
+    each file is written to a temp file first and then replaced.  The
+    ctlr journal in the same dir is truncated after a good snapshot.
+    :param snap_dir: snapshot directory (default is the cache dir)
+    :return: True if the snapshot was saved
+    """
+    import json
+    import os
+
+    from node_tools import ctlr_data as ct
+    from node_tools.helper_funcs import get_cachedir
+
+    if not snap_dir:
+        snap_dir = get_cachedir('ctlr_snapshot')
+    fnames = [os.path.join(snap_dir, x) for x in SNAPSHOT_FILES]
+
+    try:
+        save_state_trie(ct.net_trie, fnames[0] + '.tmp')
+        save_state_trie(ct.id_trie, fnames[1] + '.tmp')
+        with open(fnames[2] + '.tmp', 'w') as f:
+            json.dump(ct.revisions, f)
+        for fname in fnames:
+            os.replace(fname + '.tmp', fname)
+    except Exception as exc:
+        logger.error('SNAPSHOT: cannot save snapshot ({})'.format(exc))
+        return False
+
+    # compact the journal (if any) into this snapshot
+    if ct.journal is not None and os.path.dirname(ct.journal.fname) == snap_dir:
+        ct.journal.truncate()
+
+    logger.debug('SNAPSHOT: saved {} net keys to {}'.format(len(ct.net_trie), snap_dir))
+    return True
+
+
 def check_trie_params(nw_id, node_id, needs):
     """Check load/update trie params for correctness"""
 
@@ -71,6 +335,7 @@ def cleanup_state_tries(net_trie, id_trie, nw_id, node_id, mbr_only=False):
         del net_trie[mbr_key]
         del id_trie[node_id]
     else:
+        release_net_subnet(net_trie, nw_id)
         for key in net_trie.keys(nw_id):
             del net_trie[key]
         del id_trie[nw_id]
@@ -117,6 +382,8 @@ def find_orphans(net_trie, id_trie):
     * an empty net ID
     * a node ID with a single net ID (except the exit node)
     * a node ID without any networks
+    :notes: Member counts per net and net counts per node are built in a
+            single sweep of the net trie keys.
     :param net_trie: datrie trie object
     :param id_trie: datrie trie object
     :return: tuple of lists (orphan net list, orphan node list)
@@ -125,17 +392,22 @@ def find_orphans(net_trie, id_trie):
 
     orphan_nets = []
     orphan_nodes = []
-
-    for net_id in [x for x in list(id_trie) if len(x) == 16]:
-        mbr_list = net_trie.suffixes(net_id)[1:]
-        if mbr_list == []:
+    mbr_counts = {}
+    node_nets = {}
+
+    for key in net_trie.keys():
+        if len(key) > 16:
+            net_id = key[0:16]
+            mbr_counts[net_id] = mbr_counts.get(net_id, 0) + 1
+            node_nets.setdefault(key[16:], []).append(net_id)
+
+    id_keys = list(id_trie)
+    for net_id in [x for x in id_keys if len(x) == 16]:
+        if mbr_counts.get(net_id, 0) == 0:
             orphan_nets.append(net_id)
             logger.warning('CLEANUP: found empty net: {}'.format(net_id))
-    for node_id in [x for x in list(id_trie) if len(x) == 10 and not is_exit_node(x)]:
-        net_list = []
-        for key in list(net_trie):
-            if node_id in key:
-                net_list.append((key[0:16], node_id))
+    for node_id in [x for x in id_keys if len(x) == 10 and not is_exit_node(x)]:
+        net_list = [(net_id, node_id) for net_id in node_nets.get(node_id, [])]
         if len(net_list) == 1:
             orphan_nets.append(net_list[0])
             logger.warning('CLEANUP: found orphan net {}'.format(net_list))
@@ -164,17 +436,22 @@ def get_active_nodes(id_trie):
     return node_list
 
 
-def get_bootstrap_list(net_trie, id_trie):
+def get_bootstrap_list(net_trie, id_trie, ring=None):
     """
     Find all the nodes in the bootstrap chain (search the net trie).
     :notes: We start counting from the last node in the bootstrap
-    chain.
+    chain.  If a (non-empty) member ring is given, walk the ring links
+    instead of the tries.
     :param trie: net data trie
     :param trie: ID state trie
+    :param ring: <MemberRing> object
     :return: list of node IDs (empty list if None)
     """
     from node_tools.ctlr_funcs import get_exit_node_id
 
+    if ring is not None and len(ring) > 0:
+        return ring.bootstrap_list()
+
     node_list = []
     next_node = None
     exit_node = get_exit_node_id()
@@ -201,8 +478,7 @@ def get_dangling_net_data(trie, net_id):
     :param net_id: network ID to retrive
     :return: Attrdict <netcfg> or None
     """
-    from node_tools.ctlr_funcs import ipnet_get_netcfg
-    from node_tools.ctlr_funcs import netcfg_get_ipnet
+    from node_tools.ipv4_funcs import addr_get_netcfg
 
     payload = trie[net_id]
     # logger.debug('TRIE: net {} has payload {}'.format(net_id, payload))
@@ -210,9 +486,7 @@ def get_dangling_net_data(trie, net_id):
 
     for route in payload['routes']:
         if route['via'] is not None:
-            tgt_route = route['via']
-            netobj = netcfg_get_ipnet(tgt_route)
-            netcfg = ipnet_get_netcfg(netobj)
+            netcfg = addr_get_netcfg(route['via'])
 
     return netcfg
 
@@ -226,9 +500,22 @@ def get_invalid_net_id(trie, node_id):
     :param node_id: node ID to lookup
     :return: bogus network ID
     """
-    for key in trie:
-        if node_id in key:
-            return key[0:16]
+    net_list = get_node_nets(trie, node_id)
+    if net_list:
+        return net_list[0]
+
+
+def get_node_nets(trie, node_id):
+    """
+    Get the IDs of the networks with node ID as a member; uses the
+    reverse index for a NetTrie, otherwise scans the trie keys.
+    :param trie: net data trie
+    :param node_id: node ID to lookup
+    :return: list of network IDs (in trie key order)
+    """
+    if isinstance(trie, NetTrie):
+        return list(trie.node_nets.get(node_id, []))
+    return [key[0:16] for key in trie if key[16:] == node_id]
 
 
 def get_neighbor_ids(trie, node_id):
@@ -239,10 +526,8 @@ def get_neighbor_ids(trie, node_id):
     :param node_id: node ID to lookup
     :return: tuple of net and node IDs
     """
-    from node_tools.ctlr_funcs import ipnet_get_netcfg
     from node_tools.ctlr_funcs import is_exit_node
-    from node_tools.ctlr_funcs import netcfg_get_ipnet
-    from node_tools.helper_funcs import find_ipv4_iface
+    from node_tools.ipv4_funcs import addr_get_gateway
 
     node_list = []
     key_list = []
@@ -251,20 +536,16 @@ def get_neighbor_ids(trie, node_id):
     src_node = None
     exit_node = None
 
-    for key in trie:
-        if node_id in key:
-            key_list.append(key[0:16])
-            node_list.append(trie[key])
+    for net_id in get_node_nets(trie, node_id):
+        key_list.append(net_id)
+        node_list.append(trie[net_id + node_id])
 
     if len(key_list) != 2 and (len(key_list) == 1 and not is_exit_node(node_id)):
         raise AssertionError('Node {} keys {} are invalid!'.format(node_id, key_list))
     else:
         for key, data in zip(key_list, node_list):
             node_ip = data['ipAssignments'][0]
-            ipnet = netcfg_get_ipnet(node_ip)
-            netcfg = ipnet_get_netcfg(ipnet)
-            gw_ip = find_ipv4_iface(netcfg.gateway[0])
-            if node_ip == gw_ip:
+            if node_ip == addr_get_gateway(node_ip):
                 src_net = key
                 for node in trie.suffixes(src_net)[1:]:
                     if node_id != node:
@@ -346,11 +627,8 @@ def load_id_trie(net_trie, id_trie, nw_id, node_id, needs=[], nw=False):
         key_id = net_id
         id_list = mbr_list
     else:
-        net_list = []
         mbr_id = node_id[0]
-        for key in list(net_trie):
-            if mbr_id in key:
-                net_list.append(key[0:16])
+        net_list = get_node_nets(net_trie, mbr_id)
         if len(net_list) == 2:
             needs = [False, False]
         elif len(net_list) == 1:
@@ -366,6 +644,25 @@ def load_id_trie(net_trie, id_trie, nw_id, node_id, needs=[], nw=False):
     id_trie[key_id] = payload
 
 
+def release_net_subnet(trie, net_id):
+    """
+    Return the subnet for a network to the ctlr subnet allocator (if
+    there is one).
+    :param trie: net data trie
+    :param net_id: network ID
+    :return: True if the subnet was released
+    """
+    from node_tools import ctlr_data as ct
+    from node_tools.ipv4_funcs import get_net_subnet
+
+    if ct.subnets is None or net_id not in trie:
+        return False
+    net_int = get_net_subnet(trie[net_id], ct.subnets.prefix)
+    if net_int is None:
+        return False
+    return ct.subnets.release(net_int)
+
+
 def trie_is_empty(trie):
     """
     Check shared state Trie is fresh and empty (mainly on startup).
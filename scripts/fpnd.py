@@ -15,8 +15,10 @@ from daemon import Daemon
 
 from node_tools import __version__ as fpnd_version
 
-from node_tools.ctlr_funcs import gen_netobj_queue
 from node_tools.cache_funcs import delete_cache_entry
+from node_tools.cache_funcs import open_cache
+from node_tools.data_funcs import do_cache_maintenance
+from node_tools.data_funcs import do_cache_sweep
 from node_tools.data_funcs import update_runner
 from node_tools.helper_funcs import NODE_SETTINGS
 from node_tools.helper_funcs import do_setup
@@ -26,6 +28,9 @@ from node_tools.helper_funcs import put_state_msg
 from node_tools.helper_funcs import set_initial_role
 from node_tools.helper_funcs import startup_handlers
 from node_tools.helper_funcs import validate_role
+from node_tools.ipv4_funcs import open_subnet_allocator
+from node_tools.journal_funcs import close_ctlr_journal
+from node_tools.journal_funcs import open_ctlr_journal
 from node_tools.logger_config import setup_logging
 from node_tools.network_funcs import run_cleanup_check
 from node_tools.network_funcs import run_net_check
@@ -33,6 +38,8 @@ from node_tools.node_funcs import do_cleanup
 from node_tools.node_funcs import do_startup
 from node_tools.node_funcs import handle_moon_data
 from node_tools.node_funcs import wait_for_moon
+from node_tools.state_runner import close_state_runners
+from node_tools.trie_funcs import save_ctlr_snapshot
 
 try:
     from datetime import timezone
@@ -87,6 +94,12 @@ def setup_scheduling(max_age):
     baseUpdateJob = schedule.every(sleep_time).seconds
     baseUpdateJob.do(update_runner).tag('base-tasks', 'get-updates')
 
+    baseSweepJob = schedule.every(max_age).seconds
+    baseSweepJob.do(do_cache_sweep).tag('base-tasks', 'cache-sweep')
+
+    baseMaintJob = schedule.every(NODE_SETTINGS['maint_interval']).seconds
+    baseMaintJob.do(do_cache_maintenance).tag('base-tasks', 'cache-maint')
+
     show_scheduled_jobs()
     logger.debug('Leaving setup_scheduling')
 
@@ -126,11 +139,13 @@ def do_scheduling():
 
         else:
             if node_role == 'controller':
-                netobj_q = dc.Deque(directory=get_cachedir('netobj_queue'))
-                gen_netobj_queue(netobj_q)
-                cache = dc.Index(get_cachedir())
+                cache = open_cache()
                 for key_str in ['peer', 'moon', 'mstate']:
                     delete_cache_entry(cache, key_str)
+                open_ctlr_journal()
+                open_subnet_allocator()
+                snap_time = NODE_SETTINGS['snapshot_interval']
+                schedule.every(snap_time).seconds.do(save_ctlr_snapshot).tag('chk-tasks', 'snapshot')
 
             elif node_role == 'moon':
                 cln_q = dc.Deque(directory=get_cachedir('clean_queue'))
@@ -163,6 +178,10 @@ class fpnDaemon(Daemon):
     def cleanup(self):
 
         do_cleanup()
+        if NODE_SETTINGS['node_role'] == 'controller':
+            save_ctlr_snapshot()
+            close_ctlr_journal()
+        close_state_runners()
 
     # implement run method
     def run(self):
@@ -9,7 +9,6 @@ import datetime
 import logging
 import logging.handlers
 
-import diskcache as dc
 from daemon import Daemon
 from nanoservice import Responder
 
@@ -19,6 +18,7 @@ from node_tools import state_data as st
 
 from node_tools.helper_funcs import get_cachedir
 from node_tools.helper_funcs import get_runtimedir
+from node_tools.msg_queues import IndexedDeque
 from node_tools.msg_queues import add_one_only
 from node_tools.msg_queues import clean_from_queue
 from node_tools.msg_queues import handle_announce_msg
@@ -46,18 +46,18 @@ pid_file = os.path.join(get_runtimedir(), '{}.pid'.format('msg_responder'))
 # stdout = '/tmp/responder.log'
 # stderr = '/tmp/responder_err.log'
 
-cfg_q = dc.Deque(directory=get_cachedir('cfg_queue'))
-hold_q = dc.Deque(directory=get_cachedir('hold_queue'))
-off_q = dc.Deque(directory=get_cachedir('off_queue'))
-pub_q = dc.Deque(directory=get_cachedir('pub_queue'))
-wdg_q = dc.Deque(directory=get_cachedir('wedge_queue'))
+cfg_q = IndexedDeque(directory=get_cachedir('cfg_queue'))
+hold_q = IndexedDeque(directory=get_cachedir('hold_queue'))
+off_q = IndexedDeque(directory=get_cachedir('off_queue'))
+pub_q = IndexedDeque(directory=get_cachedir('pub_queue'))
+wdg_q = IndexedDeque(directory=get_cachedir('wedge_queue'))
 
-node_q = dc.Deque(directory=get_cachedir('node_queue'))
-reg_q = dc.Deque(directory=get_cachedir('reg_queue'))
-wait_q = dc.Deque(directory=get_cachedir('wait_queue'))
+node_q = IndexedDeque(directory=get_cachedir('node_queue'))
+reg_q = IndexedDeque(directory=get_cachedir('reg_queue'))
+wait_q = IndexedDeque(directory=get_cachedir('wait_queue'))
 
-tmp_q = dc.Deque(directory=get_cachedir('tmp_queue'))
-cln_q = dc.Deque(directory=get_cachedir('clean_queue'))
+tmp_q = IndexedDeque(directory=get_cachedir('tmp_queue'))
+cln_q = IndexedDeque(directory=get_cachedir('clean_queue'))
 
 
 def clean_stale_cfgs(key_str, deque):
@@ -9,12 +9,12 @@ import datetime
 import logging
 import logging.handlers
 
-import diskcache as dc
 from daemon import Daemon
 from nanoservice import Subscriber
 
 from node_tools.helper_funcs import get_cachedir
 from node_tools.helper_funcs import get_runtimedir
+from node_tools.msg_queues import IndexedDeque
 from node_tools.msg_queues import add_one_only
 from node_tools.msg_queues import avoid_and_update
 from node_tools.msg_queues import valid_announce_msg
@@ -37,11 +37,11 @@ pid_file = os.path.join(get_runtimedir(), '{}.pid'.format('msg_subscriber'))
 # std_out = '/tmp/subscriber.log'
 # std_err = '/tmp/subscriber_err.log'
 
-cfg_q = dc.Deque(directory=get_cachedir('cfg_queue'))
-node_q = dc.Deque(directory=get_cachedir('node_queue'))
-off_q = dc.Deque(directory=get_cachedir('off_queue'))
-pub_q = dc.Deque(directory=get_cachedir('pub_queue'))
-wdg_q = dc.Deque(directory=get_cachedir('wedge_queue'))
+cfg_q = IndexedDeque(directory=get_cachedir('cfg_queue'))
+node_q = IndexedDeque(directory=get_cachedir('node_queue'))
+off_q = IndexedDeque(directory=get_cachedir('off_queue'))
+pub_q = IndexedDeque(directory=get_cachedir('pub_queue'))
+wdg_q = IndexedDeque(directory=get_cachedir('wedge_queue'))
 
 
 def handle_msg(msg):
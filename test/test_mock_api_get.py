@@ -3,6 +3,7 @@ import os
 import sys
 import time
 import shutil
+import sqlite3
 import datetime
 import logging
 import ipaddress
@@ -467,6 +468,297 @@ def test_find_state_keys():
     assert 'istate' in s
 
 
+def test_cache_key_index():
+    from node_tools.cache_funcs import CacheKeyIndex
+    from node_tools.cache_funcs import get_key_index
+
+    for key_str in ['node', 'peer', 'net', 'state']:
+        assert find_keys(cache, key_str) == [x for x in list(cache) if key_str in x]
+
+    index = get_key_index(cache)
+    assert index.count == len(cache)
+    loaded = CacheKeyIndex(cache)
+    assert loaded.count == len(cache)
+    assert loaded.find(cache, 'state') == find_keys(cache, 'state')
+
+    # external change (not via cache_funcs) forces a rebuild
+    cache['istate-999999999999999'] = AttrDict({'identity': 'bogus'})
+    assert 'istate-999999999999999' in find_keys(cache, 'state')
+    del cache['istate-999999999999999']
+    assert len(find_keys(cache, 'state')) == 4
+
+
+def test_load_cache_bulk():
+    results = []
+    for bulk in [False, True]:
+        tmp_cache = Index(tempfile.mkdtemp())
+        _, peer_data = client.get_data('peer')
+        load_cache_by_type(tmp_cache, peer_data, 'peer', bulk=bulk)
+        del peer_data[0]
+        load_cache_by_type(tmp_cache, peer_data, 'peer', bulk=bulk)
+        results.append(list(tmp_cache.items()))
+        shutil.rmtree(tmp_cache.directory)
+    assert results[0] == results[1]
+    assert len(results[1]) == len(peer_data)
+
+
+def test_load_cache_identity_keys():
+    tmp_cache = Index(tempfile.mkdtemp())
+    _, peer_data = client.get_data('peer')
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    keys = find_keys(tmp_cache, 'peer')
+    assert sorted(keys) == sorted(['peer-' + x['address'] for x in peer_data])
+
+    # reordered list with one peer gone: existing keys stay in place
+    missing = peer_data.pop(2)
+    load_cache_by_type(tmp_cache, peer_data[::-1], 'peer')
+    assert find_keys(tmp_cache, 'peer') == [x for x in keys if missing['address'] not in x]
+    for item in peer_data:
+        assert tmp_cache['peer-' + item['address']]['address'] == item['address']
+    shutil.rmtree(tmp_cache.directory)
+
+
+def test_load_cache_skip_unchanged():
+    from node_tools.cache_funcs import expire_cache_entries
+    from node_tools.cache_funcs import get_key_index
+    from node_tools.cache_funcs import key_indexes
+    from node_tools.cache_funcs import write_stats
+
+    tmp_cache = Index(tempfile.mkdtemp())
+    _, peer_data = client.get_data('peer')
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+
+    written, skipped = write_stats['written'], write_stats['skipped']
+    index = get_key_index(tmp_cache)
+    mtime = os.stat(index.fname).st_mtime_ns
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    assert write_stats['written'] == written
+    assert write_stats['skipped'] == skipped + len(peer_data)
+    # refreshes alone do not rewrite the index file (only a sweep does)
+    assert os.stat(index.fname).st_mtime_ns == mtime
+    assert index.stamped
+    assert expire_cache_entries(tmp_cache) == []
+    assert not index.stamped
+    assert os.stat(index.fname).st_mtime_ns != mtime
+
+    peer_data[0]['latency'] = 999
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    assert write_stats['written'] == written + 1
+    assert tmp_cache['peer-' + peer_data[0]['address']]['latency'] == 999
+
+    # entry rewritten by something else while the index is on disk (same
+    # entry count), so the digests from the last run cannot be trusted
+    key_indexes.pop(tmp_cache.directory)
+    tmp_cache['peer-' + peer_data[0]['address']] = dict(peer_data[0], latency=1)
+    assert get_key_index(tmp_cache).digests == {}
+    written = write_stats['written']
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    assert tmp_cache['peer-' + peer_data[0]['address']]['latency'] == 999
+    assert write_stats['written'] == written + 1
+
+    # same, but rewritten by another connection while the index is loaded
+    other = Index(tmp_cache.directory)
+    other['peer-' + peer_data[1]['address']] = dict(peer_data[1], latency=1)
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    assert tmp_cache['peer-' + peer_data[1]['address']]['latency'] == peer_data[1]['latency']
+    assert write_stats['written'] == written + 2
+    key_indexes.pop(tmp_cache.directory)
+    shutil.rmtree(tmp_cache.directory)
+
+
+def test_cache_entry_expiry():
+    from node_tools.cache_funcs import expire_cache_entries
+    from node_tools.cache_funcs import get_key_index
+
+    tmp_cache = Index(tempfile.mkdtemp())
+    _, peer_data = client.get_data('peer')
+    _, node_data = client.get_data('status')
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    load_cache_by_type(tmp_cache, node_data, 'node')
+    index = get_key_index(tmp_cache)
+    assert expire_cache_entries(tmp_cache) == []
+
+    # stale peers expire on read, fresh node data is kept
+    for key in find_keys(tmp_cache, 'peer'):
+        index.stamps[key] -= max_age + 1
+    assert get_endpoint_data(tmp_cache, 'peer') == ([], [])
+    assert len(tmp_cache) == 1
+    assert len(get_endpoint_data(tmp_cache, 'node')[1]) == 1
+
+    # full sweep
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    for key in list(index.stamps):
+        index.stamps[key] -= 301
+    assert len(expire_cache_entries(tmp_cache)) == len(peer_data) + 1
+    assert len(tmp_cache) == 0
+    shutil.rmtree(tmp_cache.directory)
+
+
+def test_do_cache_sweep(monkeypatch):
+    import node_tools.data_funcs as df
+
+    def bad_sweep(cache):
+        raise OSError('database is locked')
+
+    assert isinstance(df.do_cache_sweep(), list)
+    monkeypatch.setattr(df, 'expire_cache_entries', bad_sweep)
+    assert df.do_cache_sweep() is None
+
+
+def test_open_cache_json_disk():
+    from node_tools.cache_funcs import get_entry_view
+    from node_tools.cache_funcs import open_cache
+
+    tmp_dir = tempfile.mkdtemp()
+    json_cache = open_cache(tmp_dir)
+    _, peer_data = client.get_data('peer')
+    load_cache_by_type(json_cache, peer_data, 'peer')
+    stamp = datetime.datetime.now(utc)
+    json_cache['utc-time'] = stamp
+
+    reopened = open_cache(tmp_dir)
+    key = 'peer-' + peer_data[0]['address']
+    assert type(reopened[key]) is dict
+    assert reopened[key] == peer_data[0]
+    assert reopened['utc-time'] == stamp
+    _, values = get_endpoint_data(reopened, 'peer')
+    assert isinstance(values[0], AttrDict)
+    assert values[0].paths[0]['address'] == peer_data[0]['paths'][0]['address']
+    assert len(get_peer_status(reopened)) == len(get_peer_status(json_cache))
+
+    # views are only built on read, with the same shape as before
+    entry = {'config': {'settings': {'primaryPort': 9993}}, 'paths': [{'active': True}]}
+    view = get_entry_view(entry)
+    assert view == AttrDict.from_nested_dict(entry)
+    assert view.config.settings.primaryPort == 9993
+    assert type(view.paths[0]) is dict
+    assert type(entry['config']) is dict
+    shutil.rmtree(tmp_dir)
+
+
+def test_entry_view_cache():
+    import copy
+
+    tmp_dir = tempfile.mkdtemp()
+    tmp_cache = Index(tmp_dir)
+    _, peer_data = client.get_data('peer')
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    key_list, values = get_endpoint_data(tmp_cache, 'peer')
+    assert get_endpoint_data(tmp_cache, 'peer')[1][0] is values[0]
+
+    # writes through cache_funcs invalidate the changed key only
+    new_data = copy.deepcopy(peer_data)
+    new_data[0]['latency'] = 999
+    load_cache_by_type(tmp_cache, new_data, 'peer')
+    _, new_values = get_endpoint_data(tmp_cache, 'peer')
+    assert new_values[0].latency == 999
+    assert new_values[1] is values[1]
+
+    # a commit from another connection drops all views
+    other = Index(tmp_dir)
+    other[key_list[1]] = dict(peer_data[1], latency=555)
+    _, new_values = get_endpoint_data(tmp_cache, 'peer')
+    assert new_values[1].latency == 555
+
+    # the version only moves on commits by other connections
+    from node_tools.cache_funcs import get_data_version
+
+    version = get_data_version(tmp_cache.cache)
+    tmp_cache[key_list[1]] = dict(peer_data[1], latency=777)
+    assert get_data_version(tmp_cache.cache) == version
+    other[key_list[1]] = dict(peer_data[1], latency=888)
+    assert get_data_version(tmp_cache.cache) != version
+    assert get_data_version(object()) != get_data_version(object())
+    shutil.rmtree(tmp_dir)
+
+
+def test_cache_metrics():
+    import json
+    from node_tools.cache_funcs import open_cache
+    from node_tools.metric_funcs import get_cache_metrics
+
+    tmp_dir = tempfile.mkdtemp()
+    tmp_cache = open_cache(tmp_dir)
+    _, peer_data = client.get_data('peer')
+    get_cache_metrics(reset=True)
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    load_cache_by_type(tmp_cache, peer_data, 'peer')
+    get_peer_status(tmp_cache)
+    get_peer_status(tmp_cache)
+    load_cache_by_type(tmp_cache, peer_data[1:], 'peer')
+
+    snapshot = get_cache_metrics()
+    json.dumps(snapshot)
+    peers = snapshot['types']['peer']
+    assert peers['written'] == len(peer_data)
+    assert peers['skipped'] == len(peer_data) * 2 - 1
+    assert peers['deleted'] == 1
+    assert peers['reads'] == len(peer_data) * 2
+    assert peers['misses'] == len(peer_data)
+    assert peers['hits'] == len(peer_data)
+    assert peers['bytes'] > 0
+    hist = snapshot['transact']['peer']
+    assert hist['count'] == 5
+    assert sum(hist['buckets'].values()) == hist['count']
+    assert get_cache_metrics(reset=True)['types']
+    assert get_cache_metrics()['types'] == {}
+    shutil.rmtree(tmp_dir)
+
+
+def test_maintain_cache_dirs(monkeypatch):
+    import node_tools.cache_funcs as cf
+
+    tmp_dir = get_cachedir('maint_test_queue')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    maint_q = Deque(directory=tmp_dir)
+    maint_q.extend(['x' * 200 + str(x) for x in range(3000)])
+    for _ in range(2900):
+        maint_q.popleft()
+    maint_q._cache.set('stale', 1, expire=0.01)
+    time.sleep(0.05)
+
+    before = cf.get_cache_dir_stats(tmp_dir)
+    assert before['entries'] == 101
+    assert before['wal_bytes'] > cf.WAL_MAX_BYTES
+    assert before['fragmentation'] <= cf.get_cache_dir_stats(tmp_dir, dbstat=True)['fragmentation']
+    assert cf.get_cache_dir_stats(get_cachedir('no_such_queue')) is None
+
+    # a cache locked by another writer is skipped without blocking
+    con = sqlite3.connect(os.path.join(tmp_dir, 'cache.db'), isolation_level=None)
+    con.execute('BEGIN IMMEDIATE')
+    start = time.time()
+    report = cf.maintain_cache_dirs(['maint_test_queue'], min_ratio=0.1)
+    con.execute('ROLLBACK')
+    con.close()
+    assert time.time() - start < 5
+    assert report[0]['culled'] == 0
+    assert not report[0]['vacuumed']
+
+    monkeypatch.setattr(cf, 'VACUUM_MIN_BYTES', 0)
+    report = cf.maintain_cache_dirs(['maint_test_queue', 'no_such_queue'], min_ratio=0.1)
+    assert len(report) == 1
+    assert report[0]['culled'] == 1
+    assert report[0]['vacuumed']
+
+    after = cf.get_cache_dir_stats(tmp_dir)
+    assert after['entries'] == 100
+    assert after['wal_bytes'] < before['wal_bytes']
+    assert after['db_bytes'] <= before['db_bytes']
+    assert len(maint_q) == 100
+    assert maint_q[0] == 'x' * 200 + '2900'
+    shutil.rmtree(tmp_dir)
+
+
+def test_do_cache_maintenance(monkeypatch):
+    import node_tools.data_funcs as df
+
+    def bad_maint():
+        raise OSError('database is locked')
+
+    monkeypatch.setattr(df, 'maintain_cache_dirs', bad_maint)
+    assert df.do_cache_maintenance() is None
+
+
 def test_get_state():
     from node_tools import state_data as stest
 
@@ -483,6 +775,39 @@ def test_get_state():
     assert nodeState['fpn_id1'] == 'b6079f73ca8129ad'
 
 
+def test_get_state_reloaded_entries():
+    from node_tools import state_data as stest
+    from node_tools.cache_funcs import expire_cache_entries
+    from node_tools.cache_funcs import get_key_index
+
+    tmp_cache = Index(tempfile.mkdtemp())
+    key_list, values = get_endpoint_data(cache, 'state')
+    node_state = [v for k, v in zip(key_list, values) if 'nstate' in k][0]
+    net_state = [v for k, v in zip(key_list, values) if 'istate' in k]
+    load_cache_by_type(tmp_cache, node_state, 'nstate')
+    load_cache_by_type(tmp_cache, net_state, 'istate')
+
+    # expire one net entry and the node state, then re-add them (the
+    # re-added keys go to the back of the key order)
+    index = get_key_index(tmp_cache)
+    node_key = find_keys(tmp_cache, 'nstate')[0]
+    net_key = find_keys(tmp_cache, 'istate')[0]
+    for key in [node_key, net_key]:
+        index.stamps[key] -= max(max_age, 300) + 1
+    assert sorted(expire_cache_entries(tmp_cache)) == sorted([node_key, net_key])
+    load_cache_by_type(tmp_cache, net_state, 'istate')
+    load_cache_by_type(tmp_cache, node_state, 'nstate')
+    assert find_keys(tmp_cache, 'state')[-1] == node_key
+
+    get_state(tmp_cache)
+    nodeState = AttrDict.from_nested_dict(stest.fpnState)
+    assert nodeState.fpn0
+    assert nodeState.fpn1
+    assert nodeState['fpn_id0'] == 'b6079f73c63cea29'
+    assert nodeState['fpn_id1'] == 'b6079f73ca8129ad'
+    shutil.rmtree(tmp_cache.directory)
+
+
 def test_get_ztnwid():
     from node_tools import state_data as stest
 
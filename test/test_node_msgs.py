@@ -6,6 +6,8 @@ import pytest
 from nanoservice import Subscriber
 from nanoservice import Publisher
 
+from node_tools.msg_queues import IndexedDeque
+from node_tools.msg_queues import add_one_only
 from node_tools.msg_queues import clean_from_queue
 from node_tools.msg_queues import handle_announce_msg
 from node_tools.msg_queues import handle_node_queues
@@ -394,6 +396,84 @@ class QueueHandlingTest(unittest.TestCase):
         self.assertEqual(list(self.wait_q), [])
 
 
+class IndexedQueueHandlingTest(QueueHandlingTest):
+    """
+    Test managing node queues with the indexed queue type.
+    """
+    def setUp(self):
+        super(IndexedQueueHandlingTest, self).setUp()
+
+        self.node_q = IndexedDeque(directory='/tmp/test-inq')
+        self.reg_q = IndexedDeque(directory='/tmp/test-irq')
+        self.wait_q = IndexedDeque(directory='/tmp/test-iwq')
+
+    def test_indexed_queue_ops(self):
+        self.node_q.extend([self.node1, self.node2, self.node1])
+        self.node_q.appendleft(self.node3)
+        self.assertIn(self.node1, self.node_q)
+        self.assertEqual(self.node_q.count(self.node1), 2)
+        self.assertFalse(self.node_q.add_unique(self.node2))
+        add_one_only(self.node2, self.node_q)
+        self.assertEqual(len(self.node_q), 4)
+
+        self.node_q.remove(self.node1)
+        self.assertEqual(list(self.node_q), [self.node3, self.node2, self.node1])
+        self.assertEqual(self.node_q.popleft(), self.node3)
+        self.assertEqual(self.node_q.pop(), self.node1)
+        self.assertNotIn(self.node1, self.node_q)
+        with self.assertRaises(ValueError):
+            self.node_q.remove(self.node1)
+
+        dict1 = {self.node1: '127.0.0.1'}
+        self.assertTrue(self.node_q.add_unique(dict1))
+        self.node_q.append(dict1)
+        self.assertEqual(self.node_q.count({self.node1: '127.0.0.1'}), 2)
+        self.assertEqual(self.node_q.remove_all(dict1), 2)
+        self.assertEqual(list(self.node_q), [self.node2])
+
+    def test_indexed_queue_bulk_ops(self):
+        self.node_q.extend([self.node1, self.node2, self.node3])
+        self.node_q.rotate()
+        self.assertEqual(list(self.node_q), [self.node3, self.node1, self.node2])
+        self.assertEqual(self.node_q.count(self.node3), 1)
+        self.node_q.rotate(-2)
+        self.assertEqual(self.node_q.count(self.node2), 1)
+        self.assertEqual(self.node_q.popleft(), self.node2)
+
+        self.node_q.extendleft([self.node2, self.node2])
+        self.assertEqual(self.node_q.count(self.node2), 2)
+        self.node_q.reverse()
+        self.assertEqual(list(self.node_q), [self.node1, self.node3, self.node2, self.node2])
+        self.assertEqual(self.node_q.remove_all(self.node2), 2)
+
+        self.node_q[0] = self.node2
+        self.assertNotIn(self.node1, self.node_q)
+        del self.node_q[0]
+        self.assertEqual(self.node_q.count(self.node2), 0)
+        self.node_q.clear()
+        self.assertTrue(self.node_q.add_unique(self.node3))
+        self.assertEqual(list(self.node_q), [self.node3])
+
+    def test_indexed_queue_shared(self):
+        import diskcache as dc
+
+        other_q = dc.Deque(directory=self.node_q.directory)
+        self.node_q.append(self.node1)
+        other_q.append(self.node2)
+        other_q.append(self.node2)
+        self.assertEqual(self.node_q.count(self.node2), 2)
+        other_q.popleft()
+        self.assertNotIn(self.node1, self.node_q)
+        self.node_q.remove(self.node2)
+        self.assertEqual(list(other_q), [self.node2])
+
+        with self.assertRaises(RuntimeError):
+            with self.node_q.transact():
+                self.node_q.append(self.node3)
+                raise RuntimeError('rollback')
+        self.assertNotIn(self.node3, self.node_q)
+
+
 class QueueMsgHandlingTest(unittest.TestCase):
     """
     Test announce msg handling/node queueing.
@@ -2,6 +2,8 @@
 import os
 import sys
 import json
+import copy
+import asyncio
 import time
 import shutil
 import datetime
@@ -16,18 +18,26 @@ from pathlib import Path
 from collections import deque
 
 import datrie
+import mock
 import pytest
 
 from diskcache import Index
 
 import node_tools.timing_funcs as tf
 
+from node_tools.async_funcs import bootstrap_mbr_node
+from node_tools.async_funcs import bootstrap_mbr_nodes
+from node_tools.async_funcs import offline_mbr_node
+from node_tools.async_funcs import offline_mbr_nodes
+from node_tools.async_funcs import refresh_state_tries
+from node_tools.async_funcs import update_state_tries
 from node_tools.ctlr_funcs import gen_netobj_queue
 from node_tools.ctlr_funcs import handle_net_cfg
 from node_tools.ctlr_funcs import ipnet_get_netcfg
 from node_tools.ctlr_funcs import is_exit_node
 from node_tools.ctlr_funcs import name_generator
 from node_tools.ctlr_funcs import netcfg_get_ipnet
+from node_tools.ctlr_funcs import release_net_cfg
 from node_tools.ctlr_funcs import set_network_cfg
 from node_tools.ctlr_funcs import unset_network_cfg
 from node_tools.exceptions import MemberNodeError
@@ -44,6 +54,13 @@ from node_tools.helper_funcs import set_initial_role
 from node_tools.helper_funcs import startup_handlers
 from node_tools.helper_funcs import validate_role
 from node_tools.helper_funcs import xform_state_diff
+from node_tools.ipv4_funcs import addr_get_gateway
+from node_tools.ipv4_funcs import addr_get_netcfg
+from node_tools.ipv4_funcs import addr_to_int
+from node_tools.ipv4_funcs import int_to_addr
+from node_tools.ipv4_funcs import SubnetAllocator
+from node_tools.journal_funcs import close_ctlr_journal
+from node_tools.journal_funcs import open_ctlr_journal
 from node_tools.logger_config import setup_logging
 from node_tools.msg_queues import handle_wedged_nodes
 from node_tools.network_funcs import do_host_check
@@ -58,8 +75,16 @@ from node_tools.node_funcs import handle_moon_data
 from node_tools.node_funcs import parse_moon_data
 from node_tools.sched_funcs import catch_exceptions
 from node_tools.sched_funcs import check_return_status
+from node_tools.state_runner import StateRunner
+from node_tools.topology_funcs import MemberRing
+from node_tools.topology_funcs import TopologyStore
+from node_tools.topology_funcs import rebuild_ring
+from node_tools.topology_funcs import sync_ring
+from node_tools.trie_funcs import NetTrie
+from node_tools.trie_funcs import TrieRecord
 from node_tools.trie_funcs import cleanup_state_tries
 from node_tools.trie_funcs import create_state_trie
+from node_tools.trie_funcs import find_dangling_nets
 from node_tools.trie_funcs import find_exit_net
 from node_tools.trie_funcs import find_orphans
 from node_tools.trie_funcs import get_active_nodes
@@ -67,10 +92,13 @@ from node_tools.trie_funcs import get_bootstrap_list
 from node_tools.trie_funcs import get_dangling_net_data
 from node_tools.trie_funcs import get_invalid_net_id
 from node_tools.trie_funcs import get_neighbor_ids
+from node_tools.trie_funcs import get_node_nets
 from node_tools.trie_funcs import get_target_node_id
 from node_tools.trie_funcs import get_wedged_node_id
+from node_tools.trie_funcs import load_ctlr_snapshot
 from node_tools.trie_funcs import load_id_trie
 from node_tools.trie_funcs import load_state_trie
+from node_tools.trie_funcs import save_ctlr_snapshot
 from node_tools.trie_funcs import save_state_trie
 from node_tools.trie_funcs import trie_is_empty
 
@@ -111,6 +139,72 @@ class mock_zt_api_client(object):
         return self.response, self.endpoint
 
 
+class mock_async_ctlr_client(object):
+    """
+    Async client API to serve ctlr network/member GET endpoints
+    """
+    def __init__(self):
+        nets, mbrs = load_ctlr_data()
+        self.nets = {net['id']: net for net in nets}
+        self.mbrs = {}
+        for net_id in self.nets:
+            self.mbrs[net_id] = {mbr['id']: mbr for mbr in mbrs if mbr['nwid'] == net_id}
+        self.endpoints = []
+        self.writes = []
+        self.data = None
+
+    async def get_data(self, endpoint):
+        self.endpoints.append(endpoint)
+        path = endpoint.split('/')[1:]
+        if path == ['network']:
+            self.data = list(self.nets)
+        elif len(path) == 2:
+            self.data = copy.deepcopy(self.nets[path[1]])
+        elif len(path) == 3:
+            self.data = {k: v['revision'] for k, v in self.mbrs[path[1]].items()}
+        else:
+            self.data = copy.deepcopy(self.mbrs[path[1]][path[3]])
+
+    async def set_value(self, cfg_dict, endpoint):
+        self.endpoints.append(endpoint)
+        self.writes.append(endpoint)
+        path = endpoint.split('/')[1:]
+        net_id = path[1]
+        if net_id.endswith('______'):
+            net_id = net_id[0:10] + '{:06x}'.format(len(self.nets))
+            self.nets[net_id] = {'id': net_id, 'nwid': net_id, 'revision': 0, 'routes': []}
+            self.mbrs[net_id] = {}
+        if len(path) == 2:
+            obj = self.nets[net_id]
+        else:
+            new_mbr = {'id': path[3], 'nwid': net_id, 'revision': 0,
+                       'authorized': False, 'ipAssignments': []}
+            obj = self.mbrs[net_id].setdefault(path[3], new_mbr)
+        obj.update({k: v for k, v in cfg_dict.items() if k})
+        for route in obj.get('routes', []):
+            route.setdefault('via', None)
+        obj['revision'] += 1
+        self.data = copy.deepcopy(obj)
+
+    async def delete_thing(self, endpoint):
+        self.endpoints.append(endpoint)
+        self.writes.append(endpoint)
+        path = endpoint.split('/')[1:]
+        if len(path) == 2:
+            del self.nets[path[1]]
+            del self.mbrs[path[1]]
+        else:
+            del self.mbrs[path[1]][path[3]]
+
+
+def run_async(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
 # unittest-based test cases
 class BasicConfigTest(unittest.TestCase):
 
@@ -290,6 +384,40 @@ class IPv4NetObjectTest(unittest.TestCase):
             res = ipnet_get_netcfg('172.16.0.0/30')
 
 
+class IPv4IntFuncsTest(unittest.TestCase):
+    """
+    The integer /30 helpers must match the ipaddress based netcfg.
+    """
+    def test_addr_int_roundtrip(self):
+        for addr in ['0.0.0.0', '172.16.0.241', '255.255.255.255']:
+            self.assertEqual(addr_to_int(addr), int(ipaddress.IPv4Address(addr)))
+            self.assertEqual(int_to_addr(addr_to_int(addr)), addr)
+
+    def test_bogus_addr(self):
+        for addr in ['172.16.0.261', '172.16.0', '172.16.0.1/30', 'a.b.c.d', '']:
+            with self.assertRaises(ipaddress.AddressValueError):
+                addr_to_int(addr)
+
+    def test_netcfg_matches_ipaddress(self):
+        subnets = ipaddress.ip_network('172.16.0.0/24').subnets(new_prefix=30)
+        for netobj in subnets:
+            hosts = list(netobj.hosts())
+            for addr in [str(x) for x in hosts]:
+                res = addr_get_netcfg(addr)
+                self.assertEqual(res.net_routes[0]['target'], str(netobj))
+                self.assertEqual(res.net_routes[1]['via'], str(hosts[0]))
+                self.assertEqual(res.gateway, [str(hosts[0]) + '/30'])
+                self.assertEqual(res.host, [str(hosts[1]) + '/30'])
+                self.assertEqual(addr_get_gateway(addr), str(hosts[0]))
+            self.assertEqual(netcfg_get_ipnet(str(hosts[1])), netobj)
+            self.assertEqual(ipnet_get_netcfg(netobj), addr_get_netcfg(str(hosts[0])))
+
+    def test_netcfg_is_new_object(self):
+        res = addr_get_netcfg('172.16.0.1')
+        res.host.append('bogus')
+        self.assertEqual(addr_get_netcfg('172.16.0.2').host, ['172.16.0.2/30'])
+
+
 class NetCmdTest(unittest.TestCase):
     """
     Simple test of find_the_net_script.
@@ -1219,3 +1347,559 @@ def test_handle_net_cfg():
     assert len(res) is 3
     # print(res)
     netobj_q.clear()
+
+
+def test_subnet_allocator():
+    from node_tools import ctlr_data as ct
+
+    snap_dir = tempfile.mkdtemp()
+    subnets = SubnetAllocator(snap_dir, ipnet='192.168.0.0/28')
+    assert len(subnets) == 4
+
+    net_ints = [subnets.allocate() for _ in range(4)]
+    assert [int_to_addr(x) for x in net_ints] == ['192.168.0.0', '192.168.0.4',
+                                                  '192.168.0.8', '192.168.0.12']
+    assert len(subnets) == 0
+    with pytest.raises(IndexError):
+        subnets.allocate()
+    assert subnets.release(net_ints[1])
+    assert not subnets.release(net_ints[1])
+    assert not subnets.release(addr_to_int('10.0.0.0'))
+    assert net_ints[1] not in subnets
+
+    subnets.save()
+    loaded = SubnetAllocator(snap_dir, ipnet='192.168.0.0/28')
+    assert len(loaded) == 1
+    assert loaded.allocate() == net_ints[1]
+
+    # released subnets are reused oldest first (also after a reload)
+    for net_int in [net_ints[2], net_ints[0]]:
+        loaded.release(net_int)
+    loaded.save()
+    loaded = SubnetAllocator(snap_dir, ipnet='192.168.0.0/28')
+    assert [loaded.allocate() for _ in range(2)] == [net_ints[2], net_ints[0]]
+
+    allocator = SubnetAllocator(ipnet='192.168.0.0/28')
+    net_ip, mbr_ip, gw_ip = handle_net_cfg(allocator)
+    assert net_ip.routes[0]['target'] == '192.168.0.0/30'
+    assert mbr_ip.ipAssignments == ['192.168.0.2/30']
+    assert gw_ip.ipAssignments == ['192.168.0.1/30']
+    assert release_net_cfg(allocator, net_ip)
+    assert not release_net_cfg(allocator, net_ip)
+    assert len(allocator) == 4
+
+    # rebuild from the net trie, then release on cleanup
+    trie = NetTrie(string.hexdigits)
+    id_trie = datrie.Trie(string.hexdigits)
+    for net_id, gw in [('beafde52b4000001', '192.168.0.5'), ('beafde52b4000003', '192.168.0.13')]:
+        trie[net_id] = {'id': net_id, 'routes': addr_get_netcfg(gw).net_routes}
+        id_trie[net_id] = ([], [False, False])
+    subnets.sync(trie)
+    assert subnets.synced
+    assert len(subnets) == 2
+    assert int_to_addr(subnets.allocate()) == '192.168.0.0'
+    assert int_to_addr(subnets.allocate()) == '192.168.0.8'
+
+    ct.subnets = subnets
+    try:
+        cleanup_state_tries(trie, id_trie, 'beafde52b4000001', None)
+        assert len(subnets) == 1
+        assert int_to_addr(subnets.allocate()) == '192.168.0.4'
+    finally:
+        ct.subnets = None
+    shutil.rmtree(snap_dir)
+
+
+def test_update_state_tries_concurrent():
+    seq_client = mock_async_ctlr_client()
+    seq_net = datrie.Trie(string.hexdigits)
+    seq_id = datrie.Trie(string.hexdigits)
+    run_async(update_state_tries(seq_client, seq_net, seq_id))
+
+    client = mock_async_ctlr_client()
+    net_trie = datrie.Trie(string.hexdigits)
+    id_trie = datrie.Trie(string.hexdigits)
+    run_async(update_state_tries(client, net_trie, id_trie, max_requests=3))
+
+    assert len(list(net_trie)) == 8
+    assert net_trie.items() == seq_net.items()
+    assert id_trie.items() == seq_id.items()
+    assert sorted(client.endpoints) == sorted(seq_client.endpoints)
+
+
+def test_refresh_state_tries():
+    seq_net = datrie.Trie(string.hexdigits)
+    seq_id = datrie.Trie(string.hexdigits)
+    run_async(update_state_tries(mock_async_ctlr_client(), seq_net, seq_id))
+
+    client = mock_async_ctlr_client()
+    net_trie = datrie.Trie(string.hexdigits)
+    id_trie = datrie.Trie(string.hexdigits)
+    revs = {}
+    added, changed, removed = run_async(refresh_state_tries(client, net_trie, id_trie, revs))
+    assert len(added) == 8
+    assert changed == removed == set()
+    assert net_trie.items() == seq_net.items()
+    assert id_trie.items() == seq_id.items()
+
+    # steady state: no member GETs and nothing written
+    client.endpoints = []
+    res = run_async(refresh_state_tries(client, net_trie, id_trie, revs))
+    assert res == (set(), set(), set())
+    assert len(client.endpoints) == 7
+
+    mbr = dict(client.mbrs['beafde52b4a5e8ab']['ff2ffdb2e1'], revision=9)
+    client.mbrs['beafde52b4a5e8ab']['ff2ffdb2e1'] = mbr
+    del client.mbrs['beafde52b4a5f7ba']['ff2ffdb2e1']
+    added, changed, removed = run_async(refresh_state_tries(client, net_trie, id_trie, revs))
+    assert added == set()
+    assert changed == {'beafde52b4a5e8abff2ffdb2e1'}
+    assert removed == {'beafde52b4a5f7baff2ffdb2e1'}
+    assert net_trie['beafde52b4a5e8abff2ffdb2e1']['revision'] == 9
+    assert 'beafde52b4a5f7baff2ffdb2e1' not in net_trie
+
+    # deauthorized member is dropped too; tries match a full reload
+    mbr = dict(client.mbrs['beafde52b4a5e8ab']['ff2ffdb2e1'], revision=10, authorized=False)
+    client.mbrs['beafde52b4a5e8ab']['ff2ffdb2e1'] = mbr
+    added, changed, removed = run_async(refresh_state_tries(client, net_trie, id_trie, revs))
+    assert changed == {'beafde52b4a5e8abff2ffdb2e1'}
+    assert 'beafde52b4a5e8abff2ffdb2e1' not in net_trie
+    seq_net = datrie.Trie(string.hexdigits)
+    seq_id = datrie.Trie(string.hexdigits)
+    run_async(update_state_tries(client, seq_net, seq_id))
+    assert net_trie.items() == seq_net.items()
+    assert id_trie.items() == seq_id.items()
+
+
+def test_state_runner_bad_role():
+    with pytest.raises(ValueError):
+        StateRunner('foostate')
+
+
+def test_state_runner():
+    import types
+    from node_tools import ctlr_data as ct
+
+    class mock_zt_client(mock_async_ctlr_client):
+        def __init__(self, token, loop, session):
+            super(mock_zt_client, self).__init__()
+            self.session = session
+
+    zt_mod = types.ModuleType('ztcli_api')
+    zt_mod.ZeroTier = mock_zt_client
+    zt_mod.ZeroTierConnectionError = Exception
+    cycles = []
+
+    async def run_cycle(client, cache, **queues):
+        cycles.append((client, sorted(queues)))
+        await client.get_data('controller/network')
+        if len(cycles) == 2:
+            raise RuntimeError('API timeout')
+
+    with mock.patch.dict(sys.modules, {'ztcli_api': zt_mod}), \
+            mock.patch('node_tools.helper_funcs.get_token', return_value='abc123'):
+        runner = StateRunner('netstate')
+        with mock.patch.object(runner.module, 'run_cycle', run_cycle), \
+                mock.patch.object(runner.queues['netobj_q'], 'save') as save:
+            runner.run()
+            session = runner.session
+            with pytest.raises(RuntimeError):
+                runner.run()
+            runner.run()
+            assert save.call_count == 3
+
+        assert runner.session is session and not session.closed
+        assert len(set(id(client) for client, _ in cycles)) == 1
+        assert cycles[0][1] == sorted(['off_q', 'node_q', 'netobj_q', 'staging_q', 'wdg_q'])
+        assert cycles[0][0].data == list(cycles[0][0].nets)
+        runner.close()
+        assert session.closed
+        assert runner.loop.is_closed()
+    ct.subnets = None
+
+
+def test_bootstrap_mbr_nodes():
+    import diskcache as dc
+    from node_tools import ctlr_data as ct
+
+    ctlr_id = 'beafde52b4'
+    new_nodes = ['deadbeef01', 'deadbeef02', 'deadbeef03']
+    netobj_q = dc.Deque(directory='/tmp/test-bq')
+    results = []
+
+    for batch in [False, True]:
+        ct.net_trie.clear()
+        ct.id_trie.clear()
+        netobj_q.clear()
+        gen_netobj_queue(netobj_q, ipnet='192.168.0.0/28')
+        client = mock_async_ctlr_client()
+        run_async(update_state_tries(client, ct.net_trie, ct.id_trie))
+        NODE_SETTINGS['use_exitnode'].append('beefea68e6')
+        rebuild_ring(ct.ring, ct.net_trie, ct.id_trie)
+        boot_list = get_bootstrap_list(ct.net_trie, ct.id_trie)
+        assert get_bootstrap_list(ct.net_trie, ct.id_trie, ct.ring) == boot_list
+
+        if batch:
+            node_times, batch_time = run_async(bootstrap_mbr_nodes(client, ctlr_id, new_nodes,
+                                                                   netobj_q, max_requests=2))
+            assert list(node_times) == new_nodes
+            assert batch_time >= max(node_times.values())
+        else:
+            for node_id in new_nodes:
+                run_async(bootstrap_mbr_node(client, ctlr_id, node_id, netobj_q))
+        mbr_addrs = [(k, v['ipAssignments']) for k, v in ct.net_trie.items() if len(k) > 16]
+        results.append((mbr_addrs, ct.id_trie.items()))
+        ring_list = get_bootstrap_list(ct.net_trie, ct.id_trie, ct.ring)
+        assert ring_list == new_nodes[::-1] + boot_list
+        assert ct.ring.dangling() == find_dangling_nets(ct.id_trie)
+        NODE_SETTINGS['use_exitnode'].clear()
+
+    assert results[0] == results[1]
+    assert len(list(ct.net_trie)) == 14
+    assert find_dangling_nets(ct.id_trie)[1] == 'deadbeef03'
+
+    netobj_q.clear()
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    ct.ring.clear()
+
+
+def test_bootstrap_mbr_nodes_link_error():
+    from node_tools import ctlr_data as ct
+
+    class failing_client(mock_async_ctlr_client):
+        async def get_data(self, endpoint):
+            if endpoint.endswith('/member/deadbeef02'):
+                raise RuntimeError('API timeout')
+            await super(failing_client, self).get_data(endpoint)
+
+    ctlr_id = 'beafde52b4'
+    new_nodes = ['deadbeef01', 'deadbeef02', 'deadbeef03']
+    netobj_q = SubnetAllocator(ipnet='192.168.0.0/28')
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    client = failing_client()
+    run_async(update_state_tries(client, ct.net_trie, ct.id_trie))
+    NODE_SETTINGS['use_exitnode'].append('beefea68e6')
+    rebuild_ring(ct.ring, ct.net_trie, ct.id_trie)
+    boot_list = get_bootstrap_list(ct.net_trie, ct.id_trie)
+
+    node_times, _ = run_async(bootstrap_mbr_nodes(client, ctlr_id, new_nodes, netobj_q))
+    assert list(node_times) == ['deadbeef01', 'deadbeef03']
+    assert len(netobj_q) == 2
+    assert 'deadbeef02' not in ct.id_trie
+    assert not [k for k in ct.net_trie if k.endswith('deadbeef02')]
+    assert not [m for net in client.mbrs.values() for m in net if m == 'deadbeef02']
+    assert get_bootstrap_list(ct.net_trie, ct.id_trie, ct.ring) == ['deadbeef03', 'deadbeef01'] + boot_list
+    assert ct.ring.dangling() == find_dangling_nets(ct.id_trie)
+    NODE_SETTINGS['use_exitnode'].clear()
+
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    ct.ring.clear()
+
+
+def test_net_trie_node_index():
+    from node_tools import ctlr_data as ct
+
+    trie = NetTrie(string.hexdigits)
+    client = mock_async_ctlr_client()
+    run_async(update_state_tries(client, trie, ct.id_trie))
+    node_ids = set(key[16:] for key in trie if len(key) > 16)
+    for node_id in node_ids:
+        assert get_node_nets(trie, node_id) == get_node_nets(dict(trie.items()), node_id)
+
+    node_id = sorted(node_ids)[0]
+    net_list = get_node_nets(trie, node_id)
+    del trie[net_list[0] + node_id]
+    assert get_node_nets(trie, node_id) == net_list[1:]
+    trie.pop(net_list[-1] + node_id, None)
+    assert net_list[-1] not in get_node_nets(trie, node_id)
+
+    with tempfile.NamedTemporaryFile() as f:
+        trie.save(f.name)
+        loaded = NetTrie.load(f.name)
+    assert loaded.node_nets == trie.node_nets
+    trie.clear()
+    assert trie.node_nets == {}
+    assert get_node_nets(trie, node_id) == []
+    ct.id_trie.clear()
+
+
+def test_member_ring():
+    ring = MemberRing()
+    exit_id = 'beefea68e6'
+    nodes = ['deadbeef01', 'deadbeef02', 'deadbeef03']
+    nets = ['beafde52b4' + '{:06x}'.format(x) for x in range(4)]
+    NODE_SETTINGS['use_exitnode'].append(exit_id)
+
+    ring.add_node(exit_id, nets[0])
+    assert ring.dangling() == [nets[0], exit_id]
+    assert ring.bootstrap_list() == []
+    for idx, node_id in enumerate(nodes):
+        ring.add_node(node_id, nets[idx + 1])
+        up_net, up_node = ring.dangling()
+        ring.link(node_id, up_net, up_node)
+    assert len(ring) == 4
+    assert ring.head() == nodes[0]
+    assert ring.tail() == nodes[2]
+    assert ring.bootstrap_list() == nodes[::-1]
+    assert ring.neighbors(nodes[1]) == (nets[2], nets[1], nodes[2], nodes[0])
+    assert ring.neighbors(exit_id) == (nets[0], None, nodes[0], None)
+
+    # remove a node and relink its downstream neighbor
+    ring.remove(nodes[1])
+    assert nodes[1] not in ring
+    assert ring.neighbors(nodes[2]) == (nets[3], None, None, None)
+    ring.link(nodes[2], nets[1], nodes[0])
+    assert ring.bootstrap_list() == [nodes[2], nodes[0]]
+
+    # close the ring (detach head from the exit node)
+    ring.unlink(nodes[0])
+    ring.link(nodes[0], nets[3], nodes[2])
+    assert ring.head() is None
+    assert ring.dangling() == [nets[0], exit_id]
+    assert ring.bootstrap_list() == []
+
+    # two open nodes (eg, a relink in progress) returns the oldest one
+    ring.clear()
+    ring.add_node(exit_id, nets[0])
+    for idx, node_id in enumerate(nodes[:2]):
+        ring.add_node(node_id, nets[idx + 1])
+        ring.link(node_id, nets[0], exit_id)
+    assert ring.dangling() == [nets[1], nodes[0]]
+
+    ring.clear()
+    assert len(ring) == 0
+    NODE_SETTINGS['use_exitnode'].clear()
+
+
+def test_sync_ring():
+    from node_tools import ctlr_data as ct
+
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    client = mock_async_ctlr_client()
+    run_async(update_state_tries(client, ct.net_trie, ct.id_trie))
+    ring = MemberRing()
+
+    assert sync_ring(ring, ct.net_trie, ct.id_trie)
+    assert not sync_ring(ring, ct.net_trie, ct.id_trie)
+    with mock.patch('node_tools.topology_funcs.rebuild_ring') as rebuild:
+        with mock.patch.object(ct.id_trie, 'keys') as keys:
+            assert not sync_ring(ring, ct.net_trie, ct.id_trie)
+            keys.assert_not_called()
+        rebuild.assert_not_called()
+
+    node_id = [x for x in ct.id_trie if x in ring][0]
+    del ct.id_trie[node_id]
+    assert sync_ring(ring, ct.net_trie, ct.id_trie)
+    assert node_id not in ring
+    assert sync_ring(ring, ct.net_trie, ct.id_trie, force=True)
+
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+
+
+def test_offline_mbr_nodes():
+    import diskcache as dc
+    from node_tools import ctlr_data as ct
+
+    ctlr_id = 'beafde52b4'
+    new_nodes = ['deadbeef01', 'deadbeef02', 'deadbeef03', 'deadbeef04', 'deadbeef05']
+    off_nodes = ['deadbeef02', 'deadbeef03', 'deadbeef05']
+    netobj_q = dc.Deque(directory='/tmp/test-oq')
+    NODE_SETTINGS['use_exitnode'].append('beefea68e6')
+    results = []
+
+    for batch in [False, True]:
+        ct.net_trie.clear()
+        ct.id_trie.clear()
+        netobj_q.clear()
+        gen_netobj_queue(netobj_q, ipnet='192.168.0.0/27')
+        client = mock_async_ctlr_client()
+        run_async(update_state_tries(client, ct.net_trie, ct.id_trie))
+        rebuild_ring(ct.ring, ct.net_trie, ct.id_trie)
+        for node_id in new_nodes:
+            run_async(bootstrap_mbr_node(client, ctlr_id, node_id, netobj_q))
+        run_async(update_state_tries(client, ct.net_trie, ct.id_trie))
+        num_calls = len(client.writes)
+
+        with mock.patch('node_tools.network_funcs.publish_cfg_msg'), \
+                mock.patch('node_tools.network_funcs.publish_cfg_msgs'):
+            if batch:
+                res = run_async(offline_mbr_nodes(client, off_nodes, max_requests=2))
+                assert res == ['deadbeef04']
+            else:
+                for node_id in off_nodes:
+                    run_async(offline_mbr_node(client, node_id))
+                    run_async(update_state_tries(client, ct.net_trie, ct.id_trie))
+        num_calls = len(client.writes) - num_calls
+
+        auth_mbrs = {}
+        for net_id, mbrs in client.mbrs.items():
+            auth_mbrs[net_id] = sorted(k for k, v in mbrs.items() if v['authorized'])
+        ring_nbrs = [(x, ct.ring.neighbors(x)) for x in new_nodes if x in ct.ring]
+        results.append((auth_mbrs, ring_nbrs, num_calls))
+
+    assert results[0][0:2] == results[1][0:2]
+    assert [x[0] for x in results[1][1]] == ['deadbeef01', 'deadbeef04']
+    assert results[1][1][1][1][3] == 'deadbeef01'
+    assert results[1][2] < results[0][2]
+
+    NODE_SETTINGS['use_exitnode'].clear()
+    netobj_q.clear()
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    ct.ring.clear()
+
+
+def test_ctlr_snapshot():
+    from node_tools import ctlr_data as ct
+
+    snap_dir = tempfile.mkdtemp()
+    assert load_ctlr_snapshot(snap_dir) is False
+
+    client = mock_async_ctlr_client()
+    run_async(refresh_state_tries(client, ct.net_trie, ct.id_trie, ct.revisions))
+    net_items = ct.net_trie.items()
+    id_items = ct.id_trie.items()
+    revs = dict(ct.revisions)
+    assert save_ctlr_snapshot(snap_dir) is True
+
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    ct.revisions.clear()
+    assert load_ctlr_snapshot(snap_dir) is True
+    assert ct.net_trie.items() == net_items
+    assert ct.id_trie.items() == id_items
+    assert ct.revisions == revs
+    assert ct.net_trie.node_nets != {}
+
+    # warm start only needs the member lists from the live API
+    client.endpoints = []
+    res = run_async(refresh_state_tries(client, ct.net_trie, ct.id_trie, ct.revisions))
+    assert res == (set(), set(), set())
+    assert len(client.endpoints) == 7
+
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    ct.revisions.clear()
+    shutil.rmtree(snap_dir)
+
+
+def test_trie_record():
+    import pickle
+
+    nets, mbrs = load_ctlr_data()
+    net_data = nets[0]
+    mbr_data = mbrs[0]
+    net_rec = TrieRecord(net_data)
+    mbr_rec = TrieRecord(mbr_data)
+
+    assert net_rec['routes'] == net_data['routes']
+    assert net_rec['name'] == net_data['name']
+    assert mbr_rec['ipAssignments'] == ['172.16.0.121']
+    assert mbr_rec['authorized'] is True
+    assert mbr_rec.get('routes') is None
+    assert 'identity' in mbr_rec
+    assert 'routes' in net_rec and 'routes' not in mbr_rec
+    with mock.patch.object(TrieRecord, 'data', new_callable=mock.PropertyMock) as data:
+        assert 'authorized' in mbr_rec
+        assert 'ipAssignments' not in net_rec
+        assert not data.called
+
+    # route fields other than target/via are kept
+    routes = [{'target': '172.16.1.140/30', 'via': None, 'flags': 0, 'metric': 10}]
+    route_rec = TrieRecord(dict(net_data, routes=routes))
+    assert route_rec['routes'] == routes
+    route_rec['routes'][0]['metric'] = 0
+    assert route_rec['routes'] == routes
+    with pytest.raises(KeyError):
+        net_rec['ipAssignments']
+    assert net_rec == net_data
+    assert net_rec.data == net_data
+    assert pickle.loads(pickle.dumps(mbr_rec)) == mbr_rec
+
+    trie = NetTrie(string.hexdigits)
+    trie[net_data['id']] = net_data
+    trie[net_data['id'] + mbr_data['id']] = mbr_data
+    assert isinstance(trie[net_data['id']], TrieRecord)
+    assert get_dangling_net_data(trie, net_data['id']).gateway == ['172.16.1.141/30']
+
+
+def test_ctlr_journal():
+    from node_tools import ctlr_data as ct
+
+    snap_dir = tempfile.mkdtemp()
+    journal = open_ctlr_journal(snap_dir, sync_every=4)
+    assert ct.net_trie.journal is journal
+
+    client = mock_async_ctlr_client()
+    run_async(refresh_state_tries(client, ct.net_trie, ct.id_trie, ct.revisions))
+    cleanup_state_tries(ct.net_trie, ct.id_trie, 'beafde52b4a5f7ba', 'ff2ffdb2e1', mbr_only=True)
+    net_items = ct.net_trie.items()
+    id_items = ct.id_trie.items()
+    assert journal.pending < 4
+    close_ctlr_journal()
+    assert ct.net_trie.journal is None
+
+    # replay rebuilds state without the API
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    open_ctlr_journal(snap_dir)
+    assert ct.net_trie.items() == net_items
+    assert ct.id_trie.items() == id_items
+    assert ct.net_trie.node_nets['ff2ffdb2e1'] == ['beafde52b4a5e8ab']
+
+    # compaction truncates the journal
+    assert save_ctlr_snapshot(snap_dir) is True
+    assert os.path.getsize(ct.journal.fname) == 0
+    del_key = id_items[0][0]
+    del ct.id_trie[del_key]
+    close_ctlr_journal()
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    open_ctlr_journal(snap_dir)
+    assert ct.net_trie.items() == net_items
+    assert del_key not in ct.id_trie
+
+    close_ctlr_journal()
+    ct.net_trie.clear()
+    ct.id_trie.clear()
+    ct.revisions.clear()
+    shutil.rmtree(snap_dir)
+
+
+def test_topology_store():
+    from node_tools import ctlr_data as ct
+
+    client = mock_async_ctlr_client()
+    run_async(update_state_tries(client, ct.net_trie, ct.id_trie))
+    NODE_SETTINGS['use_exitnode'].append('beefea68e6')
+    store = TopologyStore(ct.net_trie, ct.id_trie)
+
+    assert store.active_nodes() == get_active_nodes(ct.id_trie)
+    assert store.dangling_net() == find_dangling_nets(ct.id_trie)
+    assert store.exit_net() == find_exit_net(ct.id_trie)
+    assert store.bootstrap_list() == get_bootstrap_list(ct.net_trie, ct.id_trie)
+    views_key = store.views_key
+    assert 'bootstrap_list' in store.views
+    assert store.node_ids() == store.node_ids()
+    assert store.views_key == views_key
+
+    # any trie mutation drops the cached views
+    node_id = store.active_nodes()[0]
+    del ct.id_trie[node_id]
+    assert node_id not in store.active_nodes()
+    assert store.views_key != views_key
+    assert 'bootstrap_list' not in store.views
+
+    # plain tries are not cached
+    plain = TopologyStore(datrie.Trie(string.hexdigits), datrie.Trie(string.hexdigits))
+    assert plain.active_nodes() == []
+    assert plain.views == {}
+
+    NODE_SETTINGS['use_exitnode'].clear()
+    ct.net_trie.clear()
+    ct.id_trie.clear()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Target:   Python 3.6
+
+"""
+Compare per-item vs bulk (single transaction) load_cache_by_type for
+large peer lists.  Counts the SQLite transaction commits on the cache
+connection and the wall-clock time for an initial load, an update of
+the same peers, an unchanged refresh (skipped writes), and a shrink
+(delete half the entries).
+"""
+
+import logging
+import shutil
+import sys
+import tempfile
+import time
+
+from diskcache import Index
+
+from node_tools.cache_funcs import load_cache_by_type
+
+
+logging.disable(logging.WARNING)
+
+sizes = [int(x) for x in sys.argv[1:]] or [500, 2000]
+
+
+def gen_peers(size, latency=10):
+    """
+    Generate peer payloads with the same shape as the ZT API data.
+    """
+    return [{'address': '{:010x}'.format(idx + 1),
+             'isBonded': False, 'latency': latency, 'role': 'LEAF',
+             'version': '1.4.6', 'versionMajor': 1, 'versionMinor': 4,
+             'versionRev': 6,
+             'paths': [{'active': True, 'address': '10.0.{}.{}/9993'.format(idx // 250, idx % 250),
+                        'expired': False, 'lastReceive': 1589673393421,
+                        'lastSend': 1589673393421, 'preferred': True,
+                        'trustedPathId': 0}]}
+            for idx in range(size)]
+
+
+def count_commits(cache):
+    """
+    Attach a statement counter to the cache connection.
+    :return: list with the running COMMIT count
+    """
+    counter = [0]
+
+    def trace(stmt):
+        if stmt.startswith('COMMIT'):
+            counter[0] += 1
+
+    cache._cache._con.set_trace_callback(trace)
+    return counter
+
+
+def run_steps(size, bulk):
+    tmp_dir = tempfile.mkdtemp()
+    cache = Index(tmp_dir)
+    counter = count_commits(cache)
+    steps = [('load', gen_peers(size)),
+             ('update', gen_peers(size, latency=20)),
+             ('refresh', gen_peers(size, latency=20)),
+             ('shrink', gen_peers(size // 2))]
+    results = []
+
+    for label, data in steps:
+        counter[0] = 0
+        start = time.perf_counter()
+        load_cache_by_type(cache, data, 'peer', bulk=bulk)
+        results.append((label, counter[0], time.perf_counter() - start))
+    assert len(cache) == size // 2
+    shutil.rmtree(tmp_dir)
+    return results
+
+
+for size in sizes:
+    print('{} peers'.format(size))
+    for bulk in [False, True]:
+        mode = 'bulk' if bulk else 'per-item'
+        for label, commits, elapsed in run_steps(size, bulk):
+            print('  {:8} {:7} {:6} commits {:8.3f} s'.format(mode, label, commits, elapsed))
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Target:   Python 3.6
+
+"""
+Compare the old cache value format (pickled AttrDict trees on the
+default diskcache Disk) with the JSONDisk format from open_cache()
+(compact JSON of plain dicts).  Prints the on-disk value size, the
+load time, and the read time for get_peer_status (cold, ie, with an
+empty entry view cache, and warm) and get_state.
+"""
+
+import logging
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+from diskcache import Index
+
+from node_tools.cache_funcs import get_entry_views
+from node_tools.cache_funcs import get_peer_status
+from node_tools.cache_funcs import get_state
+from node_tools.cache_funcs import load_cache_by_type
+from node_tools.cache_funcs import open_cache
+from node_tools.helper_funcs import AttrDict
+
+
+logging.disable(logging.WARNING)
+
+sizes = [int(x) for x in sys.argv[1:]] or [500, 2000]
+reads = 20
+state_reads = 1000
+
+
+def gen_peers(size):
+    """
+    Generate peer payloads with the same shape as the ZT API data.
+    """
+    return [{'address': '{:010x}'.format(idx + 1),
+             'isBonded': False, 'latency': 10, 'role': 'LEAF',
+             'version': '1.4.6', 'versionMajor': 1, 'versionMinor': 4,
+             'versionRev': 6,
+             'paths': [{'active': True, 'address': '10.0.{}.{}/9993'.format(idx // 250, idx % 250),
+                        'expired': False, 'lastReceive': 1589673393421,
+                        'lastSend': 1589673393421, 'preferred': True,
+                        'trustedPathId': 0}]}
+            for idx in range(size)]
+
+
+def gen_node():
+    return {'address': 'beefea68e6', 'online': True, 'tcpFallbackActive': False,
+            'version': '1.4.6', 'config': {'settings': {'portMappingEnabled': True,
+                                                        'primaryPort': 9993}}}
+
+
+def gen_states():
+    """
+    State entries as built by the node status handlers.
+    """
+    nstate = {'identity': 'beefea68e6', 'status': 'ONLINE', 'tcpFallback': False}
+    istate = [{'identity': 'b6079f73c63cea29', 'status': 'OK', 'ztdevice': 'ztbtovjx4',
+               'ztaddress': '172.16.0.2', 'gateway': '172.16.0.1'},
+              {'identity': '3efa5cb78a8129ad', 'status': 'OK', 'ztdevice': 'ztbtovjx5',
+               'ztaddress': '10.0.0.1', 'gateway': '10.0.0.1'}]
+    return [('nstate', [nstate]), ('istate', istate)]
+
+
+def value_bytes(directory):
+    """
+    Sum the size of the stored values (all small enough to be inline).
+    """
+    con = sqlite3.connect(directory + '/cache.db')
+    total = con.execute('SELECT SUM(LENGTH(value)) FROM Cache').fetchone()[0]
+    con.close()
+    return total or 0
+
+
+def load_pickled(cache, peers):
+    cache['node-' + gen_node()['address']] = AttrDict.from_nested_dict(gen_node())
+    for key_str, states in gen_states():
+        for state in states:
+            cache[key_str + '-' + state['identity']] = AttrDict.from_nested_dict(state)
+    for peer in peers:
+        cache['peer-' + peer['address']] = AttrDict.from_nested_dict(peer)
+
+
+def load_json(cache, peers):
+    load_cache_by_type(cache, gen_node(), 'node')
+    for key_str, states in gen_states():
+        load_cache_by_type(cache, states[0] if key_str == 'nstate' else states, key_str)
+    load_cache_by_type(cache, peers, 'peer')
+
+
+def run_format(label, opener, loader, peers):
+    tmp_dir = tempfile.mkdtemp()
+    cache = opener(tmp_dir)
+
+    start = time.perf_counter()
+    loader(cache, peers)
+    load_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(reads):
+        get_entry_views(cache).clear()
+        assert len(get_peer_status(cache)) == len(peers)
+    cold_time = (time.perf_counter() - start) / reads
+
+    start = time.perf_counter()
+    for _ in range(reads):
+        assert len(get_peer_status(cache)) == len(peers)
+    peer_time = (time.perf_counter() - start) / reads
+
+    start = time.perf_counter()
+    for _ in range(state_reads):
+        get_state(cache)
+    state_time = (time.perf_counter() - start) / state_reads * 1e6
+
+    size = value_bytes(tmp_dir)
+    shutil.rmtree(tmp_dir)
+    print('  {:7} {:9} bytes  load {:7.3f} s  get_peer_status cold {:7.3f} s  '
+          'warm {:7.3f} s  get_state {:6.1f} us'.format(label, size, load_time, cold_time,
+                                                        peer_time, state_time))
+
+
+for size in sizes:
+    peers = gen_peers(size)
+    print('{} peers'.format(size))
+    run_format('pickle', Index, load_pickled, peers)
+    run_format('json', open_cache, load_json, peers)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Target:   Python 3.6
+
+"""
+Compare the legacy nested-scan orphan check with the single-sweep
+`find_orphans` on synthetic member chains (10k and 100k nodes).  The
+legacy check is timed on a sample of nodes and extrapolated, since a
+full run takes far too long at these sizes.
+"""
+
+import logging
+import string
+import sys
+import time
+
+import datrie
+
+from node_tools.helper_funcs import NODE_SETTINGS
+from node_tools.trie_funcs import find_orphans
+
+
+logging.disable(logging.WARNING)
+
+ctlr_id = 'beafde52b4'
+sizes = [int(x) for x in sys.argv[1:]] or [10000, 100000]
+sample = 20
+
+
+def gen_chain_tries(size):
+    """
+    Generate net/id tries for a chain of `size` nodes; every 1000th node
+    is left with a single (orphan) net.
+    """
+    net_trie = datrie.Trie(string.hexdigits)
+    id_trie = datrie.Trie(string.hexdigits)
+    nodes = ['{:010x}'.format(x + 1) for x in range(size)]
+    nets = [ctlr_id + '{:06x}'.format(x) for x in range(size)]
+
+    for idx, (node_id, net_id) in enumerate(zip(nodes, nets)):
+        net_trie[net_id] = {'id': net_id}
+        net_trie[net_id + node_id] = {'id': node_id}
+        id_trie[node_id] = ([net_id], [False, False])
+        id_trie[net_id] = ([node_id], [False, False])
+        if idx > 0 and idx % 1000:
+            net_trie[nets[idx - 1] + node_id] = {'id': node_id}
+    NODE_SETTINGS['use_exitnode'] = [nodes[0]]
+    return net_trie, id_trie, nodes
+
+
+def legacy_find_orphans(net_trie, id_trie, node_list):
+    """
+    The old nested loop (every node ID against every net trie key).
+    """
+    orphan_nets = []
+    orphan_nodes = []
+
+    for node_id in node_list:
+        net_list = []
+        for key in list(net_trie):
+            if node_id in key:
+                net_list.append((key[0:16], node_id))
+        if len(net_list) == 1:
+            orphan_nets.append(net_list[0])
+        elif len(net_list) == 0:
+            orphan_nodes.append(node_id)
+
+    return orphan_nets, orphan_nodes
+
+
+for size in sizes:
+    net_trie, id_trie, nodes = gen_chain_tries(size)
+    print('{} nodes, {} net trie keys'.format(size, len(net_trie)))
+
+    start = time.perf_counter()
+    orphans = find_orphans(net_trie, id_trie)
+    sweep_time = time.perf_counter() - start
+    print('  find_orphans (single sweep): {:.3f} s ({} orphan nets)'.format(sweep_time,
+                                                                          len(orphans[0])))
+
+    start = time.perf_counter()
+    legacy_find_orphans(net_trie, id_trie, nodes[1:sample + 1])
+    legacy_time = (time.perf_counter() - start) * (size - 1) / sample
+    print('  legacy nested scan (est. from {} nodes): {:.1f} s'.format(sample, legacy_time))
+    print('  speedup: {:.0f}x'.format(legacy_time / sweep_time))
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Target:   Python 3.6
+
+"""
+Compare the msg_queues helpers on plain diskcache Deques and on the
+IndexedDeque type for queues holding many node IDs (eg, during an
+announce storm).  Times add_one_only (duplicates), handle_announce_msg
+and a clean_from_queue/add cycle per msg.
+"""
+
+import shutil
+import sys
+import tempfile
+import time
+
+from diskcache import Deque
+
+from node_tools.msg_queues import IndexedDeque
+from node_tools.msg_queues import add_one_only
+from node_tools.msg_queues import clean_from_queue
+from node_tools.msg_queues import handle_announce_msg
+
+
+sizes = [int(x) for x in sys.argv[1:]] or [200, 1000]
+msgs = 200
+
+
+def gen_nodes(size):
+    return ['{:010x}'.format(idx + 1) for idx in range(size)]
+
+
+def run_ops(queue_type, size):
+    tmp_dir = tempfile.mkdtemp()
+    node_q = queue_type(directory=tmp_dir + '/nq')
+    reg_q = queue_type(directory=tmp_dir + '/rq')
+    wait_q = queue_type(directory=tmp_dir + '/wq')
+    nodes = gen_nodes(size)
+    node_q.extend(nodes)
+    wait_q.extend(nodes[::2])
+    picks = nodes[::max(size // msgs, 1)][:msgs]
+    results = []
+
+    start = time.perf_counter()
+    for node_id in picks:
+        add_one_only(node_id, node_q)
+    results.append(('add_one_only', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for node_id in picks:
+        handle_announce_msg(node_q, reg_q, wait_q, node_id)
+    results.append(('handle_announce_msg', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    for node_id in picks:
+        clean_from_queue(node_id, wait_q)
+        wait_q.append(node_id)
+    results.append(('clean_from_queue', time.perf_counter() - start))
+
+    assert len(node_q) == size
+    shutil.rmtree(tmp_dir)
+    return results
+
+
+for size in sizes:
+    print('{} nodes, {} msgs'.format(size, msgs))
+    for queue_type in [Deque, IndexedDeque]:
+        for label, elapsed in run_ops(queue_type, size):
+            print('  {:12} {:20} {:8.1f} usec/msg'.format(queue_type.__name__, label,
+                                                          elapsed / msgs * 1e6))
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Target:   Python 3.6
+
+"""
+Compare memory use (tracemalloc) and snapshot size/time for full JSON
+dict payloads vs compact TrieRecord payloads in the net state trie.
+"""
+
+import os
+import string
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import datrie
+
+from node_tools.trie_funcs import NetTrie
+
+
+ctlr_id = 'beafde52b4'
+sizes = [int(x) for x in sys.argv[1:]] or [1000, 10000]
+
+
+def gen_mbr_data(net_id, node_id, idx):
+    """
+    Generate a member payload with the same shape as the ZT API data.
+    """
+    return {'activeBridge': False, 'address': node_id, 'authorized': True,
+            'capabilities': [], 'creationTime': 1587843927766 + idx,
+            'id': node_id,
+            'identity': node_id + ':0:' + os.urandom(64).hex(),
+            'ipAssignments': ['172.16.{}.{}'.format(idx // 64 % 256, idx % 64 * 4 + 1)],
+            'lastAuthorizedCredential': None,
+            'lastAuthorizedCredentialType': 'api',
+            'lastAuthorizedTime': 1587843927831 + idx,
+            'lastDeauthorizedTime': 0, 'noAutoAssignIps': False,
+            'nwid': net_id, 'objtype': 'member', 'remoteTraceLevel': 0,
+            'remoteTraceTarget': None, 'revision': 3, 'tags': [],
+            'vMajor': 1, 'vMinor': 4, 'vProto': 10, 'vRev': 6}
+
+
+def gen_net_data(net_id, idx):
+    """
+    Generate a network payload with the same shape as the ZT API data.
+    """
+    gw = '172.16.{}.{}'.format(idx // 64 % 256, idx % 64 * 4 + 1)
+    return {'authTokens': [{}], 'capabilities': [],
+            'creationTime': 1588705316568 + idx, 'enableBroadcast': True,
+            'id': net_id,
+            'ipAssignmentPools': [{'ipRangeEnd': gw, 'ipRangeStart': gw}],
+            'mtu': 2800, 'multicastLimit': 32, 'name': 'zu4sy6zsh6_2gn6dstlph',
+            'nwid': net_id, 'objtype': 'network', 'private': True,
+            'remoteTraceLevel': 0, 'remoteTraceTarget': None, 'revision': 2,
+            'routes': [{'target': gw[:-1] + '0/30', 'via': None},
+                       {'target': '0.0.0.0/0', 'via': gw}],
+            'rules': [{'not': False, 'or': False, 'type': 'ACTION_ACCEPT'}],
+            'rulesSource': '', 'tags': [], 'v4AssignMode': {'zt': False},
+            'v6AssignMode': {'6plane': False, 'rfc4193': False, 'zt': False}}
+
+
+def gen_payloads(size):
+    payloads = []
+    for idx in range(size):
+        net_id = ctlr_id + '{:06x}'.format(idx)
+        node_id = '{:010x}'.format(idx + 1)
+        payloads.append((net_id, gen_net_data(net_id, idx)))
+        payloads.append((net_id + node_id, gen_mbr_data(net_id, node_id, idx)))
+    return payloads
+
+
+def measure(trie_cls, size):
+    """
+    Load a trie from fresh payloads and return the traced memory (MB)
+    plus snapshot save time (sec) and size (MB).
+    """
+    tracemalloc.start()
+    payloads = gen_payloads(size)
+    trie = trie_cls(string.hexdigits)
+    for key, data in payloads:
+        trie[key] = data
+    del payloads
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    fd, fname = tempfile.mkstemp(suffix='.dat')
+    os.close(fd)
+    start = time.perf_counter()
+    trie.save(fname)
+    save_time = time.perf_counter() - start
+    save_size = os.path.getsize(fname)
+    os.remove(fname)
+    return used / 2**20, save_time, save_size / 2**20
+
+
+for size in sizes:
+    print('{} nodes ({} net trie keys)'.format(size, size * 2))
+    for label, trie_cls in [('dict payloads', datrie.Trie), ('TrieRecord payloads', NetTrie)]:
+        used, save_time, save_size = measure(trie_cls, size)
+        print('  {:20} {:8.2f} MB traced, save {:.3f} s, {:.2f} MB on disk'.format(label,
+                                                                                    used,
+                                                                                    save_time,
+                                                                                    save_size))
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# Target:   Python 3.6
+
+"""
+Scale benchmarks for the ctlr trie functions.  Synthesizes valid
+net_trie/id_trie states for open chains and closed rings (using the
+same /30 netcfg layout as the netobj queue) and times the main trie
+queries, then prints (or saves) the results as JSON for comparison
+between runs.
+
+usage: trie_scale_bench.py [-s 100 1000 10000 100000] [-n 500] [-o out.json]
+"""
+
+import argparse
+import datetime
+import ipaddress
+import itertools
+import json
+import logging
+import platform
+import random
+import string
+import time
+
+from node_tools.ctlr_funcs import ipnet_get_netcfg
+from node_tools.helper_funcs import NODE_SETTINGS
+from node_tools.helper_funcs import find_ipv4_iface
+from node_tools.trie_funcs import NetTrie
+from node_tools.trie_funcs import StateTrie
+from node_tools.trie_funcs import cleanup_state_tries
+from node_tools.trie_funcs import find_orphans
+from node_tools.trie_funcs import get_bootstrap_list
+from node_tools.trie_funcs import get_neighbor_ids
+from node_tools.trie_funcs import load_id_trie
+
+
+logging.disable(logging.WARNING)
+
+ctlr_id = 'beafde52b4'
+
+
+def gen_net_data(net_id, netcfg):
+    """
+    Network payload with the routes set by bootstrap_mbr_node.
+    """
+    gw_ip = find_ipv4_iface(netcfg.gateway[0])
+    routes = [{'target': netcfg.net_routes[0]['target'], 'via': None},
+              {'target': '0.0.0.0/0', 'via': gw_ip}]
+    return {'id': net_id, 'nwid': net_id, 'objtype': 'network', 'revision': 2,
+            'routes': routes, 'private': True}
+
+
+def gen_mbr_data(net_id, node_id, addr):
+    """
+    Member payload with a bare IPv4 address (as returned by the API).
+    """
+    return {'id': node_id, 'address': node_id, 'nwid': net_id, 'objtype': 'member',
+            'authorized': True, 'ipAssignments': [find_ipv4_iface(addr)],
+            'revision': 3}
+
+
+def gen_ring_state(size, closed=False):
+    """
+    Generate the net/id tries for an exit node plus (size - 1) member
+    nodes.  Each node is the gateway on its own (src) net and a host on
+    the src net of its upstream neighbor.  An open chain leaves the tail
+    net dangling; a closed ring links the head to the tail net and
+    leaves the exit net dangling.
+    :return: tuple of net_trie, id_trie, node/net lists, load_id_trie time
+    """
+    net_trie = NetTrie(string.hexdigits)
+    id_trie = StateTrie(string.hexdigits)
+    nodes = ['{:010x}'.format(x + 1) for x in range(size)]
+    nets = [ctlr_id + '{:06x}'.format(x) for x in range(size)]
+    subnets = ipaddress.ip_network('172.16.0.0/12').subnets(new_prefix=30)
+    netcfgs = [ipnet_get_netcfg(x) for x in itertools.islice(subnets, size)]
+    NODE_SETTINGS['use_exitnode'] = [nodes[0]]
+
+    links = [(nodes[x], x - 1) for x in range(1, size)]
+    if closed and size > 3:
+        links[0] = (nodes[1], size - 1)
+    for idx, node_id in enumerate(nodes):
+        net_trie[nets[idx]] = gen_net_data(nets[idx], netcfgs[idx])
+        net_trie[nets[idx] + node_id] = gen_mbr_data(nets[idx], node_id, netcfgs[idx].gateway[0])
+    for node_id, up_idx in links:
+        net_trie[nets[up_idx] + node_id] = gen_mbr_data(nets[up_idx], node_id,
+                                                        netcfgs[up_idx].host[0])
+
+    start = time.perf_counter()
+    for net_id in nets:
+        load_id_trie(net_trie, id_trie, [net_id], [], nw=True)
+    for node_id in nodes:
+        load_id_trie(net_trie, id_trie, [], [node_id])
+    load_time = time.perf_counter() - start
+
+    return net_trie, id_trie, nodes, nets, load_time
+
+
+def time_calls(func, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        func(*args)
+    return time.perf_counter() - start
+
+
+def result(topo, size, op, calls, total):
+    return {'topology': topo,
+            'nodes': size,
+            'op': op,
+            'calls': calls,
+            'total_sec': round(total, 6),
+            'per_call_usec': round(total / max(calls, 1) * 1e6, 3)}
+
+
+def run_bench(size, closed, sample):
+    topo = 'ring' if closed else 'chain'
+    net_trie, id_trie, nodes, nets, load_time = gen_ring_state(size, closed)
+    results = [result(topo, size, 'load_id_trie', size * 2, load_time)]
+    picks = random.sample(nodes, min(sample, size))
+
+    total = time_calls(get_neighbor_ids, [(net_trie, x) for x in picks])
+    results.append(result(topo, size, 'get_neighbor_ids', len(picks), total))
+
+    start = time.perf_counter()
+    boot_list = get_bootstrap_list(net_trie, id_trie)
+    results.append(result(topo, size, 'get_bootstrap_list', 1, time.perf_counter() - start))
+    assert len(boot_list) == (0 if closed and size > 3 else size - 1)
+
+    start = time.perf_counter()
+    orphans = find_orphans(net_trie, id_trie)
+    results.append(result(topo, size, 'find_orphans', 1, time.perf_counter() - start))
+    assert orphans == ([], [])
+
+    tails = list(zip(nets, nodes))[-min(sample, size - 1):]
+    total = time_calls(cleanup_state_tries, [(net_trie, id_trie, net_id, node_id)
+                                             for net_id, node_id in tails])
+    results.append(result(topo, size, 'cleanup_state_tries', len(tails), total))
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ctlr trie scale benchmarks')
+    parser.add_argument('-s', '--sizes', type=int, nargs='+',
+                        default=[100, 1000, 10000, 100000])
+    parser.add_argument('-n', '--sample', type=int, default=500,
+                        help='number of calls for per-node ops')
+    parser.add_argument('-o', '--output', help='write JSON results to file')
+    args = parser.parse_args()
+
+    random.seed(42)
+    results = []
+    for size in args.sizes:
+        for closed in [False, True]:
+            results.extend(run_bench(size, closed, args.sample))
+
+    report = {'meta': {'python': platform.python_version(),
+                       'machine': platform.machine(),
+                       'date': datetime.datetime.now().isoformat(timespec='seconds'),
+                       'sample': args.sample},
+              'results': results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    print(output)
+
+
+if __name__ == '__main__':
+    main()